@@ -9,27 +9,301 @@ Research group Pain Perception
 Date: 26th May 2021
 """
 
+import numpy as np
 import serial
+import threading
+import time
+from contextlib import contextmanager
+
+
+# '\r' + 'xxx?xxx?xxx?xxx?xxx?xxx' with '?' = sign '+' ou '-'
+FRAME_LEN = 24
+# how many streamed samples to keep (10 min @100Hz)
+STREAM_BUFFER_SIZE = 60000
+# serial read timeout of the streaming thread in s
+STREAM_READ_TIMEOUT = 0.05
+# time between two streamed frames during stimulation (100Hz) in s
+STREAM_FRAME_SEC = 0.01
+# get_temperatures() in streaming mode ignores samples older than that (s)
+STREAM_SAMPLE_MAX_AGE = 5 * STREAM_FRAME_SEC
+# handshake: the answer to 'H' is over when the TCS is silent for that long (s)
+HANDSHAKE_INTERBYTE_TIMEOUT = 0.05
+# handshake: never wait longer than that (s)
+HANDSHAKE_TIMEOUT = 2
+# initial size of the batch buffer (a full trial setup is ~130 bytes)
+TX_BUFFER_SIZE = 256
+
+
+# parameters set per zone: letter: (min, max, scale, digits)
+ZONE_PARAMS = {
+    b'D': (0.001, 99.999, 1000, 5),     # durations in s
+    b'V': (0.1, 300, 10, 4),            # ramp up speeds in °C/s
+    b'R': (0.1, 300, 10, 4),            # ramp down speeds in °C/s
+    b'C': (0.1, 60, 10, 3),             # target temperatures in °C
+}
+
+
+def clamp_zone_values(letter, values):
+    """
+    clamps the values of all 5 zones in place to the range the TCS accepts
+    :param letter: command letter (b'D', b'V', b'R' or b'C')
+    :param values: array of 5 values
+    """
+    low, high = ZONE_PARAMS[letter][:2]
+    for i in range(5):
+        if values[i] > high:
+            values[i] = high
+        if values[i] < low:
+            values[i] = low
+
+
+def encode_zone_value(letter, value):
+    """
+    :return: the integer the TCS expects for a clamped value
+    """
+    return int(value*ZONE_PARAMS[letter][2])
+
+
+def zone_command(letter, zone, encoded):
+    """
+    :param zone: 1 to 5 or 0 for all zones
+    :param encoded: value from encode_zone_value()
+    :return: command bytes, e.g. b'C1510'
+    """
+    return b'%s%d%0*d' % (letter, zone, ZONE_PARAMS[letter][3], encoded)
+
+
+# a frame viewed as 6 rows of 4 bytes is '\r' or sign + 3 digits 
+# for neutral, t1 to t5
+_DIGIT_WEIGHTS = np.array([100, 10, 1], dtype=np.int16)
+# sign byte -> factor
+_SIGN_FACTOR = np.ones(256, dtype=np.int16)
+_SIGN_FACTOR[ord('-')] = -1
+
+
+class FrameDecoder:
+    """
+    decodes single temperature frames into a preallocated int16 row
+    (neutral, t1 to t5 in 0.1°C) without building Python floats or lists
+    """
+    def __init__(self):
+        self._digits = np.empty((6, 3), dtype=np.uint8)
+        self._signs = np.empty(5, dtype=np.int16)
+
+    def decode(self, data, out):
+        """
+        :param data: bytes-like object with one frame, 
+            '\r' + 'xxx?xxx?xxx?xxx?xxx?xxx' with '?' = sign '+' ou '-'
+        :param out: C-contiguous int16 array of 6 values, filled in place
+        :return: True if the frame could be decoded
+        """
+        if len(data) < FRAME_LEN:
+            return False
+        frame = np.frombuffer(data, dtype=np.uint8, count=FRAME_LEN)
+        frame = frame.reshape(6, 4)
+        np.subtract(frame[:, 1:], 48, out=self._digits)
+        if not _valid_frames(frame, self._digits):
+            return False
+        np.dot(self._digits, _DIGIT_WEIGHTS, out=out)
+        np.take(_SIGN_FACTOR, frame[1:, 0], out=self._signs)
+        np.multiply(out[1:], self._signs, out=out[1:])
+        return True
+
+
+def baseline_commands(baselineTemp, sent, force=False):
+    """
+    clamps the baseline temperature (min 20°C, max 40°C) and builds the
+    command unless this value was sent already
+    :param sent: dict of the values sent so far, updated
+    :return: list of command bytes (empty if nothing needs to be sent)
+    """
+    if baselineTemp > 40:
+        baselineTemp = 40
+    if baselineTemp < 20:
+        baselineTemp = 20   
+    value = int(baselineTemp*10)
+    if not force and sent.get((b'N', 0)) == value:
+        return []
+    sent[(b'N', 0)] = value
+    return [b'N%03d' % value]
+
+
+def zone_commands(letter, values, sent, force=False):
+    """
+    clamps one parameter for all 5 zones (in place) and builds the commands
+    for the zones whose value differs from the last sent one
+    :param letter: command letter (b'D', b'V', b'R' or b'C')
+    :param values: array of 5 values
+    :param sent: dict (letter, zone) -> last sent value, updated
+    :param force: build the commands for all zones
+    :return: list of command bytes (empty if nothing needs to be sent)
+    """
+    clamp_zone_values(letter, values)
+    encoded = [encode_zone_value(letter, values[i]) for i in range(5)]
+    if force:
+        changed = [0, 1, 2, 3, 4]
+    else:
+        changed = [i for i in range(5)
+                   if sent.get((letter, i+1)) != encoded[i]]
+    for i in range(5):
+        sent[(letter, i+1)] = encoded[i]
+    if not changed:
+        return []
+    # check if values are equal
+    if len(changed) > 1 and encoded.count(encoded[0]) == len(encoded):
+        # yes: send all values in one command
+        return [zone_command(letter, 0, encoded[0])]
+    # no: send changed values in separate commands
+    return [zone_command(letter, i+1, encoded[i]) for i in changed]
+
+
+def parse_banner(banner):
+    """
+    :param banner: answer to 'H', see TcsDevice._read_banner()
+    :return: (firmware, id_msg) as bytes; the first two lines, the help
+        text follows them, or fixed slices if the banner has no lines
+    """
+    lines = [bytes(line.strip()) for line in banner.splitlines()
+             if line.strip()]
+    if len(lines) >= 2:
+        return lines[0], lines[1]
+    return bytes(banner[:30]), bytes(banner[30:60])
+
+
+def _valid_frames(frames, digits):
+    """
+    the checks of FrameDecoder and parse_stream()
+    :param frames: uint8 array (6, 4) of one frame or (n, 6, 4)
+    :param digits: the digit bytes of frames - 48, (6, 3) or (n, 6, 3)
+    :return: bool, or bool array (n,): starts with '\r' and has only digits
+    """
+    # anything that is not a digit wraps around to > 9
+    return (digits <= 9).all(axis=(-2, -1)) & (frames[..., 0, 0] == 13)
+
+
+def _decode_frames(frames):
+    """
+    :param frames: uint8 array (n, 24)
+    :return: int16 array (n, 6) and bool array (n,) of valid frames
+    """
+    frames = frames.reshape(-1, 6, 4)
+    digits = frames[:, :, 1:] - np.uint8(48)
+    valid = _valid_frames(frames, digits)
+    values = digits @ _DIGIT_WEIGHTS
+    values[:, 1:] *= _SIGN_FACTOR[frames[:, 1:, 0]]
+    return values, valid
+
+
+def parse_stream(data):
+    """
+    finds and decodes all complete frames in a byte stream, e.g. a capture
+    of the serial line with answers to 'E' or temperatures streamed by the TCS
+    bytes between frames are skipped
+    :param data: bytes-like object
+    :return: (int16 array (n, 6) with neutral, t1 to t5 in 0.1°C, 
+        number of bytes consumed - the rest starts with an incomplete frame)
+    """
+    raw = np.frombuffer(data, dtype=np.uint8)
+    starts = np.flatnonzero(raw == 13)
+    incomplete = starts[starts + FRAME_LEN > raw.size]
+    consumed = int(incomplete[0]) if incomplete.size else raw.size
+    starts = starts[starts + FRAME_LEN <= raw.size]
+    frames = raw[starts[:, None] + np.arange(FRAME_LEN)]
+    values, valid = _decode_frames(frames)
+    return values[valid], consumed
+
+
+def parse_capture(path):
+    """
+    batch entry point for offline parsing of a captured byte stream
+    :param path: file with the raw bytes read from the TCS
+    :return: float32 array (n, 6) with neutral, t1 to t5 in °C
+    """
+    with open(path, 'rb') as f:
+        values, consumed = parse_stream(f.read())
+    return to_celsius(values)
+
+
+def to_celsius(values):
+    """
+    :param values: int16 array in 0.1°C
+    :return: float32 array in °C
+    """
+    return values / np.float32(10)
+
+
+def frame_times(now, n, previous=None):
+    """
+    frames read together arrived over time: the last one at now, the ones
+    before it one frame period apart, never before the previous sample so
+    that the times stay sorted
+    :param now: time.perf_counter() when the frames were read
+    :param n: number of frames read
+    :param previous: time of the sample before them, None if there is none
+    :return: float64 array (n,) of arrival times, oldest first
+    """
+    times = now - STREAM_FRAME_SEC * np.arange(n - 1, -1, -1)
+    if previous is not None:
+        np.maximum(times, previous, out=times)
+    return times
 
 
 class TcsDevice:
     def __init__(self, port='/dev/ttyACM0'):
         # some initial parameters
         self.baseline = 30.0
+        # streaming state (see start_streaming)
+        self._stream_thread = None
+        self._stream_stop = threading.Event()
+        self._stream_lock = threading.Lock()
+        self._alloc_stream_buffer(STREAM_BUFFER_SIZE)
+        # polling: decode the answer to 'E' into a preallocated row
+        self._decoder = FrameDecoder()
+        self._frame = np.zeros(6, dtype=np.int16)
+        # neutral temperature in °C reported with the last polled frame
+        self.neutral = None
+        # last value sent for each (command letter, zone), see invalidate()
+        self._sent = {}
+        # commands collected inside batch()
+        self._tx_buffer = bytearray(TX_BUFFER_SIZE)
+        self._tx_len = 0
+        self._batch_depth = 0
         # Open serial port
+        start = time.perf_counter()
         self.s_port = serial.Serial(port, 115200, timeout = 2)
         self.s_port.flushInput()
         self.s_port.write(bytes(b'H'))
-        self.s_port.flushOutput()
-        firmware_msg = self.s_port.read(30)
-        print(firmware_msg)
-        self.s_port.flushInput()
-        self.id_msg = self.s_port.read(30)
+        self.s_port.flush()
+        self.firmware, self.id_msg = parse_banner(self._read_banner())
+        print(self.firmware)
         print(self.id_msg)
         self.s_port.flushInput()
-        # read the rest
-        rest = self.s_port.read(10000)
-        self.s_port.flushInput()
+        # time in s from opening the port until the TCS is ready
+        self.connect_time = time.perf_counter() - start
+
+    def _read_banner(self):
+        """
+        reads the answer to 'H' until the TCS stops talking for
+        HANDSHAKE_INTERBYTE_TIMEOUT instead of waiting for a fixed byte count
+        :return: everything received
+        """
+        banner = bytearray()
+        deadline = time.perf_counter() + HANDSHAKE_TIMEOUT
+        # the first byte may take a while
+        banner += self.s_port.read(1)
+        if not banner:
+            return banner
+        timeout = self.s_port.timeout
+        self.s_port.timeout = HANDSHAKE_INTERBYTE_TIMEOUT
+        try:
+            while time.perf_counter() < deadline:
+                chunk = self.s_port.read(self.s_port.in_waiting or 1)
+                if not chunk:
+                    break
+                banner += chunk
+        finally:
+            self.s_port.timeout = timeout
+        return banner
 
     def set_quiet(self):
         """
@@ -38,164 +312,307 @@ class TcsDevice:
         (@1Hz if no stimulation, @100Hz during stimulation)
         and that can corrupt dialog between PC and TCS
         """
-        self.s_port.write(bytes(b'F'))
-        self.s_port.flushOutput()
+        self._send(b'F')
     
     
-    def set_baseline(self, baselineTemp):
+    def set_baseline(self, baselineTemp, force=False):
         """
         sets baseline temperature in °C (also called neutral temperature)
         :param baselineTemp: 1 float value (min 20°C, max 40°C)
+        :param force: send even if this value was already sent
         """
-        if baselineTemp > 40:
-            baselineTemp = 40
-        if baselineTemp < 20:
-            baselineTemp = 20   
-        command = b'N%03d' % (baselineTemp*10)
-        self.s_port.write(bytes(command))
-        self.s_port.flushOutput()
+        for command in baseline_commands(baselineTemp, self._sent, force):
+            self._send(command)
         # self.adjust_to_skin()
 
     def adjust_to_skin(self):
         """
         adjusts baseline to the skin
         """
-        self.s_port.write(bytes(b'G'))
-        self.s_port.flushOutput()
+        self._send(b'G')
+        # the TCS picks the new baseline itself
+        self._sent.pop((b'N', 0), None)
     
     
-    def set_durations(self, stimDurations):
+    def set_durations(self, stimDurations, force=False):
         """
         sets stimulus durations in s for all 5 zones
         :param stimDurations: array of 5 values (min 0.001s, max 99.999s)
+        :param force: send even if these values were already sent
         """
-        for i in range(5):
-            if stimDurations[i] > 99.999:
-                stimDurations[i] = 99.999
-            if stimDurations[i] < 0.001:
-                stimDurations[i] = 0.001
-        # check if speeds are equal
-        if stimDurations.count(stimDurations[0]) == len(stimDurations):
-            # yes: send all speeds in one command
-            command = b'D0%05d' % (stimDurations[1]*1000)
-            self.s_port.write(bytes(command))
-            self.s_port.flushOutput()
-        else:       
-            # no: send speeds in separate commands
-            for i in range(5):
-                command = b'D%d%05d' % ((i+1) , (stimDurations[i]*1000))
-                self.s_port.write(bytes(command))
-                self.s_port.flushOutput()
+        self._set_zone_values(b'D', stimDurations, force)
     
     
-    def set_ramp_speed(self, rampSpeeds):
+    def set_ramp_speed(self, rampSpeeds, force=False):
         """
         sets ramp up speeds in °C/s for all 5 zones
         :param rampSpeeds: array of 5 values (min 0.1°C/s, max 300°C/s)
+        :param force: send even if these values were already sent
         """
-        for i in range(5):
-            if rampSpeeds[i] > 300:
-                rampSpeeds[i] = 300
-            if rampSpeeds[i] < 0.1:
-                rampSpeeds[i] = 0.1
-        
-        # check if speeds are equal
-        if rampSpeeds.count(rampSpeeds[0]) == len(rampSpeeds):
-            # yes: send all speeds in one command
-            command = b'V0%04d' % (rampSpeeds[1]*10)
-            self.s_port.write(bytes(command))
-            self.s_port.flushOutput()
-        else:        
-            # no: send speeds in separate commands
-            for i in range(5):
-                command = b'V%d%04d' % ((i+1), (rampSpeeds[i]*10))
-                self.s_port.write(bytes(command))
-                self.s_port.flushOutput()
+        self._set_zone_values(b'V', rampSpeeds, force)
     
-    def set_return_speed(self, returnSpeeds):
+    def set_return_speed(self, returnSpeeds, force=False):
         """
         sets ramp down/ return speeds in °C/s for all 5 zones
         :param returnSpeeds: array of 5 values (min 0.1°C/s, max 300°C/s)
+        :param force: send even if these values were already sent
         """
-        for i in range(5):
-            if returnSpeeds[i] > 300:
-                returnSpeeds[i] = 300
-            if returnSpeeds[i] < 0.1:
-                returnSpeeds[i] = 0.1
-        
-        # check if speeds are equal
-        if returnSpeeds.count(returnSpeeds[0]) == len(returnSpeeds):
-            # yes: send all speeds in one command
-            command = b'R0%04d' % (returnSpeeds[1]*10)
-            self.s_port.write(bytes(command))
-            self.s_port.flushOutput()
-        else:        
-            # no: send speeds in separate commands
-            for i in range(5):
-                command = b'R%d%04d' % ((i+1), (returnSpeeds[i]*10))
-                self.s_port.write(bytes(command))
-                self.s_port.flushOutput()
+        self._set_zone_values(b'R', returnSpeeds, force)
     
     
-    def set_temperatures(self, temperatures):
+    def set_temperatures(self, temperatures, force=False):
         """
         sets target temperatures in °C for all 5 zones
         :param temperatures: array of 5 values (min 0.1°C, max 60°C)
+        :param force: send even if these values were already sent
         """
-        for i in range(5):
-            if temperatures[i] > 60:
-                temperatures[i] = 60
-            if temperatures[i] < 0.1:
-                temperatures[i] = 0.1
-        
-        # check if temperatures are equal
-        if temperatures.count(temperatures[0]) == len(temperatures):
-            # yes: send all speeds in one command
-            command = b'C0%03d' % (temperatures[1]*10)
-            self.s_port.write(bytes(command))
-            self.s_port.flushOutput()
-        else:        
-            # no: send speeds in separate commands
-            for i in range(5):
-                command = b'C%d%03d' % ((i+1), (temperatures[i]*10))
-                self.s_port.write(bytes(command))
-                self.s_port.flushOutput()
+        self._set_zone_values(b'C', temperatures, force)
     
     
-    def stimulate(self):
+    def invalidate(self):
         """
-        starts the stimulation protocol with the parameters that have been set
+        forgets all values sent so far, so that the next call of each
+        setter reaches the TCS again
+        use it when the device state is unknown (e.g. after it was 
+        used by another program or reset)
         """
-        self.s_port.write(bytes(b'L'))
+        self._sent.clear()
     
     
+    def _set_zone_values(self, letter, values, force):
+        for command in zone_commands(letter, values, self._sent, force):
+            self._send(command)
     
+    
+    @contextmanager
+    def batch(self):
+        """
+        collects the commands of all setters called inside
+            with dev.batch():
+                dev.set_durations(...)
+                dev.set_temperatures(...)
+        and sends them in a single write when the block ends
+        batches can be nested, only the outermost one sends
+        if the block raises nothing is sent
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        except BaseException:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._tx_len = 0
+                # the setters already cached values that were never sent
+                self.invalidate()
+            raise
+        self._batch_depth -= 1
+        if self._batch_depth == 0:
+            self._commit()
+    
+    
+    def _commit(self):
+        if self._tx_len == 0:
+            return
+        data = memoryview(self._tx_buffer)[:self._tx_len]
+        self._tx_len = 0
+        try:
+            self.s_port.write(data)
+            self.s_port.flush()
+        except Exception:
+            self.invalidate()
+            raise
+        finally:
+            data.release()
+    
+    
+    def _send(self, command, flush=True):
+        if self._batch_depth > 0:
+            # queue the command, it is sent by batch()
+            end = self._tx_len + len(command)
+            if end > len(self._tx_buffer):
+                self._tx_buffer.extend(bytes(end - len(self._tx_buffer)))
+            self._tx_buffer[self._tx_len:end] = command
+            self._tx_len = end
+            return
+        try:
+            self.s_port.write(bytes(command))
+            if flush:
+                self.s_port.flush()
+        except Exception:
+            # we don't know what reached the TCS
+            self.invalidate()
+            raise
+    
+    
+    def stimulate(self):
+        """
+        starts the stimulation protocol with the parameters that have been set
+        """
+        self._send(b'L', flush=False)
+
+
+    def abort_to_baseline(self, baselineTemp):
+        """
+        safety stop: sends neutral and all targets at baselineTemp and
+        starts a new stimulation to them, in one write; the new stimulation
+        replaces the running one, so hot zones ramp down right away
+        :param baselineTemp: temperature in °C
+        """
+        with self.batch():
+            self.set_baseline(baselineTemp, force=True)
+            self.set_temperatures([baselineTemp]*5, force=True)
+            self.stimulate()
+
+
     def get_temperatures(self):
         """
         get current temperatures of zone 1 to 5 in °C
+        in streaming mode the latest streamed sample is returned
+        without asking the TCS, once, and only if it is not older than
+        STREAM_SAMPLE_MAX_AGE (the TCS streams @1Hz when not stimulating)
         :return: returns an array of five temperatures or empty array if 
-            there is an error
+            there is an error or no new streamed sample
         """
+        if self.is_streaming():
+            with self._stream_lock:
+                count = self._stream_count
+                if count == self._stream_returned:
+                    return []
+                self._stream_returned = count
+            sample = self.get_latest_sample()
+            if time.perf_counter() - sample[0] > STREAM_SAMPLE_MAX_AGE:
+                return []
+            return list(sample[1])
         self.s_port.flushInput()
         self.s_port.write(bytes(b'E'))
-        self.s_port.flushOutput()
+        self.s_port.flush()
         # '/r' + 'xxx?xxx?xxx?xxx?xxx?xxx' with '?' = sign '+' ou '-'
         # neutral + t1 to t5
-        data = self.s_port.read(24)
-        temperatures = [0, 0, 0, 0, 0]
-        if len(data) > 23:
-            neutral = float(data[2:4])
-            temperatures[0] = float(data[5:8]) / 10
-            temperatures[1] = float(data[9:12]) / 10
-            temperatures[2] = float(data[13:16]) / 10
-            temperatures[3] = float(data[17:20]) / 10
-            temperatures[4] = float(data[21:24]) / 10
-        else:
-            temperatures = []
-        return temperatures
+        data = self.s_port.read(FRAME_LEN)
+        if not self._decoder.decode(data, self._frame):
+            return []
+        self.neutral = self._frame[0] / 10
+        return (self._frame[1:] / 10).tolist()
+    
+    
+    def start_streaming(self, buffer_size=STREAM_BUFFER_SIZE):
+        """
+        starts a background thread that reads the temperatures the TCS sends
+        by itself (@1Hz if no stimulation, @100Hz during stimulation)
+        the samples are kept in a ring buffer together with the time 
+        (time.perf_counter()) at which they arrived
+        do not call set_quiet() when using this mode
+        :param buffer_size: max number of samples kept in the ring buffer
+        """
+        if self.is_streaming():
+            return
+        with self._stream_lock:
+            self._alloc_stream_buffer(buffer_size)
+        # don't block the reader for long so that it can be stopped
+        self._saved_timeout = self.s_port.timeout
+        self.s_port.timeout = STREAM_READ_TIMEOUT
+        self.s_port.flushInput()
+        self._stream_stop.clear()
+        self._stream_thread = threading.Thread(target=self._stream_loop,
+                                               name="TcsStreamReader",
+                                               daemon=True)
+        self._stream_thread.start()
+    
+    
+    def stop_streaming(self):
+        """
+        stops the background reader started with start_streaming()
+        the samples already read stay available
+        """
+        if self._stream_thread is None:
+            return
+        self._stream_stop.set()
+        self._stream_thread.join()
+        self._stream_thread = None
+        self.s_port.timeout = self._saved_timeout
+    
+    
+    def is_streaming(self):
+        return self._stream_thread is not None
+    
+    
+    def get_latest_sample(self):
+        """
+        :return: (time, [t1, t2, t3, t4, t5]) of the latest streamed sample
+            or None if nothing was received yet
+        """
+        with self._stream_lock:
+            if self._stream_count == 0:
+                return None
+            i = (self._stream_count - 1) % len(self._stream_times)
+            return (float(self._stream_times[i]), 
+                    (self._stream_values[i, 1:] / 10).tolist())
+    
+    
+    def get_samples_since(self, since):
+        """
+        :param since: time.perf_counter() value
+        :return: (times, temperatures) received after since, oldest first
+            times: float64 array (n,)
+            temperatures: float32 array (n, 5) with t1 to t5 in °C
+        """
+        with self._stream_lock:
+            size = len(self._stream_times)
+            n = min(self._stream_count, size)
+            idx = np.arange(self._stream_count - n, self._stream_count) % size
+            times = self._stream_times[idx]
+            first = np.searchsorted(times, since, side='right')
+            idx = idx[first:]
+            temperatures = to_celsius(self._stream_values[idx, 1:])
+        return times[first:], temperatures
+    
+    
+    def _alloc_stream_buffer(self, size):
+        # ring buffer: arrival times and neutral, t1 to t5 in 0.1°C
+        self._stream_times = np.zeros(size, dtype=np.float64)
+        self._stream_values = np.zeros((size, 6), dtype=np.int16)
+        # number of samples written so far
+        self._stream_count = 0
+        # _stream_count at the last get_temperatures()
+        self._stream_returned = 0
+    
+    
+    def _stream_loop(self):
+        # frames are not terminated, so we look for the leading '\r'
+        # and keep an incomplete frame until the rest arrives
+        buffer = bytearray()
+        while not self._stream_stop.is_set():
+            try:
+                chunk = self.s_port.read(self.s_port.in_waiting or 1)
+            except (serial.SerialException, OSError, TypeError):
+                # port was closed under our feet
+                break
+            if not chunk:
+                continue
+            now = time.perf_counter()
+            buffer += chunk
+            values, consumed = parse_stream(buffer)
+            del buffer[:consumed]
+            if len(values):
+                self._append_samples(now, values)
+    
+    
+    def _append_samples(self, now, values):
+        with self._stream_lock:
+            size = len(self._stream_times)
+            previous = None
+            if self._stream_count:
+                previous = self._stream_times[(self._stream_count - 1) % size]
+            times = frame_times(now, len(values), previous)
+            idx = np.arange(self._stream_count, 
+                            self._stream_count + len(values)) % size
+            self._stream_times[idx] = times
+            self._stream_values[idx] = values
+            self._stream_count += len(values)
     
     
     def close(self):
+        self.stop_streaming()
         self.s_port.close()
     
     
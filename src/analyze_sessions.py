@@ -0,0 +1,404 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import csv
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import session_plan
+import temperature_store
+import live_recording
+from protocol_engine import (LOG_ROOT, THERMAL_STIMULI_LOG_FOLDER, HEAT_THRESHOLD_LOG_FOLDER,
+                             BEGIN_MARKER, END_MARKER)
+
+'''
+    Offline analysis of all sessions under _HEAT_LOGS and
+    _HEAT_SIMPLE_THRESHOLD_LOGS, one row per trial in one CSV:
+        python analyze_sessions.py [log roots ...] --output trials.csv --jobs 8
+    Sessions are found by their folder or log file and are loaded and
+    analysed in a process pool, one session per task. Samples are aligned
+    to the stimulus onset of their trial: the marker log for thermal
+    stimuli, the first sample of the recording for heat threshold.
+    Temperatures come from <session>_temperatures.bin, from
+    <session>_live.bin if the session crashed before its store was written,
+    or from the per-stimulus CSV folder of older sessions.
+    Features of the stimulated zone, computed for all trials of a session
+    at once on NaN-padded arrays:
+        time_to_target_s    first sample within TARGET_TOLERANCE of the target
+        peak_temp, peak_time_s, overshoot (peak above the target)
+        plateau_mean, plateau_sd, plateau_s: samples from reaching the
+                            target until the first one below it again
+        return_time_s       end of the plateau to the first sample within
+                            BASELINE_TOLERANCE of the baseline (the median
+                            of the other zones)
+    Times are in s from the onset, NaN if unknown or not reached while
+    recording. response_ms is the time from the question to the answer of
+    heat threshold sessions that logged it.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+# °C below the target that counts as reached
+TARGET_TOLERANCE = 0.5
+# °C above the baseline that counts as returned
+BASELINE_TOLERANCE = 0.5
+# old sessions did not log it
+LEGACY_BASELINE_TEMP = 32.0
+OUTPUT_NAME = "trials.csv"
+META_COLUMNS = ["task", "subject", "session", "date", "trial", "marker", "zone",
+                "target_temp", "baseline_temp", "onset_s", "response", "response_ms",
+                "n_samples", "source"]
+FEATURE_COLUMNS = ["time_to_target_s", "peak_temp", "peak_time_s", "overshoot",
+                   "plateau_mean", "plateau_sd", "plateau_s", "return_time_s"]
+COLUMNS = META_COLUMNS + FEATURE_COLUMNS
+
+
+def find_sessions(roots):
+    """
+    :param roots: folders that contain _HEAT_LOGS and/or _HEAT_SIMPLE_THRESHOLD_LOGS
+    :return: list of (task, path): session folders and heat threshold log files
+    """
+    sessions = []
+    for root in roots:
+        for path in sorted(glob.glob(os.path.join(root, THERMAL_STIMULI_LOG_FOLDER, "*", ""))):
+            path = path.rstrip(os.sep)
+            if os.path.exists(os.path.join(path, os.path.basename(path)+".txt")):
+                sessions.append(("thermal_stimuli", path))
+        for path in sorted(glob.glob(os.path.join(root, HEAT_THRESHOLD_LOG_FOLDER, "*.txt"))):
+            sessions.append(("heat_threshold", path))
+    return sessions
+
+
+def split_name(prefix):
+    """
+    :param prefix: <subject>_<session>_<year>_<month>_<day>_<hour>_<min>_<sec>
+    :return: (subject, session, date)
+    """
+    parts = prefix.rsplit("_", 7)
+    if len(parts) < 8:
+        return prefix, "", ""
+    return parts[0], parts[1], "_".join(parts[2:])
+
+
+def load_samples(prefix_path):
+    """
+    :param prefix_path: session path without the suffixes
+    :return: (samples, index, source) as temperature_store.load_session(), None if there is no file
+    """
+    store_path = prefix_path+"_temperatures"+temperature_store.FILE_EXTENSION
+    live_path = prefix_path+"_live"+live_recording.FILE_EXTENSION
+    samples, index, source = None, {}, "none"
+    if os.path.exists(store_path):
+        samples, index = temperature_store.load_session(store_path)
+        source = "store"
+    if os.path.exists(live_path):
+        reader = live_recording.LiveReader(live_path)
+        rows = reader.rows()
+        # a crash: the live file has trials the store did not get
+        if samples is None or len(rows) > len(samples):
+            samples = live_recording.to_samples(rows)
+            index = {}
+            for trial in np.unique(samples["trial"]):
+                rows_of_trial = np.flatnonzero(samples["trial"] == trial)
+                index[int(trial)] = slice(rows_of_trial[0], rows_of_trial[-1] + 1)
+            source = "live"
+    return samples, index, source
+
+
+def read_marker_log(path):
+    """
+    :return: list of (onset in s from the begin marker, date, marker) of the stimuli
+    """
+    with open(path) as f:
+        rows = [line.strip().split(",") for line in f if line.strip()]
+    rows = [row for row in rows[1:] if len(row) == 3]
+    begin = next((float(row[0]) for row in rows if int(row[2]) == BEGIN_MARKER), None)
+    stimuli = []
+    for ms, date, marker in rows:
+        if int(marker) in (BEGIN_MARKER, END_MARKER):
+            continue
+        onset = (float(ms) - begin) / 1000 if begin is not None else float("nan")
+        stimuli.append((onset, date, int(marker)))
+    return stimuli
+
+
+def read_legacy_csvs(folder, stimuli):
+    """
+    old sessions: one CSV per stimulus, named by the date at the end of the
+    recording; each file goes to the last marker logged at or before it
+    :return: dict trial -> (times or NaN, temperatures)
+    """
+    trials = {}
+    dates = [date for onset, date, marker in stimuli]
+    for path in sorted(glob.glob(os.path.join(folder, "*.csv"))):
+        end_date = os.path.splitext(os.path.basename(path))[0]
+        trial = int(np.searchsorted(dates, end_date, side="right"))
+        if trial == 0:
+            continue
+        with open(path) as f:
+            header = f.readline().strip().split(",")
+        data = np.loadtxt(path, delimiter=",", skiprows=1, ndmin=2)
+        if "time_s" in header:
+            times, temps = data[:, header.index("time_s")], data[:, -temperature_store.ZONES:]
+        else:
+            times, temps = np.full(len(data), np.nan), data[:, -temperature_store.ZONES:]
+        trials[trial] = (times, temps)
+    return trials
+
+
+def thermal_stimuli_trials(path):
+    """
+    :return: list of (meta dict, times from onset, temperatures (n, 5)) per trial
+    """
+    prefix = os.path.basename(path)
+    prefix_path = os.path.join(path, prefix)
+    subject, session, date = split_name(prefix)
+    stimuli = read_marker_log(prefix_path+".txt")
+    plan = None
+    if os.path.exists(prefix_path+"_plan.csv"):
+        plan, seed = session_plan.load_plan(prefix_path+"_plan.csv")
+    samples, index, source = load_samples(prefix_path)
+    legacy = {}
+    if samples is None:
+        folders = glob.glob(prefix_path+"_temperatures_*")
+        if folders:
+            legacy = read_legacy_csvs(folders[0], stimuli)
+            source = "csv"
+    legacy_target = float("nan")
+    if legacy:
+        legacy_target = float(folders[0].rsplit("_", 1)[1])
+    trials = []
+    for number, (onset, stimulus_date, marker) in enumerate(stimuli, start=1):
+        meta = {"task": "thermal_stimuli", "subject": subject, "session": session, "date": date,
+                "trial": number, "marker": marker, "zone": marker, "onset_s": onset,
+                "response": "", "response_ms": float("nan"), "source": source}
+        if plan is not None and number <= len(plan):
+            meta["zone"] = int(plan[number-1]["zone"])
+            meta["target_temp"] = float(plan[number-1]["temperature"])
+        else:
+            meta["target_temp"] = legacy_target
+        if samples is not None and number in index:
+            rows = samples[index[number]]
+            times, temps = rows["time_s"] - onset, rows["temps"]
+        elif number in legacy:
+            times, temps = legacy[number]
+        else:
+            times, temps = np.empty(0), np.empty((0, temperature_store.ZONES))
+        trials.append((meta, times, temps))
+    return trials
+
+
+def heat_threshold_trials(path):
+    """
+    :return: list of (meta dict, times from onset, temperatures (n, 5)) per trial
+    """
+    prefix_path = os.path.splitext(path)[0]
+    subject, session, date = split_name(os.path.basename(prefix_path))
+    responses = []
+    # a response without a temperature line before it
+    temperature = float("nan")
+    with open(path) as f:
+        for line in f:
+            if line.startswith("Temperature: "):
+                temperature = float(line.split(":")[1])
+            elif line.startswith("Response: "):
+                responses.append([temperature, line.split(":")[1].strip(), float("nan")])
+            elif line.startswith("Response time: ") and responses:
+                responses[-1][2] = float(line.split(":")[1].split()[0])
+    plan = None
+    if os.path.exists(prefix_path+"_plan.csv"):
+        plan, seed = session_plan.load_plan(prefix_path+"_plan.csv")
+    samples, index, source = load_samples(prefix_path)
+    # trials with samples but no answer (stopped) are kept too
+    count = max([len(responses)] + list(index))
+    trials = []
+    for number in range(1, count + 1):
+        meta = {"task": "heat_threshold", "subject": subject, "session": session, "date": date,
+                "trial": number, "marker": "", "zone": "", "onset_s": float("nan"),
+                "response": "", "response_ms": float("nan"), "source": source,
+                "target_temp": float("nan")}
+        if number <= len(responses):
+            meta["target_temp"], meta["response"], meta["response_ms"] = responses[number-1]
+        if plan is not None and number <= len(plan):
+            meta["zone"] = int(plan[number-1]["zone"])
+            meta["marker"] = int(plan[number-1]["marker"])
+            meta["target_temp"] = float(plan[number-1]["temperature"])
+        if samples is not None and number in index:
+            rows = samples[index[number]]
+            # the recording starts with the stimulation
+            meta["onset_s"] = float(rows["time_s"][0])
+            times, temps = rows["time_s"] - rows["time_s"][0], rows["temps"]
+        else:
+            times, temps = np.empty(0), np.empty((0, temperature_store.ZONES))
+        trials.append((meta, times, temps))
+    return trials
+
+
+def pad(arrays, shape_tail=()):
+    """
+    :return: float64 array (len(arrays), longest, *shape_tail), NaN after the end of each one
+    """
+    longest = max([len(array) for array in arrays] + [1])
+    padded = np.full((len(arrays), longest) + shape_tail, np.nan)
+    for i, array in enumerate(arrays):
+        padded[i, :len(array)] = array
+    return padded
+
+
+def trial_features(times, temps, zones, targets):
+    """
+    all trials of a session at once
+    :param times: (m, n) s from onset, NaN padded
+    :param temps: (m, n, 5) °C, NaN padded
+    :param zones: (m,) stimulated zone, 0 to 4
+    :param targets: (m,) target temperature
+    :return: dict of FEATURE_COLUMNS and baseline_temp, arrays (m,)
+    """
+    m, n = times.shape
+    rows = np.arange(m)
+    columns = np.arange(n)
+    active = temps[rows[:, None], columns[None, :], zones[:, None]]
+    # the other zones stay at baseline
+    others = temps.copy()
+    others[rows[:, None], columns[None, :], zones[:, None]] = np.nan
+    others = others.reshape(m, -1)
+    has_others = ~np.isnan(others).all(axis=1)
+    baseline = np.full(m, LEGACY_BASELINE_TEMP)
+    baseline[has_others] = np.nanmedian(others[has_others], axis=1)
+
+    valid = ~np.isnan(active)
+    n_valid = valid.sum(axis=1)
+    with np.errstate(invalid="ignore"):
+        reached = active >= (targets - TARGET_TOLERANCE)[:, None]
+    has_reached = reached.any(axis=1)
+    first_reach = reached.argmax(axis=1)
+    time_to_target = np.where(has_reached, times[rows, first_reach], np.nan)
+
+    masked = np.where(valid, active, -np.inf)
+    peak_idx = masked.argmax(axis=1)
+    peak = np.where(n_valid > 0, masked[rows, peak_idx], np.nan)
+    peak_time = np.where(n_valid > 0, times[rows, peak_idx], np.nan)
+    overshoot = np.where(has_reached, np.maximum(peak - targets, 0), np.nan)
+
+    # plateau: from the first sample at target to the first one below it again
+    after = columns[None, :] >= first_reach[:, None]
+    below = after & ~reached & valid
+    has_left = below.any(axis=1)
+    plateau_end = np.where(has_left, below.argmax(axis=1), n_valid)
+    plateau = after & (columns[None, :] < plateau_end[:, None]) & has_reached[:, None]
+    count = plateau.sum(axis=1)
+    values = np.where(plateau, active, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        plateau_mean = np.where(count > 0, values.sum(axis=1) / count, np.nan)
+        squares = np.where(plateau, (active - plateau_mean[:, None])**2, 0.0)
+        plateau_sd = np.where(count > 1, np.sqrt(squares.sum(axis=1) / (count - 1)), np.nan)
+    last_plateau = np.maximum(plateau_end - 1, 0)
+    plateau_s = np.where(count > 0, times[rows, last_plateau] - time_to_target, np.nan)
+
+    with np.errstate(invalid="ignore"):
+        returned = (columns[None, :] >= plateau_end[:, None]) & valid & \
+                   (active <= (baseline + BASELINE_TOLERANCE)[:, None])
+    has_returned = returned.any(axis=1) & has_reached & has_left
+    return_time = np.where(has_returned,
+                           times[rows, returned.argmax(axis=1)] - times[rows, last_plateau], np.nan)
+    return {"baseline_temp": baseline, "time_to_target_s": time_to_target, "peak_temp": peak,
+            "peak_time_s": peak_time, "overshoot": overshoot, "plateau_mean": plateau_mean,
+            "plateau_sd": plateau_sd, "plateau_s": plateau_s, "return_time_s": return_time}
+
+
+def analyze_session(session):
+    """
+    runs in the worker processes
+    :param session: (task, path) from find_sessions()
+    :return: (path, list of rows in the order of COLUMNS, error message or None)
+    """
+    task, path = session
+    try:
+        if task == "thermal_stimuli":
+            trials = thermal_stimuli_trials(path)
+        else:
+            trials = heat_threshold_trials(path)
+        if not trials:
+            return path, [], None
+        metas = [meta for meta, times, temps in trials]
+        zones = np.array([int(meta["zone"]) - 1 if meta["zone"] != "" else 0 for meta in metas])
+        targets = np.array([meta["target_temp"] for meta in metas], dtype=np.float64)
+        features = trial_features(pad([times for meta, times, temps in trials]),
+                                  pad([temps for meta, times, temps in trials], (temperature_store.ZONES,)),
+                                  zones, targets)
+        rows = []
+        for i, (meta, times, temps) in enumerate(trials):
+            meta["n_samples"] = len(times)
+            meta["baseline_temp"] = features["baseline_temp"][i] if len(times) else float("nan")
+            rows.append([meta[name] for name in META_COLUMNS] +
+                        [features[name][i] for name in FEATURE_COLUMNS])
+        return path, rows, None
+    except Exception as e:
+        # a malformed session is reported and skipped, the others go on
+        return path, [], type(e).__name__+": "+str(e)
+
+
+def format_value(value):
+    if isinstance(value, (float, np.floating)):
+        return "" if np.isnan(value) else "%.4f" % value
+    return value
+
+
+def analyze(roots, output, jobs=None):
+    """
+    :return: (sessions, trials, errors)
+    """
+    sessions = find_sessions(roots)
+    jobs = jobs or os.cpu_count() or 1
+    trials = 0
+    errors = []
+    with open(output, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        if not sessions:
+            return 0, 0, errors
+        chunksize = max(1, len(sessions) // (jobs * 4))
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            # results come in the order of the sessions
+            for path, rows, error in pool.map(analyze_session, sessions, chunksize=chunksize):
+                if error is not None:
+                    errors.append((path, error))
+                for row in rows:
+                    writer.writerow([format_value(value) for value in row])
+                trials += len(rows)
+    return len(sessions), trials, errors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="One row per trial of all logged sessions")
+    parser.add_argument("roots", nargs="*", default=[LOG_ROOT],
+                        help="folders with _HEAT_LOGS and _HEAT_SIMPLE_THRESHOLD_LOGS")
+    parser.add_argument("--output", default=OUTPUT_NAME)
+    parser.add_argument("--jobs", type=int, default=None, help="worker processes, default all cores")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sessions, trials, errors = analyze(args.roots, args.output, args.jobs)
+    for path, error in errors:
+        print(f"Skipped {path}: {error}")
+    print(f"Sessions: {sessions}, trials: {trials}, {time.perf_counter() - start:.1f} sec -> {args.output}")
+    sys.exit(1 if errors else 0)
@@ -0,0 +1,296 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+import numpy as np
+import serial
+import TcsControl_python3 as TCS
+from protocol_engine import RAMP_SPEED, RETURN_SPEED
+
+'''
+    Benchmarks of the TCS control path.
+    By default the benchmarks run against tcs_simulator.py, so they measure
+    our side of the serial line (encoding, syscalls, parsing) and not the
+    thermode. Use --port to run them against a real device; the thermode
+    is then never told to stimulate, the stimulate and streaming
+    benchmarks only run against the simulator.
+    Reported for each TcsDevice method: latency percentiles in ms.
+    Also: connect time, cost of a full trial setup, and sustained sampling
+    throughput of the get_temperatures() loop used while recording and of
+    the streaming mode, and the import time of the GUI scripts
+    (python -X importtime, time until the settings window can be built).
+    Results are written as JSON so that releases can be compared:
+        python benchmark_tcs.py --output bench_before.json
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+REPEATS = 200
+CONNECT_REPEATS = 5
+SAMPLING_SEC = 2.0
+BASELINE_TEMP = 32.0
+TARGET_TEMP = 51.0
+TIME2APPLY_SEC = 1
+IMPORT_REPEATS = 5
+IMPORT_MODULES = ["thermal_stimuli", "heat_threshold"]
+
+
+def summarize(latencies):
+    """
+    :param latencies: list of durations in s
+    :return: dict of statistics in ms
+    """
+    ms = np.asarray(latencies) * 1000
+    return {
+        "n": int(ms.size),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "max_ms": float(ms.max()),
+    }
+
+
+def time_calls(func, repeats=REPEATS):
+    latencies = []
+    for i in range(repeats):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def trial_temperatures(i):
+    # target on a different zone each trial, like thermal_stimuli.py
+    temps = [BASELINE_TEMP]*5
+    temps[i % 5] = TARGET_TEMP
+    return temps
+
+
+def bench_connect(port):
+    latencies = []
+    reported = []
+    for i in range(CONNECT_REPEATS):
+        start = time.perf_counter()
+        device = TCS.TcsDevice(port=port)
+        latencies.append(time.perf_counter() - start)
+        reported.append(device.connect_time)
+        device.close()
+    result = summarize(latencies)
+    result["reported_connect_time"] = summarize(reported)
+    return result
+
+
+def bench_methods(device, stimulate=True):
+    """
+    :param stimulate: also time stimulate(), only against the simulator
+    """
+    results = {}
+    results["set_baseline"] = time_calls(
+        lambda i: device.set_baseline(BASELINE_TEMP, force=True))
+    results["set_durations"] = time_calls(
+        lambda i: device.set_durations([TIME2APPLY_SEC]*5, force=True))
+    results["set_ramp_speed"] = time_calls(
+        lambda i: device.set_ramp_speed(list(RAMP_SPEED), force=True))
+    results["set_return_speed"] = time_calls(
+        lambda i: device.set_return_speed(list(RETURN_SPEED), force=True))
+    results["set_temperatures"] = time_calls(
+        lambda i: device.set_temperatures(trial_temperatures(i)))
+    results["set_temperatures_cached"] = time_calls(
+        lambda i: device.set_temperatures(trial_temperatures(0)))
+    if stimulate:
+        results["stimulate"] = time_calls(lambda i: device.stimulate())
+    results["get_temperatures"] = time_calls(
+        lambda i: device.get_temperatures())
+    return results
+
+
+def bench_trial_setup(device):
+    def setup(i, force):
+        device.set_baseline(BASELINE_TEMP, force=force)
+        device.set_durations([TIME2APPLY_SEC]*5, force=force)
+        device.set_ramp_speed(list(RAMP_SPEED), force=force)
+        device.set_return_speed(list(RETURN_SPEED), force=force)
+        device.set_temperatures(trial_temperatures(i), force=force)
+
+    def batched(i):
+        with device.batch():
+            setup(i, False)
+
+    return {
+        "all_setters_forced": time_calls(lambda i: setup(i, True)),
+        "all_setters_cached": time_calls(lambda i: setup(i, False)),
+        "all_setters_batched": time_calls(batched),
+    }
+
+
+def bench_polling(device, seconds=SAMPLING_SEC):
+    # same loop as the recording in thermal_stimuli.py
+    samples = 0
+    errors = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if device.get_temperatures():
+            samples += 1
+        else:
+            errors += 1
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "samples": samples, "errors": errors,
+            "samples_per_sec": samples / elapsed}
+
+
+def bench_streaming(device, seconds=SAMPLING_SEC):
+    # the TCS streams @100Hz only while stimulating
+    device.set_durations([seconds + 1]*5, force=True)
+    device.start_streaming()
+    start = time.perf_counter()
+    device.stimulate()
+    time.sleep(seconds)
+    times, temperatures = device.get_samples_since(start)
+    device.stop_streaming()
+    device.set_quiet()
+    elapsed = time.perf_counter() - start
+    return {"seconds": elapsed, "samples": int(times.size),
+            "samples_per_sec": times.size / elapsed}
+
+
+def import_times(module):
+    """
+    imports module in a fresh interpreter with -X importtime
+    (Python 3.7+, older interpreters ignore it and only the total is measured)
+    :return: (cumulative import time of module in s or None if it failed,
+        {name: cumulative s} of the modules it imports directly)
+    """
+    code = ("import time; start = time.perf_counter(); import " + module +
+            "; print(time.perf_counter() - start)")
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    total = None
+    direct = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or not fields[1].strip().isdigit():
+            continue
+        # nested imports are indented by two spaces per level
+        name = fields[2][1:].rstrip()
+        seconds = int(fields[1]) / 1e6
+        if name == module:
+            total = seconds
+            break
+        elif name.startswith("  ") and not name.startswith("    "):
+            direct[name.strip()] = seconds
+        elif not name.startswith(" "):
+            # an import of the interpreter startup, its children are not ours
+            direct = {}
+    if process.returncode != 0:
+        return None, direct
+    if total is None:
+        total = float(process.stdout.split()[-1])
+    return total, direct
+
+
+def bench_imports(modules=IMPORT_MODULES, repeats=IMPORT_REPEATS):
+    results = {}
+    for module in modules:
+        latencies = []
+        for i in range(repeats):
+            total, direct = import_times(module)
+            if total is None:
+                break
+            latencies.append(total)
+        if not latencies:
+            results[module] = {"error": "import failed"}
+            continue
+        results[module] = summarize(latencies)
+        # heaviest direct imports of the last run
+        heaviest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:5]
+        results[module]["heaviest_ms"] = {name: t * 1000 for name, t in heaviest}
+    return results
+
+
+def run(port=None):
+    simulator = None
+    if port is None:
+        # pty based, not available on Windows
+        import tcs_simulator
+        simulator = tcs_simulator.TcsSimulator(stream=False).start()
+        port = simulator.port
+    try:
+        results = {
+            "meta": {
+                "date": datetime.now().isoformat(),
+                "python": sys.version.split()[0],
+                "platform": platform.platform(),
+                "pyserial": serial.__version__,
+                "numpy": np.__version__,
+                "target": "simulator" if simulator else port,
+            },
+        }
+        results["imports"] = bench_imports()
+        results["connect"] = bench_connect(port)
+        device = TCS.TcsDevice(port=port)
+        device.set_quiet()
+        try:
+            results["methods"] = bench_methods(device, stimulate=simulator is not None)
+            results["trial_setup"] = bench_trial_setup(device)
+            results["polling"] = bench_polling(device)
+            if simulator is not None:
+                # streaming needs the device out of quiet mode
+                simulator.quiet = False
+                results["streaming"] = bench_streaming(device)
+        finally:
+            device.close()
+    finally:
+        if simulator is not None:
+            simulator.close()
+    return results
+
+
+################################################################
+#                                                              #
+# RUN BENCHMARKS FROM MAIN                                     #
+#                                                              #
+################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TCS control path benchmarks")
+    parser.add_argument("--port", default=None,
+                        help="serial port of a real TCS (default: simulator)")
+    parser.add_argument("--output", default=None,
+                        help="JSON file for the results (default: stdout)")
+    args = parser.parse_args()
+
+    # TcsDevice prints the handshake, keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run(args.port)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
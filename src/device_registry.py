@@ -0,0 +1,115 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import threading
+import time
+import serial
+import TcsControl_python3 as TCS
+
+'''
+    Process-wide registry of open serial devices.
+    Sessions ask for a port instead of opening it, so back-to-back
+    participants reuse the open connection (and the parameters already sent
+    to the thermode) instead of paying the handshake every time.
+    Before a device is handed out again it is checked with a cheap probe
+    and reopened only if the probe fails.
+    Call close_all() when the program ends.
+'''
+
+# a streaming TCS sends at least @1Hz
+STREAM_MAX_AGE_SEC = 2.5
+
+_lock = threading.Lock()
+_tcs_devices = {}
+_serial_ports = {}
+
+
+def get_tcs(port):
+    """
+    :param port: serial port of the thermode, e.g. 'COM5'
+    :return: open TcsDevice, the same object for every caller of this port
+    """
+    with _lock:
+        device = _tcs_devices.get(port)
+        if device is not None and not tcs_is_healthy(device):
+            print(f"Reconnecting to Qst on {port}")
+            _close_quietly(device)
+            device = None
+        if device is None:
+            # remove the broken one even if the reconnect fails
+            _tcs_devices.pop(port, None)
+            device = TCS.TcsDevice(port=port)
+            _tcs_devices[port] = device
+        return device
+
+
+def get_serial(port, baudrate, timeout=2):
+    """
+    :param port: serial port, e.g. 'COM8' for the trigger box
+    :return: open serial.Serial, the same object for every caller of this port
+    """
+    with _lock:
+        ser = _serial_ports.get(port)
+        if ser is not None and not ser.is_open:
+            ser = None
+        if ser is None:
+            _serial_ports.pop(port, None)
+            ser = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+            _serial_ports[port] = ser
+        elif ser.baudrate != baudrate:
+            ser.baudrate = baudrate
+        return ser
+
+
+def tcs_is_healthy(device):
+    """
+    cheap probe: one temperature read (or a recent streamed sample)
+    """
+    try:
+        if device.is_streaming():
+            sample = device.get_latest_sample()
+            return (sample is not None and
+                    time.perf_counter() - sample[0] < STREAM_MAX_AGE_SEC)
+        return len(device.get_temperatures()) == 5
+    except Exception:
+        return False
+
+
+def close(port):
+    """
+    closes the device registered for port, if any
+    """
+    with _lock:
+        for devices in (_tcs_devices, _serial_ports):
+            device = devices.pop(port, None)
+            if device is not None:
+                _close_quietly(device)
+
+
+def close_all():
+    with _lock:
+        for devices in (_tcs_devices, _serial_ports):
+            for device in devices.values():
+                _close_quietly(device)
+            devices.clear()
+
+
+def _close_quietly(device):
+    try:
+        device.close()
+    except Exception:
+        pass
@@ -18,14 +18,15 @@
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-import pandas as pd
-import random
-import os
 import sys
 import time
-from time import strftime
-from datetime import datetime
-import TcsControl_python3 as TCS
+from session_modules import load_session_modules
+
+# imported by load_session_modules() when a session starts, see session_modules.py
+device_registry = None
+protocol_engine = None
+session_plan = None
+temperature_plot = None
 
 '''
     The program will apply thermal stimulus. 
@@ -36,6 +37,13 @@ import TcsControl_python3 as TCS
     During the session, the user will be prompted to press Space Bar to start stimulation.
     After each stimulus, the user will have to respond y or n to the displayed question.
     Current design is that each time, the program will randomly choose one of the 5 areas on the thermode.
+    The areas are planned up front from a seed (see session_plan.py), the plan is saved next to the log.
+    The session itself is protocol_engine.HeatThresholdSession, the same as
+    in run_protocol.py; this window only shows the prompts and takes the answers.
+    The window follows the state of the session (ready, stimulating, asking,
+    done): the hold is recorded in a thread and the event loop keeps running,
+    keys that do not belong to the current state are ignored, and the
+    response time is measured from the painted question to the key press.
 '''
 
 #########################################################
@@ -46,25 +54,18 @@ COM = 'COM5'
 TIME2APPLY_SEC = 1
 # First temp to apply in C
 START_TEMP = 46
-BASELINE_TEMP = 32
-# How many degrees C to go up
-STEP_UP = 1
-MAX_TEMP = 60
-LOG_FOLDER = "_HEAT_SIMPLE_THRESHOLD_LOGS"
+# temperature reads per second during the hold (10, 50 or 100)
+SAMPLE_RATE_HZ = 100
 INFO_LABEL = "Press Space Bar when ready"
 WAIT_TEXT = "+"
 QUESTION = "1 = low pain; 10 = unbearable pain\n\nWas this 4-6?\n\n\nPress Y for yes\nor N for no"
+# live temperatures for the operator at the bottom of the task window
+SHOW_PLOT = True
+PLOT_HEIGHT = 250
 
 SUBJECT_ID = "00"
 SESSION = "00"
 
-# possible start values
-ALL_TEMPS = [32,33,34,35,36,37,38,39,40,41,42,43,44,45,46,47,48,49,50,51,52,53,54,55,56,57,58,59,60]
-
-RAMP_SPEED      = [300.0]*5              # ramp up speed in °C/s for the 5 zones
-RETURN_SPEED    = [300.0]*5              # ramp down speed in °C/s for the 5 zones
-
-
 
 ########################################
 # SETTINGS CLASS
@@ -85,6 +86,8 @@ class MySettingsWidget(QMainWindow):
                                     "session": SESSION,
                                     "start_temp":START_TEMP,
                                     "hold_time":TIME2APPLY_SEC,
+                                    "seed":"",
+                                    "sample_rate":SAMPLE_RATE_HZ,
                                     "com":COM
                                 }
 
@@ -107,6 +110,10 @@ class MySettingsWidget(QMainWindow):
         self.hold_label = QLabel("Hold time (sec)")
         self.hold_text = QLineEdit(str(self.task_params_dict["hold_time"]))
         self.main_layout.addRow(self.hold_label,self.hold_text)
+        self.seed_label = QLabel("Seed (empty = random)")
+        self.seed_text = QLineEdit(self.task_params_dict["seed"])
+        self.seed_text.setValidator(QIntValidator(0, 2**31 - 1))
+        self.main_layout.addRow(self.seed_label,self.seed_text)
         self.com_label = QLabel("Device COM Port")
         self.com_text = QLineEdit(self.task_params_dict["com"])
         self.main_layout.addRow(self.com_label,self.com_text)
@@ -128,16 +135,28 @@ class MySettingsWidget(QMainWindow):
         self.task_params_dict["session"] = self.session_id_text.text()
         self.task_params_dict["com"] = self.com_text.text()
         self.hold_ok = False
+        # the possible start values are those of protocol_engine
+        load_session_modules(globals())
         try:
             self.task_params_dict["hold_time"] = int(self.hold_text.text())
             self.task_params_dict["start_temp"] = int(self.start_text.text())
-            if self.task_params_dict["start_temp"] not in ALL_TEMPS:
-                self.show_info_dialog("Temperature not allowed. Unknown speed.\nTry intigers between "+str(ALL_TEMPS[0])+" degrees and "+str(ALL_TEMPS[-1])+" degrees.")
+            if self.task_params_dict["start_temp"] not in protocol_engine.ALL_TEMPS:
+                self.show_info_dialog("Temperature not allowed. Unknown speed.\nTry intigers between "+str(protocol_engine.ALL_TEMPS[0])+" degrees and "+str(protocol_engine.ALL_TEMPS[-1])+" degrees.")
             else:
                 self.hold_ok = True
         except:
             self.show_info_dialog("Only full seconds holding time.")
         if self.hold_ok == True:
+            if self.seed_text.text().strip():
+                try:
+                    self.task_params_dict["seed"] = int(self.seed_text.text())
+                    if self.task_params_dict["seed"] < 0:
+                        raise ValueError("negative seed")
+                except ValueError:
+                    self.show_info_dialog("The seed has to be an integer of 0 or more.")
+                    return
+            else:
+                self.task_params_dict["seed"] = session_plan.new_seed()
             self.start_task()
 
     @pyqtSlot()
@@ -165,6 +184,10 @@ class MySettingsWidget(QMainWindow):
 ######################################
 
 class PresentationWidget(QMainWindow):
+    # end of the recorded hold, emitted from the recording thread
+    stimulus_done = pyqtSignal()
+    # safety stop, emitted from the thread that read the sample
+    safety_stopped = pyqtSignal()
   
     def __init__(self,params):
         super(PresentationWidget, self).__init__()
@@ -176,48 +199,29 @@ class PresentationWidget(QMainWindow):
         # changing the background color to black 
         self.setStyleSheet("background-color: black;") 
 
-        # don't allow to answer right away
-        self.ask_on = False
-        # wait for space bar to start
-        self.wait2start = True
-        
-        # set current temp Value to default 
-        self.current_temp = params["start_temp"]
-
-        self.subject_id = params["subjectID"]
-        self.session = params["session"]
         self.com = params["com"]
-        self.duration = params["hold_time"]
-        self.time_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
         # check if the com connection was possible or quit app
         # create thermode object
         try:
-            self.thermode = TCS.TcsDevice(port=self.com)
+            self.thermode = device_registry.get_tcs(self.com)
         except:
             self.show_info_dialog("Could not connect to the device.\nCheck your device COM port")
             sys.exit()
 
-
-        # configure logging
-        self.current_path = os.path.dirname(os.path.abspath(__file__))
-        self.dump_path = os.path.join(self.current_path,LOG_FOLDER)
-        try: 
-            os.mkdir(self.dump_path)
-        except:
-            pass
-        if not os.path.exists(self.dump_path):
+        # stimuli, answers and logging
+        self.engine = protocol_engine.HeatThresholdSession(params, self.thermode)
+        try:
+            self.engine.configure_logging()
+        except OSError:
             self.show_info_dialog("Your data could not be logged under default path.")
             sys.exit()
-        self.log_file_name = self.subject_id+"_"+self.session+"_"+datetime.now().strftime("%Y_%m_%d_%H_%M_%S")+".txt"
-        self.log_path = os.path.join(self.dump_path,self.log_file_name)
-
-        # log task settings
-        f = open(self.log_path, "a")
-        f.write("Subject ID: "+self.subject_id+"\n")
-        f.write("Session: "+self.session+"\n")
-        f.write("Date: "+self.time_stamp+"\n\n")
-        f.close()
+        self.engine.on_stimulus_done = self.stimulus_done.emit
+        self.stimulus_done.connect(self.show_question)
+        self.engine.on_safety_stop = self.safety_stopped.emit
+        self.safety_stopped.connect(self.show_safety_stop)
+        # set by closeEvent, a hold that ends after it shows no question
+        self.closing = False
 
         # make big label
         self.big_label_stylesheet = "QLabel {margin: 30px;font-size: 50pt;color:white}"
@@ -234,84 +238,66 @@ class PresentationWidget(QMainWindow):
         self.init_widget.setLayout(self.init_layout)
         self.main_layout.addWidget(self.init_widget)
         self.init_widget.setStyleSheet(self.big_label_stylesheet)
+        self.plot = None
+        if SHOW_PLOT:
+            self.plot = temperature_plot.TemperaturePlot()
+            self.plot.setFixedHeight(PLOT_HEIGHT)
+            self.main_layout.addWidget(self.plot)
+            self.engine.on_sample = self.plot_sample
 
 
 
     # define keypress events
     def keyPressEvent(self,event):
-        if event.key() == Qt.Key_Space and self.wait2start == True:
-            self.wait2start = False
-            self.ask_on = True
-            self.question_label.setText(WAIT_TEXT)
-            QApplication.processEvents()
-            self.apply_temp()
-        elif event.key() == Qt.Key_N and self.ask_on == True:
-            print("N")
-            self.ask_on = False
-            # log 
-            f = open(self.log_path, "a")
-            f.write("Temperature: " + str(self.current_temp)+"\n")
-            f.write("Response: N\n")
-            f.close()
-            self.current_temp += STEP_UP
-            if self.current_temp <= MAX_TEMP:
-                self.question_label.setText(WAIT_TEXT)
-                QApplication.processEvents()
-                self.apply_temp()
+        # first, for the response time
+        pressed_at = time.perf_counter()
+        state = self.engine.state
+        if event.isAutoRepeat():
+            pass
+        elif event.key() == Qt.Key_Space and state == protocol_engine.READY:
+            self.start_stimulus()
+        elif event.key() in (Qt.Key_Y, Qt.Key_N) and state == protocol_engine.ASKING:
+            if self.engine.answer(event.key() == Qt.Key_Y, pressed_at):
+                # yes, or max temp exceeded
+                self.finish()
             else:
-                # log 
-                f = open(self.log_path, "a")
-                f.write("\nMax temp exceeded: " + str(self.current_temp)+"\n")
-                f.close()
-                self.question_label.setText("Thank you")
-                QApplication.processEvents()
-        elif event.key() == Qt.Key_Y and self.ask_on == True:
-            print("Y")
-            # log 
-            f = open(self.log_path, "a")
-            f.write("Temperature: " + str(self.current_temp)+"\n")
-            f.write("Response: Y\n")
-            f.close()
-            # log 
-            f = open(self.log_path, "a")
-            f.write("\nThreshold: " + str(self.current_temp)+"\n")
-            f.close()
-            self.question_label.setText("Thank you")
-            QApplication.processEvents()
-            self.thermode.close()
-            print("Closing QST connection")
+                self.start_stimulus()
         super(PresentationWidget, self).keyPressEvent(event)
 
-    def apply_temp(self):
-        # set temp
-        temperatures = [BASELINE_TEMP,BASELINE_TEMP,BASELINE_TEMP,BASELINE_TEMP,BASELINE_TEMP]
-        current_area_idx = random.choice([0,1,2,3,4])
-        temperatures[current_area_idx] = self.current_temp
-        durations    = [self.duration]*5     # stimulation durations in s for the 5 zones
-        # send all settings for the stimuli
-        self.thermode.set_baseline(BASELINE_TEMP)
-        self.thermode.set_durations(durations)
-        self.thermode.set_ramp_speed(RAMP_SPEED)
-        self.thermode.set_return_speed(RETURN_SPEED)
-        self.thermode.set_temperatures(temperatures)
-
-        print("heating")
-        print("current temp: ", self.current_temp)
-        self.thermode.stimulate()  
-
-        # record stimulation temperatures
-        recordDuration = max(durations)+0.5
-        start_time = time.time()
-       
-        while True:
-            # current_temperatures = self.thermode.get_temperatures()
-            current_time = time.time()
-            elapsed_time = current_time - start_time
-            if elapsed_time > recordDuration:
-                self.ask_on = True
-                break
+    def plot_sample(self, elapsed_time, temperatures):
+        # from the recording thread, the plot redraws itself
+        self.plot.add_sample(temperatures)
+
+    def start_stimulus(self):
+        self.question_label.setText(WAIT_TEXT)
+        if self.plot is not None:
+            self.plot.set_overlays(self.engine.current_temp, protocol_engine.HEAT_THRESHOLD_BASELINE_TEMP)
+        # returns at once, show_question() follows at the end of the hold
+        self.engine.start_stimulus()
+
+    @pyqtSlot()
+    def show_question(self):
+        if self.engine.watchdog.tripped or self.closing:
+            # no question, see show_safety_stop()
+            return
         self.question_label.setText(QUESTION)
-        QApplication.processEvents()
+        # paint now, the response time starts when the question is shown
+        self.question_label.repaint()
+        self.engine.ask()
+
+    @pyqtSlot()
+    def show_safety_stop(self):
+        # during a hold or between them, the zones are already going to baseline
+        if self.closing:
+            return
+        self.finish()
+        self.show_info_dialog(self.engine.watchdog.message())
+
+    def finish(self):
+        self.question_label.setText("Thank you")
+        self.engine.close()
+        device_registry.close(self.com)
+        print("Closing QST connection")
 
     # show info that only ins are streamed
     def show_info_dialog(self, text):
@@ -323,8 +309,12 @@ class PresentationWidget(QMainWindow):
         msgBox.exec()
 
     def closeEvent(self, event):  
+        # the log of a session that was not finished
+        self.closing = True
+        self.engine.stop()
+        self.engine.close()
         try:
-            self.thermode.close()
+            device_registry.close(self.com)
             print("Closing QST connection")
         except:
             print("QST connection closed")
@@ -0,0 +1,214 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import time
+import numpy as np
+from temperature_store import ZONES, SCALE, SAMPLE_DTYPE
+
+'''
+    Memory-mapped recording file, written sample by sample during the session.
+    The file is preallocated for the whole session: a HEADER with the write
+    cursor, then capacity RECORD rows. append() writes the row first and
+    then moves the cursor, so everything below the cursor is complete.
+    The rows live in the page cache of the OS as soon as they are written:
+    if the program crashes (Qt, USB disconnect) they are still in the file,
+    without any write call. flush() also gets them to the disk.
+    Other processes map the same file read-only (LiveReader) and see new
+    rows as soon as the cursor moves, without copying, locks or any
+    cooperation of the writer. The writer is the only one that writes.
+    Follow a running session from a second terminal:
+        python live_recording.py <session>_live.bin
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+FILE_EXTENSION = ".bin"
+LIVE_MAGIC = b"TCSLIVE1"
+LIVE_VERSION = 1
+# 64 bytes, cursor aligned to 8 bytes so it is written in one store
+HEADER = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("zones", "<u4"),
+    ("capacity", "<u8"),
+    ("cursor", "<u8"),     # rows written
+    ("closed", "<u4"),     # 1 after close(), the session is over
+    ("reserved", "V28"),
+])
+RECORD = np.dtype([
+    ("time_s", "<f8"),          # from session start
+    ("trial", "<i4"),
+    ("marker", "<i2"),
+    ("temps", "<i2", (ZONES,)),  # 1/10 °C
+])
+# rows added to the expected number of samples
+SPARE_ROWS = 1000
+# reader poll interval of the follow mode
+POLL_SEC = 0.2
+
+
+class LiveRecording:
+    """
+    use: live = LiveRecording(path, capacity); live.append(...) for every
+         sample; live.flush() when there is time; live.close() at the end
+    """
+    def __init__(self, path, capacity):
+        """
+        :param path: created, or overwritten, with room for capacity rows
+        :param capacity: most rows of the session
+        """
+        self.path = path
+        self.capacity = int(capacity)
+        with open(path, "wb") as f:
+            f.truncate(HEADER.itemsize + self.capacity * RECORD.itemsize)
+        self._header = np.memmap(path, dtype=HEADER, mode="r+", shape=(1,))
+        self._rows = np.memmap(path, dtype=RECORD, mode="r+", offset=HEADER.itemsize,
+                               shape=(self.capacity,))
+        self._header["version"] = LIVE_VERSION
+        self._header["zones"] = ZONES
+        self._header["capacity"] = self.capacity
+        self._header["cursor"] = 0
+        # last, readers ignore the file until the header is complete
+        self._header["magic"] = LIVE_MAGIC
+        # column views, writing a field of one row through them is cheaper
+        self._times = self._rows["time_s"]
+        self._trials = self._rows["trial"]
+        self._markers = self._rows["marker"]
+        self._temps = self._rows["temps"]
+        self._cursor = self._header["cursor"]
+        self.cursor = 0
+        self.full = False
+        self.closed = False
+
+    def append(self, time_s, trial, marker, temperatures):
+        """
+        :param time_s: s from session start
+        :param temperatures: five temperatures in °C
+        """
+        if self.cursor == self.capacity:
+            if not self.full:
+                self.full = True
+                print(f"Live recording full after {self.capacity} samples: {self.path}")
+            return
+        i = self.cursor
+        self._times[i] = time_s
+        self._trials[i] = trial
+        self._markers[i] = marker
+        self._temps[i] = [round(temperature * SCALE) for temperature in temperatures]
+        # publish the row
+        self.cursor = i + 1
+        self._cursor[0] = self.cursor
+
+    def flush(self):
+        """
+        writes the mapped pages to the disk, not needed if only the program crashes
+        """
+        self._rows.flush()
+        self._header.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._header["closed"] = 1
+        self.flush()
+        del self._times, self._trials, self._markers, self._temps, self._cursor
+        del self._rows, self._header
+
+
+class LiveReader:
+    """
+    read-only view of a LiveRecording, also while it is written
+    use: reader = LiveReader(path); rows = reader.new_rows() again and again
+    """
+    def __init__(self, path):
+        self.path = path
+        self._header = np.memmap(path, dtype=HEADER, mode="r", shape=(1,))
+        if self._header["magic"][0] != LIVE_MAGIC or self._header["version"][0] != LIVE_VERSION:
+            raise ValueError(path + " is not a live recording, or not initialized yet")
+        capacity = int(self._header["capacity"][0])
+        self._rows = np.memmap(path, dtype=RECORD, mode="r", offset=HEADER.itemsize,
+                               shape=(capacity,))
+        # rows returned by new_rows() so far
+        self.position = 0
+
+    def cursor(self):
+        return int(self._header["cursor"][0])
+
+    def is_closed(self):
+        return bool(self._header["closed"][0])
+
+    def rows(self):
+        """
+        :return: RECORD view (no copy) of all complete rows
+        """
+        return self._rows[:self.cursor()]
+
+    def new_rows(self):
+        """
+        :return: RECORD view (no copy) of the rows written since the last call
+        """
+        cursor = self.cursor()
+        rows = self._rows[self.position:cursor]
+        self.position = cursor
+        return rows
+
+
+def to_samples(rows):
+    """
+    :param rows: RECORD rows, e.g. from LiveReader
+    :return: temperature_store.SAMPLE_DTYPE copy in °C, same as load_session()
+    """
+    samples = np.empty(len(rows), dtype=SAMPLE_DTYPE)
+    samples["time_s"] = rows["time_s"]
+    samples["trial"] = rows["trial"]
+    samples["marker"] = rows["marker"]
+    samples["temps"] = rows["temps"] / np.float32(SCALE)
+    return samples
+
+
+def follow(path, poll=POLL_SEC):
+    """
+    prints the newest sample of each poll until the session is closed
+    """
+    reader = LiveReader(path)
+    print(f"Following {path}, {reader.cursor()} samples so far")
+    while True:
+        closed = reader.is_closed()
+        rows = reader.new_rows()
+        if len(rows):
+            last = rows[-1]
+            temps = " ".join("%.1f" % (temp / SCALE) for temp in last["temps"])
+            print(f"{last['time_s']:9.3f} s  trial {last['trial']:3d}  marker {last['marker']:2d}  "
+                  f"{temps} °C  (+{len(rows)} samples)")
+        if closed:
+            print(f"Session closed, {reader.cursor()} samples")
+            return
+        time.sleep(poll)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Follow a live recording from another process")
+    parser.add_argument("path")
+    parser.add_argument("--poll", type=float, default=POLL_SEC, help="seconds between reads")
+    args = parser.parse_args()
+    try:
+        follow(args.path, args.poll)
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,115 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import queue
+import threading
+import time
+
+'''
+    Trigger markers (Neurospec MMBT-S box) written by their own thread.
+    send() only puts the marker in a queue, so the caller can fire the
+    stimulus right after it without waiting for the serial port. The writer
+    thread writes the byte, waits until the port has sent it and records
+    time.perf_counter() at that moment.
+    Example:
+        markers = MarkerDispatcher(acq)
+        event = markers.send(3)
+        qst.stimulate()
+        onset = time.perf_counter()
+        if event.wait(1):
+            print("marker - onset (ms):", (event.written - onset)*1000)
+        markers.close()
+'''
+
+# how long close() waits for the queued markers to be written
+CLOSE_TIMEOUT_SEC = 2
+
+
+class MarkerEvent:
+    """
+    one marker handed to MarkerDispatcher.send()
+    """
+    def __init__(self, marker):
+        self.marker = marker
+        # time.perf_counter() when send() was called
+        self.requested = time.perf_counter()
+        # time.perf_counter() after the byte left the port, None until then
+        self.written = None
+        # exception of the write, None if it worked
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        """
+        :return: True if the marker was written within timeout s
+        """
+        return self._done.wait(timeout) and self.error is None
+
+    def latency(self):
+        """
+        :return: s from send() until the byte was written, None if not written
+        """
+        if self.written is None:
+            return None
+        return self.written - self.requested
+
+
+class MarkerDispatcher:
+    """
+    writes the markers to port in the order they were sent,
+    from a background thread
+    """
+    def __init__(self, port):
+        self.port = port
+        self._queue = queue.Queue()
+        # every MarkerEvent of the session
+        self.events = []
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def send(self, marker):
+        """
+        queues marker (0 to 255) and returns at once
+        :return: MarkerEvent, written is set when the byte has been sent
+        """
+        event = MarkerEvent(marker)
+        self.events.append(event)
+        self._queue.put(event)
+        return event
+
+    def close(self, timeout=CLOSE_TIMEOUT_SEC):
+        """
+        writes the markers still in the queue and stops the thread
+        (the port itself stays open)
+        """
+        self._queue.put(None)
+        self._thread.join(timeout)
+
+    def _write_loop(self):
+        while True:
+            event = self._queue.get()
+            if event is None:
+                break
+            try:
+                self.port.write(bytes([event.marker]))
+                # wait until the byte is out of the OS buffer
+                self.port.flush()
+                event.written = time.perf_counter()
+            except Exception as e:
+                event.error = e
+                print(f"Marker {event.marker} could not be sent: {e}")
+            event._done.set()
@@ -0,0 +1,139 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+'''
+    Synchronized control of two or more thermodes, e.g. for bilateral
+    stimulation.
+    Every device gets its own worker thread, so parameters are loaded on all
+    devices in parallel, and the workers wait on a barrier before sending L,
+    so the onsets are not skewed by the round trips of the other devices.
+    Example:
+        controller = MultiTcsController([device_left, device_right])
+        controller.start_streaming()
+        controller.preload([{"temperatures": [32, 32, 50, 32, 32]},
+                            {"temperatures": [32, 50, 32, 32, 32]}])
+        offsets = controller.stimulate()
+        times, temperatures = controller.merged_samples(since=controller.onset)
+'''
+
+# rate of the common time grid of merged_samples() in Hz
+MERGE_RATE_HZ = 100
+# keyword of preload() -> TcsDevice setter
+PRELOAD_SETTERS = [
+    ("baseline", "set_baseline"),
+    ("durations", "set_durations"),
+    ("ramp_speeds", "set_ramp_speed"),
+    ("return_speeds", "set_return_speed"),
+    ("temperatures", "set_temperatures"),
+]
+
+
+class MultiTcsController:
+    """
+    :param devices: list of open TcsDevice objects, at least one
+    """
+    def __init__(self, devices):
+        self.devices = list(devices)
+        if not self.devices:
+            raise ValueError("At least one device is needed")
+        self._pool = ThreadPoolExecutor(max_workers=len(self.devices),
+                                        thread_name_prefix="MultiTcs")
+        # time.perf_counter() after L was written, per device
+        self.onset_times = None
+        # earliest of onset_times
+        self.onset = None
+
+    def preload(self, params):
+        """
+        sends the parameters of the next stimulus to all devices in parallel,
+        each device in a single write
+        :param params: one dict per device with any of the keys baseline,
+            durations, ramp_speeds, return_speeds, temperatures
+        """
+        if len(params) != len(self.devices):
+            raise ValueError("One set of parameters per device is needed")
+
+        def load(device, device_params):
+            with device.batch():
+                for key, setter in PRELOAD_SETTERS:
+                    if key in device_params:
+                        getattr(device, setter)(device_params[key])
+
+        self._run_all(load, params)
+
+    def stimulate(self):
+        """
+        starts the stimulation on all devices at once
+        :return: onset offset of each device in s relative to the earliest
+        """
+        barrier = threading.Barrier(len(self.devices))
+
+        def fire(device, unused):
+            # all workers are ready before anyone sends
+            barrier.wait()
+            device.stimulate()
+            return time.perf_counter()
+
+        self.onset_times = self._run_all(fire, [None]*len(self.devices))
+        self.onset = min(self.onset_times)
+        return [t - self.onset for t in self.onset_times]
+
+    def start_streaming(self):
+        for device in self.devices:
+            device.start_streaming()
+
+    def stop_streaming(self):
+        for device in self.devices:
+            device.stop_streaming()
+
+    def merged_samples(self, since, rate=MERGE_RATE_HZ):
+        """
+        merges the streamed temperatures of all devices onto one time grid
+        (linear interpolation, only where all devices have data)
+        :param since: time.perf_counter() value
+        :param rate: samples per second of the common grid
+        :return: (times, temperatures)
+            times: float64 array (n,)
+            temperatures: float32 array (n, number of devices, 5)
+        """
+        streams = [device.get_samples_since(since) for device in self.devices]
+        if any(len(times) == 0 for times, temps in streams):
+            return np.empty(0), np.empty((0, len(self.devices), 5), np.float32)
+        start = max(times[0] for times, temps in streams)
+        end = min(times[-1] for times, temps in streams)
+        grid = np.arange(start, end, 1.0 / rate) if end > start else np.empty(0)
+        merged = np.empty((len(grid), len(self.devices), 5), np.float32)
+        for d, (times, temps) in enumerate(streams):
+            for zone in range(5):
+                merged[:, d, zone] = np.interp(grid, times, temps[:, zone])
+        return grid, merged
+
+    def close(self):
+        """
+        stops the worker threads, the devices stay open
+        """
+        self._pool.shutdown()
+
+    def _run_all(self, func, args):
+        futures = [self._pool.submit(func, device, arg)
+                   for device, arg in zip(self.devices, args)]
+        return [future.result() for future in futures]
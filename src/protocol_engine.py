@@ -0,0 +1,716 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import os
+import threading
+import time
+from datetime import datetime
+import session_plan
+from marker_dispatcher import MarkerDispatcher
+from recording import SampleBuffer
+from safety_watchdog import SafetyWatchdog, IdleMonitor, DEFAULT_LIMITS
+from sampler import Sampler, DEFAULT_RATE_HZ
+from session_log import SessionLog
+from temperature_store import TemperatureStore, FILE_EXTENSION
+from live_recording import LiveRecording, SPARE_ROWS
+from session_clock import SessionClock
+from trial_scheduler import TrialScheduler, wait_until, begin_fine_timer, end_fine_timer
+
+'''
+    Session logic of thermal_stimuli.py and heat_threshold.py without GUI.
+    The Qt windows and run_protocol.py (command line) drive the same
+    session classes, so both write the same logs in the same folders.
+    The sessions only need open devices (TcsDevice and the serial port of
+    the trigger box); they never open or close ports themselves.
+    Callbacks (on_trial, on_sample, ...) are called from the thread that
+    runs the session; a GUI has to pass them on to its own thread.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+# logs are written next to the scripts
+LOG_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+RAMP_SPEED      = [300.0]*5              # ramp up speed in °C/s for the 5 zones
+RETURN_SPEED    = [300.0]*5              # ramp down speed in °C/s for the 5 zones
+
+# thermal_stimuli
+THERMAL_STIMULI_LOG_FOLDER = "_HEAT_LOGS"
+AREAS = [1,4,2,5,3]
+MIN_INTERVAL = 8
+MAX_INTERVAL = 12
+INTERVAL_STEP = 0.5
+# wait times after the hold to choose from
+INTERVAL_SEC = [MIN_INTERVAL + i*INTERVAL_STEP for i in range(int((MAX_INTERVAL-MIN_INTERVAL)/INTERVAL_STEP))]
+BEGIN_MARKER = 11
+END_MARKER = 22
+MAX_TEMP = 60
+MIN_TEMP = 15
+MIN_TIME2APPLY = 1
+MAX_TIME2APPLY = 10
+# recorded after the hold
+RECORD_EXTRA_SEC = 0.25
+# how often the recording reports its progress
+PROGRESS_SEC = 0.1
+# first stimulus after the begin marker
+FIRST_ONSET_SEC = 1
+# how long to wait for the marker write after the recording
+MARKER_WAIT_SEC = 1
+# the safety monitor stops reading that long before an onset
+MONITOR_GUARD_SEC = 0.05
+THERMAL_STIMULI_DEFAULTS = {
+    "subjectID": "00",
+    "session": "00",
+    "target_temp": 51.0,
+    "baseline_temp": 32.0,
+    "time2apply": 1,
+    "duration": 300,
+    "seed": None,
+    # temperature reads per second while recording
+    "sample_rate": DEFAULT_RATE_HZ,
+    # overrides of safety_watchdog.DEFAULT_LIMITS
+    "safety": {},
+    "intervals": INTERVAL_SEC,
+}
+
+# heat_threshold
+HEAT_THRESHOLD_LOG_FOLDER = "_HEAT_SIMPLE_THRESHOLD_LOGS"
+HEAT_THRESHOLD_BASELINE_TEMP = 32
+STEP_UP = 1
+# recorded after the hold
+HOLD_EXTRA_SEC = 0.5
+# states of a heat threshold session, see HeatThresholdSession.set_state()
+READY = "ready"              # waiting for the participant to start
+STIMULATING = "stimulating"  # from the stimulation command to the end of the recording
+ASKING = "asking"            # question shown, waiting for the answer
+DONE = "done"
+# possible start values
+ALL_TEMPS = list(range(32, MAX_TEMP + 1))
+HEAT_THRESHOLD_DEFAULTS = {
+    "subjectID": "00",
+    "session": "00",
+    "start_temp": 46,
+    "hold_time": 1,
+    "seed": None,
+    # temperature reads per second during the hold
+    "sample_rate": DEFAULT_RATE_HZ,
+    # overrides of safety_watchdog.DEFAULT_LIMITS
+    "safety": {},
+}
+
+
+def check_thermal_stimuli_params(params):
+    """
+    raises ValueError with a message for the user if a parameter is out of range
+    """
+    for name in ["target_temp", "baseline_temp"]:
+        if params[name] > MAX_TEMP or params[name] < MIN_TEMP:
+            raise ValueError("Max temperature is "+str(MAX_TEMP)+" and min temperature is "+str(MIN_TEMP))
+    if params["time2apply"] > MAX_TIME2APPLY or params["time2apply"] < MIN_TIME2APPLY:
+        raise ValueError("Max time to apply is "+str(MAX_TIME2APPLY)+" and min time to apply is "+str(MIN_TIME2APPLY))
+    if params["duration"] <= params["time2apply"]+max(params["intervals"])+1:
+        raise ValueError("Total duration has to be at least "+str(params["time2apply"]+max(params["intervals"])+1)+" sec.")
+    if params["sample_rate"] <= 0:
+        raise ValueError("Sample rate has to be positive.")
+    check_safety_limits(params["safety"])
+
+
+def check_heat_threshold_params(params):
+    if params["start_temp"] not in ALL_TEMPS:
+        raise ValueError("Temperature not allowed.\nTry intigers between "+str(ALL_TEMPS[0])+" degrees and "+str(ALL_TEMPS[-1])+" degrees.")
+    if params["hold_time"] != int(params["hold_time"]) or params["hold_time"] <= 0:
+        raise ValueError("Only full seconds holding time.")
+    if params["sample_rate"] <= 0:
+        raise ValueError("Sample rate has to be positive.")
+    check_safety_limits(params["safety"])
+
+
+def check_safety_limits(limits):
+    for name in limits:
+        if name not in DEFAULT_LIMITS:
+            raise ValueError("Unknown safety limit '"+name+"', use "+", ".join(DEFAULT_LIMITS))
+    if limits.get("max_temp", DEFAULT_LIMITS["max_temp"]) > MAX_TEMP + DEFAULT_LIMITS["max_overshoot"]:
+        raise ValueError("The safety max_temp can not be above "+str(MAX_TEMP + DEFAULT_LIMITS["max_overshoot"]))
+
+
+def make_folder(path):
+    try:
+        os.mkdir(path)
+    except OSError:
+        pass
+    if not os.path.exists(path):
+        raise OSError("Your data could not be logged under " + path)
+
+
+def open_recordings(prefix_path, device, baseline, limits, capacity, on_trip, stop, start=None):
+    """
+    opens what both sessions record next to their log file
+    :param prefix_path: path of the log file without extension
+    :param device: TcsDevice of the session
+    :param baseline: temperature the watchdog sends the zones to on a trip
+    :param limits: safety limits of the session parameters
+    :param capacity: most samples of the session
+    :param on_trip: function(reason) of the session, see SafetyWatchdog
+    :param stop: threading.Event of the session, ends the idle monitor
+    :param start: time.perf_counter() of the session start, default now
+    :return: (TemperatureStore, LiveRecording, SafetyWatchdog, IdleMonitor)
+    """
+    # all recorded temperatures of the session, see temperature_store.py
+    store = TemperatureStore(prefix_path+"_temperatures"+FILE_EXTENSION)
+    # every sample as soon as it is read, for crashes and live monitoring, see live_recording.py
+    live = LiveRecording(prefix_path+"_live"+FILE_EXTENSION, capacity + SPARE_ROWS)
+    # safety stops, see safety_watchdog.py
+    watchdog = SafetyWatchdog(device, baseline, limits, log_path=prefix_path+"_safety.csv",
+                              on_trip=on_trip, start=start)
+    # also checks the temperatures between the recordings
+    monitor = IdleMonitor(watchdog, device.get_temperatures, stop=stop)
+    return store, live, watchdog, monitor
+
+
+########################################
+# THERMAL STIMULI SESSION CLASS
+######################################
+class ThermalStimuliSession:
+    """
+    the target temperature on the next area of the plan at each onset,
+    a marker on the trigger box with each stimulus and the temperatures
+    recorded during each stimulus
+    use:
+        session = ThermalStimuliSession(params, qst, acq)
+        session.configure_device()
+        session.configure_logging()
+        session.run()   # blocks until the plan is done or stop() is called
+    """
+    def __init__(self, params, qst, acq, log_root=LOG_ROOT):
+        """
+        :param params: dict with the keys of THERMAL_STIMULI_DEFAULTS
+        :param qst: open TcsDevice
+        :param acq: open serial port of the trigger box
+        """
+        self.params = dict(THERMAL_STIMULI_DEFAULTS, **params)
+        if self.params["seed"] is None:
+            self.params["seed"] = session_plan.new_seed()
+        self.qst = qst
+        self.acq = acq
+        self.log_root = log_root
+        # trials of the session, see session_plan.py
+        self.plan = session_plan.make_thermal_stimuli_plan(
+            self.params["seed"],
+            target_temp=self.params["target_temp"],
+            time2apply=self.params["time2apply"],
+            duration=self.params["duration"],
+            intervals=self.params["intervals"], areas=AREAS, first_onset=FIRST_ONSET_SEC)
+        # index of the next trial in the plan
+        self.trial_idx = 0
+        # absolute onset deadlines
+        self.scheduler = TrialScheduler()
+        # timestamps of the log, ms since the begin marker
+        self.clock = SessionClock()
+        # temperatures recorded during the current stimulus
+        self.samples = SampleBuffer()
+        # writes the markers to acq in its own thread, see begin()
+        self.markers = None
+        # checks every recorded sample, see configure_logging()
+        self.watchdog = None
+        # feeds the watchdog between the recordings
+        self.monitor = None
+        # True while the session holds 1 ms timer ticks on Windows
+        self.fine_timer = False
+        # one dict per finished trial
+        self.results = []
+        self.running = False
+        self._stop = threading.Event()
+        # callbacks
+        # trial number, marker, temperature; called before waiting for the onset
+        self.on_trial = None
+        # time since onset (s), five temperatures
+        self.on_sample = None
+        # time since onset (s), called every PROGRESS_SEC
+        self.on_progress = None
+        # dict of the finished trial, see run_trial()
+        self.on_trial_done = None
+
+    def configure_device(self):
+        # Quiet mode
+        self.qst.set_quiet()
+        # a device reused from device_registry keeps the values of the last
+        # session in its cache, they may no longer be on the TCS
+        self.qst.invalidate()
+        # send constant settings for the stimuli in one write
+        with self.qst.batch():
+            self.qst.set_baseline(self.params["baseline_temp"])
+            # set durations to user defined
+            self.qst.set_durations([self.params["time2apply"]]*5)
+            self.qst.set_ramp_speed(RAMP_SPEED)
+            self.qst.set_return_speed(RETURN_SPEED)
+
+    def configure_logging(self):
+        """
+        creates the session folders, raises OSError if that is not possible
+        """
+        dump_path = os.path.join(self.log_root, THERMAL_STIMULI_LOG_FOLDER)
+        make_folder(dump_path)
+        # create subject sub folder
+        self.start_time = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        prefix = self.params["subjectID"]+"_"+self.params["session"]+"_"+self.start_time
+        self.dump_path_subject = os.path.join(dump_path, prefix)
+        make_folder(self.dump_path_subject)
+        self.log_path = os.path.join(self.dump_path_subject, prefix+".txt")
+        # open for the whole session, see session_log.py
+        self.log = SessionLog(self.log_path)
+        self.log.write("ms,year_month_day_hour_min_sec,marker")
+        # the plan, to replay the session
+        self.plan_path = os.path.join(self.dump_path_subject, prefix+"_plan.csv")
+        # planned vs actual onsets in s from session start,
+        # marker_offset_ms = time the marker byte was written - stimulus onset
+        self.timing_log_path = os.path.join(self.dump_path_subject, prefix+"_timing.csv")
+        # sample_rate_hz and missed_deadlines of the recording, see sampler.py
+        self.timing_log = SessionLog(self.timing_log_path)
+        self.timing_log.write("trial,planned_s,actual_s,error_ms,marker_offset_ms,sample_rate_hz,missed_deadlines")
+        self.store, self.live, self.watchdog, self.monitor = open_recordings(
+            os.path.join(self.dump_path_subject, prefix), self.qst, self.params["baseline_temp"],
+            self.params["safety"], self.params["duration"]*self.params["sample_rate"],
+            self.safety_stop, self._stop)
+
+    def run(self):
+        """
+        runs all trials of the plan, blocks until they are done or stop() is called
+        """
+        self.begin()
+        try:
+            while not self._stop.is_set() and self.trial_idx < len(self.plan):
+                self.run_trial(self.plan[self.trial_idx])
+        finally:
+            self.finish()
+
+    def stop(self):
+        """
+        can be called from any thread, the session stops within one sample
+        """
+        self._stop.set()
+
+    def begin(self):
+        session_plan.save_plan(self.plan, self.plan_path, self.params["seed"])
+        session_plan.print_summary(self.plan)
+        self.markers = MarkerDispatcher(self.acq)
+        self.running = True
+        print("Begin")
+        self.clock.start()
+        self.log_marker(self.clock.timestamp(), datetime.now(), BEGIN_MARKER)
+        # send begin marker to acqknowledge
+        print(f"Sending marker: {BEGIN_MARKER}\n")
+        self.markers.send(BEGIN_MARKER)
+        # onsets are planned from the same start as the log timestamps
+        self.scheduler.begin(FIRST_ONSET_SEC, self.clock.start_s)
+        self.watchdog.start = self.clock.start_s
+        # 1 ms sleeps on Windows for the onsets and the sampling
+        self.fine_timer = begin_fine_timer()
+        self.monitor.start()
+
+    def run_trial(self, trial):
+        """
+        sets the temperatures of trial, stimulates at its planned onset and
+        records until the end of the hold
+        :return: dict of the trial, also passed to on_trial_done
+        """
+        self.trial_idx += 1
+        temps = [self.params["baseline_temp"] for el in AREAS]
+        current_area = int(trial["zone"])
+        temps[current_area-1] = float(trial["temperature"]) # current_area-1 (-1 because area index starts at 0)
+        marker = int(trial["marker"])
+        curr_temp = float(trial["temperature"])
+        print(f"Current area: {marker}, Temperature: {curr_temp}")
+        if self.on_trial is not None:
+            self.on_trial(int(trial["trial"]), marker, curr_temp)
+        self.monitor.pause()
+        self.qst.set_temperatures(temps)
+        self.watchdog.set_targets(temps)
+        self.monitor.resume()
+        # the zones are read by the monitor until shortly before the onset
+        if wait_until(self.scheduler.next_onset - MONITOR_GUARD_SEC, self._stop) is None:
+            return None
+        self.monitor.pause()
+        # send marker and begin stimulation exactly at the planned onset,
+        # the marker is written by the dispatcher thread while L goes out
+        if wait_until(self.scheduler.next_onset, self._stop) is None:
+            return None
+        marker_event = self.markers.send(marker)
+        self.qst.stimulate()
+        start_time = time.perf_counter()
+        self.watchdog.start_hold(start_time, float(trial["hold_s"]))
+        start_date = datetime.now()
+        print(f"Sending marker: {marker}\n")
+        stats = self.record(float(trial["hold_s"]) + RECORD_EXTRA_SEC, start_time, int(trial["trial"]), marker)
+        self.monitor.resume()
+        # save the samples with session times
+        self.store.append(int(trial["trial"]), marker, self.record_onset + self.samples.data[:, 0], self.samples.data[:, 1:])
+        self.live.flush()
+        self.log_marker("%.3f" % self.clock.to_session_ms(start_time), start_date, marker)
+        if marker_event.wait(MARKER_WAIT_SEC):
+            marker_offset = marker_event.written - start_time
+        else:
+            marker_offset = float("nan")
+        print(f"Samples: {len(self.samples)}, sample rate: {stats}")
+        # planned vs actual onset
+        error = self.scheduler.record_onset(start_time)
+        number, planned, actual = self.scheduler.onsets[-1]
+        print(f"Onset error: {error*1000:.2f} ms, marker - onset: {marker_offset*1000:.2f} ms")
+        self.timing_log.write(str(number)+","+"%.6f" % planned+","+"%.6f" % actual+","+"%.3f" % (error*1000)+","+"%.3f" % (marker_offset*1000)+","+"%.1f" % stats.achieved_rate()+","+str(stats.missed))
+        # wait interval, counted from the planned onset
+        interval = float(trial["interval_s"])
+        self.scheduler.advance(float(trial["hold_s"])+interval)
+        print(f"Sec from session start: {self.clock.elapsed_s():.3f}")
+        print(f"Current interval: {interval}\n")
+        result = {"trial": number, "marker": marker, "temperature": curr_temp,
+                  "samples": len(self.samples), "sample_rate": stats.achieved_rate(),
+                  "missed_deadlines": stats.missed,
+                  "onset_error": error, "marker_offset": marker_offset}
+        self.results.append(result)
+        if self.on_trial_done is not None:
+            self.on_trial_done(result)
+        return result
+
+    def record(self, recordDuration, start_time, trial=0, marker=0):
+        """
+        records the temperatures for recordDuration s after start_time
+        :return: sampler.SamplerStats
+        """
+        self.samples.clear()
+        self.last_progress = 0
+        self.record_start = start_time
+        # for the live recording
+        self.record_onset = self.clock.to_session_ms(start_time) / 1000
+        self.record_trial = trial
+        self.record_marker = marker
+        sampler = Sampler(self.qst.get_temperatures, self.params["sample_rate"], self._stop)
+        return sampler.run(recordDuration, self.add_sample, start_time)
+
+    def add_sample(self, elapsed_time, current_temperatures):
+        # safety first, the watchdog aborts from this thread
+        self.watchdog.check(self.record_start + elapsed_time, current_temperatures)
+        self.live.append(self.record_onset + elapsed_time, self.record_trial, self.record_marker, current_temperatures)
+        self.samples.append(elapsed_time, current_temperatures)
+        if self.on_sample is not None:
+            self.on_sample(elapsed_time, current_temperatures)
+        if elapsed_time - self.last_progress >= PROGRESS_SEC:
+            self.last_progress = elapsed_time
+            if self.on_progress is not None:
+                self.on_progress(elapsed_time)
+
+    def finish(self):
+        """
+        sends the end marker and closes the logs, called by run()
+        """
+        if not self.running:
+            return
+        self.running = False
+        # total time
+        print(f"Total duration: {self.clock.elapsed_s():.3f} sec\n")
+        mean_jitter, max_jitter = self.scheduler.jitter()
+        print(f"Onset jitter: mean {mean_jitter*1000:.2f} ms, max {max_jitter*1000:.2f} ms\n")
+        # send end marker to acqknowledge
+        print(f"Sending marker: {END_MARKER}\n")
+        self.markers.send(END_MARKER)
+        # writes the markers still queued
+        self.markers.close()
+        self.monitor.close()
+        if self.fine_timer:
+            end_fine_timer()
+        self.log_marker(self.clock.timestamp(), datetime.now(), END_MARKER)
+        self.close_logs()
+        print("The end")
+
+    def close_logs(self):
+        """
+        writes what is still queued and fsyncs the logs
+        """
+        self.log.close()
+        self.timing_log.close()
+        self.watchdog.close()
+        self.store.close()
+        self.live.close()
+
+    def safety_stop(self, reason):
+        # the zones are already going to baseline
+        self.stop()
+
+    def log_marker(self, ms, date, marker):
+        self.log.write(ms+","+date.strftime("%Y_%m_%d_%H_%M_%S")+","+str(marker))
+################### end ThermalStimuliSession class
+
+
+########################################
+# HEAT THRESHOLD SESSION CLASS
+######################################
+class HeatThresholdSession:
+    """
+    one stimulus per temperature step, starting at start_temp, on the zone
+    of the plan, until the answer is yes or MAX_TEMP is exceeded
+    states: READY -> STIMULATING -> ASKING -> STIMULATING ... -> DONE,
+    every transition is logged with its time in <log>_states.csv
+    use:
+        session = HeatThresholdSession(params, thermode)
+        session.configure_logging()
+        while not session.done:
+            session.apply_temp()        # blocks for the hold, or start_stimulus()
+            session.ask()               # when the question is shown
+            session.answer(painful, time.perf_counter())   # True = yes
+        session.close()
+    """
+    def __init__(self, params, thermode, log_root=LOG_ROOT):
+        """
+        :param params: dict with the keys of HEAT_THRESHOLD_DEFAULTS
+        :param thermode: open TcsDevice
+        """
+        self.params = dict(HEAT_THRESHOLD_DEFAULTS, **params)
+        if self.params["seed"] is None:
+            self.params["seed"] = session_plan.new_seed()
+        self.thermode = thermode
+        # Quiet mode, the hold is read with 'E' like in ThermalStimuliSession
+        self.thermode.set_quiet()
+        # a device reused from device_registry keeps the values of the last
+        # session in its cache, the first stimulus sends all of them again
+        self.thermode.invalidate()
+        self.log_root = log_root
+        # set current temp Value to default
+        self.current_temp = self.params["start_temp"]
+        self.duration = self.params["hold_time"]
+        # one row per temperature step, the zone of each step is planned from the seed
+        self.plan = session_plan.make_heat_threshold_plan(self.params["seed"], self.current_temp, MAX_TEMP,
+                                                          STEP_UP, self.duration)
+        # index of the current step in the plan
+        self.trial_idx = 0
+        self.done = False
+        # temperature answered with yes, None if there was none
+        self.threshold = None
+        # temperatures recorded during the last hold
+        self.samples = SampleBuffer()
+        self._stop = threading.Event()
+        # callback: time since onset (s), five temperatures; called during the hold
+        self.on_sample = None
+        # checks every recorded sample, see configure_logging()
+        self.watchdog = None
+        # feeds the watchdog between the holds
+        self.monitor = None
+        # True while the session holds 1 ms timer ticks on Windows
+        self.fine_timer = False
+        # callback without arguments after a safety stop, called from the
+        # thread that read the sample
+        self.on_safety_stop = None
+        self.state = READY
+        # (s from session start, state) of every transition
+        self.transitions = []
+        # time.perf_counter() when the current question was shown
+        self.question_onset = None
+        # records the hold when started with start_stimulus()
+        self.stimulus_thread = None
+        # callback without arguments at the end of the recording of start_stimulus(),
+        # called from the recording thread
+        self.on_stimulus_done = None
+
+    def configure_logging(self):
+        """
+        creates the log file, raises OSError if that is not possible
+        """
+        dump_path = os.path.join(self.log_root, HEAT_THRESHOLD_LOG_FOLDER)
+        make_folder(dump_path)
+        self.time_stamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.log_file_name = self.params["subjectID"]+"_"+self.params["session"]+"_"+datetime.now().strftime("%Y_%m_%d_%H_%M_%S")+".txt"
+        self.log_path = os.path.join(dump_path, self.log_file_name)
+        self.plan_path = os.path.splitext(self.log_path)[0]+"_plan.csv"
+        session_plan.save_plan(self.plan, self.plan_path, self.params["seed"])
+        # log task settings, open for the whole session, see session_log.py
+        self.log = SessionLog(self.log_path)
+        self.log.write("Subject ID: "+self.params["subjectID"])
+        self.log.write("Session: "+self.params["session"])
+        self.log.write("Seed: "+str(self.params["seed"]))
+        self.log.write("Date: "+self.time_stamp+"\n")
+        # sample times in the log files are from here
+        self.session_start = time.perf_counter()
+        capacity = len(self.plan)*(self.params["hold_time"]+HOLD_EXTRA_SEC)*self.params["sample_rate"]
+        self.store, self.live, self.watchdog, self.monitor = open_recordings(
+            os.path.splitext(self.log_path)[0], self.thermode, HEAT_THRESHOLD_BASELINE_TEMP,
+            self.params["safety"], capacity, self.safety_stop, self._stop, start=self.session_start)
+        self.monitor.start()
+        # 1 ms sleeps on Windows for the sampling, until close()
+        self.fine_timer = begin_fine_timer()
+        # state transitions, see set_state()
+        self.state_log = SessionLog(os.path.splitext(self.log_path)[0]+"_states.csv")
+        self.state_log.write("session_s,state,trial,temperature")
+        self.set_state(READY)
+
+    def stop(self):
+        self._stop.set()
+
+    def set_state(self, state):
+        """
+        :return: time.perf_counter() of the transition
+        """
+        now = time.perf_counter()
+        self.state = state
+        self.transitions.append((now - self.session_start, state))
+        self.state_log.write("%.6f" % (now - self.session_start)+","+state+","+str(self.trial_idx+1)+","+str(self.current_temp))
+        return now
+
+    def apply_temp(self):
+        """
+        stimulates with the current temperature, returns after the hold
+        """
+        self.send_stimulus()
+        self.record_stimulus()
+
+    def start_stimulus(self):
+        """
+        stimulates with the current temperature and returns at once, the hold
+        is recorded in a thread that calls on_stimulus_done at its end
+        """
+        self.send_stimulus()
+        self.stimulus_thread = threading.Thread(target=self.record_stimulus, name="heat-threshold-hold", daemon=True)
+        self.stimulus_thread.start()
+
+    def send_stimulus(self):
+        self.monitor.pause()
+        # set temp
+        temperatures = [HEAT_THRESHOLD_BASELINE_TEMP]*5
+        current_area_idx = int(self.plan[self.trial_idx]["zone"])-1
+        temperatures[current_area_idx] = self.current_temp
+        durations    = [self.duration]*5     # stimulation durations in s for the 5 zones
+        # send all settings for the stimuli in one write
+        with self.thermode.batch():
+            self.thermode.set_baseline(HEAT_THRESHOLD_BASELINE_TEMP)
+            self.thermode.set_durations(durations)
+            self.thermode.set_ramp_speed(RAMP_SPEED)
+            self.thermode.set_return_speed(RETURN_SPEED)
+            self.thermode.set_temperatures(temperatures)
+        self.watchdog.set_targets(temperatures)
+
+        print("heating")
+        print("current temp: ", self.current_temp)
+        self.thermode.stimulate()
+        self.record_start = self.set_state(STIMULATING)
+        self.watchdog.start_hold(self.record_start, self.duration)
+        trial = self.plan[self.trial_idx]
+        self.record_trial = int(trial["trial"])
+        self.record_marker = int(trial["marker"])
+
+    def record_stimulus(self):
+        """
+        records from the stimulation until the stimulus is over
+        """
+        self.samples.clear()
+        sampler = Sampler(self.thermode.get_temperatures, self.params["sample_rate"], self._stop)
+        stats = sampler.run(self.duration + HOLD_EXTRA_SEC, self.add_sample, self.record_start)
+        print(f"Samples: {len(self.samples)}, sample rate: {stats}")
+        self.monitor.resume()
+        self.store.append(self.record_trial, self.record_marker,
+                          self.record_start - self.session_start + self.samples.data[:, 0],
+                          self.samples.data[:, 1:])
+        self.live.flush()
+        if self.on_stimulus_done is not None:
+            self.on_stimulus_done()
+
+    def add_sample(self, elapsed_time, current_temperatures):
+        # safety first, the watchdog aborts from this thread
+        self.watchdog.check(self.record_start + elapsed_time, current_temperatures)
+        self.live.append(self.record_start - self.session_start + elapsed_time,
+                         self.record_trial, self.record_marker, current_temperatures)
+        self.samples.append(elapsed_time, current_temperatures)
+        if self.on_sample is not None:
+            self.on_sample(elapsed_time, current_temperatures)
+
+    def safety_stop(self, reason):
+        # the zones are already going to baseline
+        self.stop()
+        self.done = True
+        self.log.write("\nSafety stop: " + reason + " at " + str(self.current_temp))
+        self.set_state(DONE)
+        if self.on_safety_stop is not None:
+            self.on_safety_stop()
+
+    def ask(self):
+        """
+        call when the question is on the screen, response times are from here
+        """
+        self.question_onset = self.set_state(ASKING)
+
+    def answer(self, painful, answered_at=None):
+        """
+        :param painful: True if the answer was yes
+        :param answered_at: time.perf_counter() of the key press, for the response time
+        :return: True if the session is over
+        """
+        print("Y" if painful else "N")
+        # log
+        self.log.write("Temperature: " + str(self.current_temp))
+        self.log.write("Response: " + ("Y" if painful else "N"))
+        if answered_at is not None and self.question_onset is not None:
+            self.log.write("Response time: " + "%.3f" % ((answered_at - self.question_onset)*1000) + " ms")
+        self.question_onset = None
+        if painful:
+            self.log.write("\nThreshold: " + str(self.current_temp))
+            self.threshold = self.current_temp
+            self.done = True
+        else:
+            self.current_temp += STEP_UP
+            self.trial_idx += 1
+            if self.current_temp > MAX_TEMP:
+                self.log.write("\nMax temp exceeded: " + str(self.current_temp))
+                self.done = True
+        if self.done:
+            self.set_state(DONE)
+        return self.done
+
+    def close(self):
+        """
+        writes what is still queued and fsyncs the log and the temperatures,
+        call at the end of the session
+        """
+        if self.stimulus_thread is not None:
+            # a hold still recording, returns early after stop()
+            self.stimulus_thread.join()
+        self.monitor.close()
+        if self.fine_timer:
+            end_fine_timer()
+            self.fine_timer = False
+        self.log.close()
+        self.state_log.close()
+        self.watchdog.close()
+        self.store.close()
+        self.live.close()
+
+    def run(self, ask):
+        """
+        runs the whole session
+        :param ask: function(temperature) that returns True if the stimulus was painful
+        :return: the threshold or None
+        """
+        try:
+            while not self.done and not self._stop.is_set():
+                self.apply_temp()
+                if self._stop.is_set():
+                    break
+                self.ask()
+                painful = ask(self.current_temp)
+                if self._stop.is_set():
+                    # safety stop while asking
+                    break
+                self.answer(painful, time.perf_counter())
+        finally:
+            self.close()
+        return self.threshold
+################### end HeatThresholdSession class
@@ -0,0 +1,66 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import numpy as np
+
+'''
+    Buffers for the thermode temperatures recorded during a stimulus.
+'''
+
+# rows added each time the buffer is full (10 s @100Hz)
+CHUNK_SAMPLES = 1000
+COLUMN_NAMES = ["time_s", "temp_1", "temp_2", "temp_3", "temp_4", "temp_5"]
+
+
+class SampleBuffer:
+    """
+    preallocated rows of (time in s, t1 to t5 in °C) that grow in chunks,
+    so appending a sample never copies the samples recorded before it
+    (apart from the rare chunk growth)
+    """
+    def __init__(self, chunk=CHUNK_SAMPLES):
+        self.chunk = chunk
+        self._data = np.empty((chunk, len(COLUMN_NAMES)), dtype=np.float64)
+        self.n = 0
+
+    def __len__(self):
+        return self.n
+
+    def append(self, sample_time, temperatures):
+        """
+        :param sample_time: time of the sample in s
+        :param temperatures: five temperatures in °C
+        """
+        if self.n == len(self._data):
+            grown = np.empty((len(self._data) + self.chunk, self._data.shape[1]))
+            grown[:self.n] = self._data
+            self._data = grown
+        row = self._data[self.n]
+        row[0] = sample_time
+        row[1:] = temperatures
+        self.n += 1
+
+    def clear(self):
+        # keep the memory for the next stimulus
+        self.n = 0
+
+    @property
+    def data(self):
+        """
+        :return: view of the recorded rows, float64 array (n, 6)
+        """
+        return self._data[:self.n]
@@ -0,0 +1,182 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import json
+import os
+import sys
+
+'''
+    Runs thermal_stimuli or heat_threshold sessions without the GUI.
+    The protocol file (YAML or JSON) holds the same settings as the
+    settings window, see example_protocol.yaml:
+        python run_protocol.py plan example_protocol.yaml
+        python run_protocol.py run example_protocol.yaml --port COM5 --acq-port COM8
+    (or python -m run_protocol ... from the src folder)
+    heat_threshold asks for the answers on the terminal, unless the protocol
+    file lists them under "responses" (y/n, for scripted runs).
+    Ctrl+C stops the session; the end marker is still sent and the logs closed.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+TASKS = ["thermal_stimuli", "heat_threshold"]
+BAUDRATE = 9600
+
+
+def load_protocol(path):
+    """
+    :return: dict of the protocol file, the task is checked but not the values
+    """
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() == ".json":
+            protocol = json.load(f)
+        else:
+            import yaml
+            protocol = yaml.safe_load(f)
+    if not isinstance(protocol, dict) or protocol.get("task") not in TASKS:
+        raise ValueError(path + ": 'task' has to be one of " + ", ".join(TASKS))
+    return protocol
+
+
+def session_params(protocol):
+    """
+    :return: params of the session classes, with the defaults for missing keys
+    """
+    import protocol_engine
+    if protocol["task"] == "thermal_stimuli":
+        defaults = protocol_engine.THERMAL_STIMULI_DEFAULTS
+    else:
+        defaults = protocol_engine.HEAT_THRESHOLD_DEFAULTS
+    params = dict(defaults)
+    params.update({key: value for key, value in protocol.items() if key in defaults})
+    # ids are used in file names
+    params["subjectID"] = str(params["subjectID"])
+    params["session"] = str(params["session"])
+    return params
+
+
+def ask_on_terminal(temperature):
+    while True:
+        answer = input(f"{temperature} °C: was this 4-6? [y/n] ").strip().lower()
+        if answer in ("y", "n"):
+            return answer == "y"
+
+
+def scripted_answers(responses):
+    """
+    :return: ask function that returns the responses one after the other
+    """
+    answers = iter(responses)
+
+    def ask(temperature):
+        answer = str(next(answers, "n")).strip().lower()
+        print(f"{temperature} °C: {answer}")
+        return answer in ("y", "yes", "true")
+    return ask
+
+
+def plan(protocol):
+    import protocol_engine
+    import session_plan
+    params = session_params(protocol)
+    seed = session_plan.new_seed() if params["seed"] is None else params["seed"]
+    if protocol["task"] == "thermal_stimuli":
+        protocol_engine.check_thermal_stimuli_params(params)
+        trials = session_plan.make_thermal_stimuli_plan(
+            seed, params["target_temp"], params["time2apply"],
+            params["duration"], params["intervals"], protocol_engine.AREAS,
+            protocol_engine.FIRST_ONSET_SEC)
+    else:
+        protocol_engine.check_heat_threshold_params(params)
+        trials = session_plan.make_heat_threshold_plan(
+            seed, params["start_temp"], protocol_engine.MAX_TEMP, protocol_engine.STEP_UP,
+            params["hold_time"])
+    print(f"Seed: {seed}")
+    session_plan.print_summary(trials)
+
+
+def run(protocol, port, acq_port):
+    import device_registry
+    import protocol_engine
+    params = session_params(protocol)
+    port = port or protocol.get("com_qst") or protocol.get("com")
+    if not port:
+        raise ValueError("No thermode port, use --port or 'com_qst' in the protocol")
+    if protocol["task"] == "thermal_stimuli":
+        protocol_engine.check_thermal_stimuli_params(params)
+        acq_port = acq_port or protocol.get("com_acqknoledge")
+        if not acq_port:
+            raise ValueError("No trigger box port, use --acq-port or 'com_acqknoledge' in the protocol")
+        acq = device_registry.get_serial(acq_port, baudrate=BAUDRATE, timeout=2)
+        session = protocol_engine.ThermalStimuliSession(params, device_registry.get_tcs(port), acq)
+        session.configure_device()
+        session.configure_logging()
+        try:
+            session.run()
+        except KeyboardInterrupt:
+            print("Stopped")
+        if session.watchdog.tripped:
+            print(session.watchdog.message())
+        print(f"Trials: {len(session.results)}, logs: {session.dump_path_subject}")
+    else:
+        protocol_engine.check_heat_threshold_params(params)
+        if "responses" in protocol:
+            ask = scripted_answers(protocol["responses"])
+        else:
+            ask = ask_on_terminal
+        session = protocol_engine.HeatThresholdSession(params, device_registry.get_tcs(port))
+        session.configure_logging()
+        try:
+            threshold = session.run(ask)
+            if session.watchdog.tripped:
+                print(session.watchdog.message())
+            print(f"Threshold: {threshold}, log: {session.log_path}")
+        except KeyboardInterrupt:
+            print("Stopped")
+    device_registry.close_all()
+
+
+################################################################
+#                                                              #
+# RUN FROM MAIN                                                #
+#                                                              #
+################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a QST protocol without GUI")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+    run_parser = commands.add_parser("run", help="run the session")
+    run_parser.add_argument("protocol", help="protocol file (.yaml or .json)")
+    run_parser.add_argument("--port", default=None,
+                            help="serial port of the thermode (default: com_qst/com of the protocol)")
+    run_parser.add_argument("--acq-port", default=None,
+                            help="serial port of the trigger box (default: com_acqknoledge of the protocol)")
+    plan_parser = commands.add_parser("plan", help="print the trials and duration, no device needed")
+    plan_parser.add_argument("protocol", help="protocol file (.yaml or .json)")
+    args = parser.parse_args()
+
+    try:
+        protocol = load_protocol(args.protocol)
+        if args.command == "plan":
+            plan(protocol)
+        else:
+            run(protocol, args.port, args.acq_port)
+    except (ValueError, OSError) as e:
+        print(e)
+        sys.exit(1)
@@ -0,0 +1,243 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import threading
+import time
+from session_log import SessionLog
+
+'''
+    Safety watchdog on the measured thermode temperatures.
+    MAX_TEMP and the clamps of TcsDevice only limit what is requested;
+    the watchdog checks what the zones actually report:
+        - absolute limits (max_temp, min_temp)
+        - overshoot: more than max_overshoot above the target of the zone
+        - above above_temp for longer than max_time_above after the end
+          of the hold (start_hold()), or at all when no hold is running
+    check() runs in the thread that reads the samples, right after each
+    read, so there is no queue between a sample and the abort: on a
+    violation it sends TcsDevice.abort_to_baseline() at once, then calls
+    on_trip (which stops the session). The latency from the arrival of
+    the sample to the written abort command is measured and logged with
+    every trip.
+    The recordings only cover the stimuli; between them an IdleMonitor
+    reads the zones at MONITOR_RATE_HZ in its own thread and passes the
+    samples to the same watchdog, so a zone that stays hot after a hold is
+    also seen. The sessions pause the monitor while they use the port.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+DEFAULT_LIMITS = {
+    "max_temp": 60.0,        # °C, any zone
+    "min_temp": 5.0,         # °C, any zone
+    "max_overshoot": 2.0,    # °C above the target of the zone
+    "above_temp": 50.0,      # °C
+    "max_time_above": 1.0,   # s above above_temp after the end of the hold
+}
+# reads per second of the IdleMonitor between the recordings
+MONITOR_RATE_HZ = 10
+LOG_HEADER = "session_s,reason,zone,temperature,target,latency_ms"
+
+
+class SafetyWatchdog:
+    """
+    use: watchdog.set_targets(temperatures) before each stimulus,
+         watchdog.start_hold(onset, hold) when it starts,
+         watchdog.check(arrival, temperatures) for every sample and
+         watchdog.close() at the end of the session
+    """
+    def __init__(self, device, baseline, limits=None, log_path=None, on_trip=None, start=None):
+        """
+        :param device: TcsDevice that is stopped on a violation
+        :param baseline: temperature the zones are sent to on a violation
+        :param limits: dict overriding keys of DEFAULT_LIMITS
+        :param log_path: csv file for the trips (a session_log.SessionLog), None = only print
+        :param on_trip: function(reason), called after the abort command
+        :param start: time.perf_counter() of the session start, default now
+        """
+        self.device = device
+        self.baseline = baseline
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.log_path = log_path
+        self.log = None
+        self.on_trip = on_trip
+        self.targets = [baseline]*5
+        # time.perf_counter() since when each zone is above above_temp
+        self._above_since = [None]*5
+        # time.perf_counter() at the end of the last hold, None before the first
+        self._hold_end = None
+        # time.perf_counter() that session times in the log are relative to
+        self.start = time.perf_counter() if start is None else start
+        # one dict per trip
+        self.trips = []
+        self.tripped = False
+        if self.log_path is not None:
+            self.log = SessionLog(self.log_path)
+            self.log.write(LOG_HEADER)
+
+    def set_targets(self, temperatures):
+        """
+        :param temperatures: requested temperatures of zone 1 to 5
+        """
+        self.targets = [max(target, self.baseline) for target in temperatures]
+
+    def start_hold(self, onset, hold):
+        """
+        :param onset: time.perf_counter() of the stimulation command
+        :param hold: s the zones stay at the target
+        """
+        self._hold_end = onset + hold
+
+    def check(self, arrival, temperatures):
+        """
+        :param arrival: time.perf_counter() when the sample was read
+        :param temperatures: measured temperatures of zone 1 to 5
+        :return: True if the sample is within the limits
+        """
+        limits = self.limits
+        for zone, temperature in enumerate(temperatures):
+            reason = None
+            if temperature > limits["max_temp"]:
+                reason = "max_temp"
+            elif temperature < limits["min_temp"]:
+                reason = "min_temp"
+            elif temperature > self.targets[zone] + limits["max_overshoot"]:
+                reason = "overshoot"
+            elif temperature > limits["above_temp"]:
+                if self._above_since[zone] is None:
+                    self._above_since[zone] = arrival
+                # the time during the hold does not count
+                since = self._above_since[zone]
+                if self._hold_end is not None and self._hold_end > since:
+                    since = self._hold_end
+                if arrival - since > limits["max_time_above"]:
+                    reason = "time_above"
+            else:
+                self._above_since[zone] = None
+            if reason is not None:
+                self.trip(reason, arrival, zone, temperature)
+                return False
+        return True
+
+    def trip(self, reason, arrival, zone, temperature):
+        # abort first, everything else after
+        try:
+            self.device.abort_to_baseline(self.baseline)
+            latency = time.perf_counter() - arrival
+        except Exception as e:
+            print(f"SAFETY: abort command failed: {e}")
+            latency = float("nan")
+        self.tripped = True
+        trip = {"session_s": arrival - self.start, "reason": reason, "zone": zone + 1,
+                "temperature": temperature, "target": self.targets[zone], "latency": latency}
+        self.trips.append(trip)
+        print(f"SAFETY STOP: {reason}, zone {zone+1}: {temperature} °C "
+              f"(target {self.targets[zone]} °C), latency {latency*1000:.3f} ms")
+        if self.log is not None:
+            self.log.write("%.4f" % trip["session_s"]+","+reason+","+str(zone+1)+","+str(temperature)+","
+                           +str(self.targets[zone])+","+"%.3f" % (latency*1000))
+        if self.on_trip is not None:
+            self.on_trip(reason)
+
+    def close(self):
+        """
+        writes the queued trips and closes the log
+        """
+        if self.log is not None:
+            self.log.close()
+
+    def message(self):
+        """
+        :return: text for the operator about the last trip, "" if none
+        """
+        if not self.trips:
+            return ""
+        trip = self.trips[-1]
+        return (f"Safety stop: {trip['reason']} on zone {trip['zone']} "
+                f"({trip['temperature']} °C, target {trip['target']} °C).\n"
+                f"All zones were sent to {self.baseline} °C.")
+
+
+class IdleMonitor:
+    """
+    reads the zones for the watchdog between the recordings
+    use: monitor.start(); monitor.pause() before the session uses the
+         port and monitor.resume() after; monitor.close() at the end
+    """
+    def __init__(self, watchdog, read, rate=MONITOR_RATE_HZ, stop=None):
+        """
+        :param watchdog: SafetyWatchdog that checks the samples
+        :param read: function without arguments, e.g. TcsDevice.get_temperatures
+        :param rate: reads per second
+        :param stop: optional threading.Event of the session, ends the monitor
+        """
+        self.watchdog = watchdog
+        self.read = read
+        self.period = 1.0 / rate
+        self.stop = stop
+        # set while the monitor may use the port
+        self._running = threading.Event()
+        # held during a read
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._running.set()
+        self._thread = threading.Thread(target=self._loop, name="safety-monitor", daemon=True)
+        self._thread.start()
+
+    def pause(self):
+        """
+        returns when the monitor no longer uses the port
+        """
+        self._running.clear()
+        with self._lock:
+            pass
+
+    def resume(self):
+        self._running.set()
+
+    def close(self):
+        self._closed.set()
+        self._running.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _stopped(self):
+        return self._closed.is_set() or (self.stop is not None and self.stop.is_set())
+
+    def _loop(self):
+        next_read = time.perf_counter()
+        while True:
+            self._running.wait()
+            if self._stopped():
+                return
+            with self._lock:
+                if not self._running.is_set():
+                    continue
+                try:
+                    temperatures = self.read()
+                except OSError as e:
+                    print(f"SAFETY: monitor read failed: {e}")
+                    return
+                if temperatures:
+                    self.watchdog.check(time.perf_counter(), temperatures)
+            # no catching up after a pause
+            next_read = max(next_read + self.period, time.perf_counter())
+            self._closed.wait(next_read - time.perf_counter())
@@ -0,0 +1,132 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import time
+from trial_scheduler import wait_until
+
+'''
+    Reads the thermode at a fixed rate instead of as fast as possible.
+    Reads are due at start + k/rate. Between reads the thread sleeps (only
+    the last SPIN_SEC is a busy wait), so a 100 Hz recording uses a few
+    percent of a core instead of a whole one.
+    A late read does not shift the following ones: the sampler reads again
+    right away until it is back on the grid, so the number of samples stays
+    rate * duration. If it falls more than MAX_BACKLOG_SEC behind (e.g. the
+    port stalled) it gives up the missed reads and counts them as skipped.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+DEFAULT_RATE_HZ = 100
+# busy wait before each read, shorter than trial_scheduler.SPIN_SEC
+# (longer on Windows, see trial_scheduler.timer_tick())
+SPIN_SEC = 0.0005
+# a read that starts later than this after its deadline counts as missed
+LATE_TOLERANCE_SEC = 0.001
+MAX_BACKLOG_SEC = 0.5
+
+
+class SamplerStats:
+    """
+    result of Sampler.run()
+    """
+    def __init__(self, rate):
+        self.target_rate = rate
+        # reads done and reads that returned temperatures
+        self.reads = 0
+        self.samples = 0
+        # reads that started more than LATE_TOLERANCE_SEC after their deadline
+        self.missed = 0
+        # reads given up after falling more than MAX_BACKLOG_SEC behind
+        self.skipped = 0
+        self.max_lateness = 0.0
+        # times of the first and last sample, s since start
+        self.first = None
+        self.last = None
+
+    def achieved_rate(self):
+        """
+        :return: samples per second (0 with less than 2 samples)
+        """
+        if self.samples < 2 or self.last <= self.first:
+            return 0.0
+        return (self.samples - 1) / (self.last - self.first)
+
+    def __str__(self):
+        return (f"{self.achieved_rate():.1f} Hz of {self.target_rate} Hz, "
+                f"missed deadlines: {self.missed}, skipped: {self.skipped}, "
+                f"max late: {self.max_lateness*1000:.2f} ms")
+
+
+class Sampler:
+    """
+    calls read() rate times per second
+    """
+    def __init__(self, read, rate=DEFAULT_RATE_HZ, stop=None):
+        """
+        :param read: function without arguments, returns the sample or an
+            empty value if the read failed (e.g. TcsDevice.get_temperatures)
+        :param rate: reads per second
+        :param stop: optional threading.Event that ends run() early
+        """
+        if rate <= 0:
+            raise ValueError("rate has to be positive")
+        self.read = read
+        self.rate = rate
+        self.period = 1.0 / rate
+        self.stop = stop
+
+    def run(self, duration, on_sample, start=None):
+        """
+        reads until duration s after start
+        :param on_sample: function(time since start in s, sample), called for
+            every successful read
+        :param start: time.perf_counter() of the first read, default now
+        :return: SamplerStats
+        """
+        stats = SamplerStats(self.rate)
+        start = time.perf_counter() if start is None else start
+        end = start + duration
+        k = 0
+        while True:
+            deadline = start + k * self.period
+            if deadline > end:
+                break
+            lateness = wait_until(deadline, self.stop, SPIN_SEC)
+            if lateness is None:
+                break
+            if lateness > MAX_BACKLOG_SEC:
+                # too far behind to catch up, continue from now
+                behind = int(lateness / self.period)
+                stats.skipped += behind
+                k += behind
+                lateness -= behind * self.period
+            if lateness > LATE_TOLERANCE_SEC:
+                stats.missed += 1
+            stats.max_lateness = max(stats.max_lateness, lateness)
+            sample = self.read()
+            now = time.perf_counter()
+            stats.reads += 1
+            if sample:
+                stats.samples += 1
+                if stats.first is None:
+                    stats.first = now - start
+                stats.last = now - start
+                on_sample(now - start, sample)
+            k += 1
+        return stats
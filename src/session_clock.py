@@ -0,0 +1,68 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import time
+from datetime import datetime
+
+'''
+    Clock for the session timestamps.
+    Based on time.perf_counter(): monotonic, not changed by NTP or the
+    user setting the system time, and with sub-microsecond resolution on
+    Windows, Linux and macOS (time.monotonic() is only ~15 ms on Windows).
+    The driver, the scheduler and the marker dispatcher use the same clock,
+    so their times can be given relative to the session start with
+    to_session_ms().
+    Replaces pygame.time.get_ticks() (integer ms since pygame.init()).
+'''
+
+
+class SessionClock:
+    """
+    time since the session started, the session starts with start()
+    """
+    def __init__(self):
+        # time.perf_counter() at start(), in s
+        self.start_s = None
+        # wall clock time at start(), only to put dates into the logs
+        self.start_date = None
+
+    def start(self):
+        self.start_s = time.perf_counter()
+        self.start_date = datetime.now()
+        return self
+
+    def elapsed_s(self):
+        return time.perf_counter() - self.start_s
+
+    def elapsed_ms(self):
+        """
+        :return: ms since start() as float (sub-ms resolution)
+        """
+        return self.elapsed_s() * 1e3
+
+    def to_session_ms(self, perf_counter_s):
+        """
+        :param perf_counter_s: a time.perf_counter() value
+        :return: the same moment in ms since start()
+        """
+        return (perf_counter_s - self.start_s) * 1e3
+
+    def timestamp(self):
+        """
+        :return: ms since start() formatted for the logs, e.g. '1234.567'
+        """
+        return "%.3f" % self.elapsed_ms()
@@ -0,0 +1,126 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import atexit
+import os
+import queue
+import threading
+import time
+
+'''
+    Session log files that stay open for the whole session.
+    write() only puts the line on a queue, so logging next to a stimulus
+    onset does not open, write or close a file. A writer thread writes the
+    lines in order and flushes them to the OS at most FLUSH_SEC after they
+    were queued, so a crash of the program loses at most that much.
+    close() writes what is still queued and fsyncs the file; it is called
+    at the end of the session and, for logs that are still open, when the
+    interpreter exits (also after an uncaught exception).
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+# longest time a written line stays in the buffers of the program
+FLUSH_SEC = 0.5
+# put on the queue by close()
+_CLOSE = object()
+# logs not closed yet, closed at exit
+_open_logs = set()
+_open_logs_lock = threading.Lock()
+
+
+class SessionLog:
+    """
+    use: log = SessionLog(path); log.write(line) from any thread; log.close()
+    """
+    def __init__(self, path, flush_sec=FLUSH_SEC):
+        """
+        :param path: opened in append mode, raises OSError if that is not possible
+        :param flush_sec: longest time between write() and the flush to the OS
+        """
+        self.path = path
+        self.flush_sec = flush_sec
+        self._file = open(path, "a")
+        self._queue = queue.Queue()
+        self.closed = False
+        self._thread = threading.Thread(target=self._write_loop, name="session-log", daemon=True)
+        self._thread.start()
+        with _open_logs_lock:
+            _open_logs.add(self)
+
+    def write(self, line):
+        """
+        :param line: text without the line end, written by the writer thread
+        """
+        if self.closed:
+            raise ValueError("write to closed log " + self.path)
+        self._queue.put(line + "\n")
+
+    def close(self):
+        """
+        writes the queued lines, fsyncs and closes the file; returns when done
+        """
+        with _open_logs_lock:
+            if self.closed:
+                return
+            self.closed = True
+            _open_logs.discard(self)
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def _write_loop(self):
+        # written lines not flushed yet
+        pending = False
+        last_flush = time.monotonic()
+        while True:
+            if pending:
+                timeout = max(0.0, self.flush_sec - (time.monotonic() - last_flush))
+            else:
+                timeout = None
+            try:
+                text = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                text = None
+            if text is _CLOSE:
+                return
+            if text is not None:
+                self._file.write(text)
+                pending = True
+            if pending and time.monotonic() - last_flush >= self.flush_sec:
+                self._file.flush()
+                pending = False
+                last_flush = time.monotonic()
+
+
+def close_all():
+    """
+    closes the logs that are still open, registered with atexit
+    """
+    with _open_logs_lock:
+        logs = list(_open_logs)
+    for log in logs:
+        try:
+            log.close()
+        except OSError as e:
+            print(f"Could not close {log.path}: {e}")
+
+
+atexit.register(close_all)
@@ -0,0 +1,39 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import importlib
+
+'''
+    The modules thermal_stimuli.py and heat_threshold.py need once a
+    session starts (NumPy, pyserial). The windows import them only then,
+    so that the settings window opens without waiting for them; keep this
+    module free of heavy imports.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+SESSION_MODULES = ["device_registry", "protocol_engine", "session_plan", "temperature_plot"]
+
+
+def load_session_modules(namespace):
+    """
+    imports SESSION_MODULES, already imported ones are only looked up
+    :param namespace: globals() of the window module, gets one name per module
+    """
+    for name in SESSION_MODULES:
+        namespace[name] = importlib.import_module(name)
@@ -0,0 +1,174 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import csv
+import math
+import random
+import numpy as np
+
+'''
+    Session plans generated up front from a seed.
+    A plan is a NumPy table with one row per trial: onset, zone, temperature,
+    hold, interval and marker. The session sets the temperatures of each
+    trial with TcsDevice.set_temperatures(), whose parameter cache skips the
+    zones the device already has. The same seed and parameters always give the
+    same plan; the plan is also saved next to the logs.
+    Dry run (prints the expected number of trials and duration):
+        python session_plan.py --seed 7 --duration 300
+        python session_plan.py --task heat_threshold --seed 7 --start-temp 46
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+# (the session defaults are in protocol_engine.py)
+
+PLAN_COLUMNS = ["trial", "onset_s", "zone", "temperature", "hold_s",
+                "interval_s", "marker"]
+PLAN_DTYPE = np.dtype([
+    ("trial", np.int32),
+    ("onset_s", np.float64),      # from session start, NaN if self-paced
+    ("zone", np.int8),            # 1 to 5
+    ("temperature", np.float64),  # target temperature of the zone
+    ("hold_s", np.float64),
+    ("interval_s", np.float64),   # wait after the hold, NaN if self-paced
+    ("marker", np.int16),
+])
+
+
+def new_seed():
+    return random.randrange(2**31)
+
+
+def make_thermal_stimuli_plan(seed, target_temp, time2apply, duration,
+                              intervals, areas, first_onset):
+    """
+    target temperature on the next area of areas each trial, random
+    interval from intervals, trials start until duration is over
+    """
+    rng = np.random.default_rng(seed)
+    # upper bound of the number of trials
+    n_max = int(math.ceil((duration - first_onset) / (time2apply + min(intervals)))) + 1
+    waits = rng.choice(np.asarray(intervals, dtype=np.float64), n_max)
+    onsets = first_onset + np.concatenate(([0.0], np.cumsum(time2apply + waits[:-1])))
+    n = max(0, int(np.searchsorted(onsets, duration)))
+    plan = np.zeros(n, dtype=PLAN_DTYPE)
+    plan["trial"] = np.arange(1, n + 1)
+    plan["onset_s"] = onsets[:n]
+    plan["zone"] = np.resize(np.asarray(areas), n)
+    plan["temperature"] = target_temp
+    plan["hold_s"] = time2apply
+    plan["interval_s"] = waits[:n]
+    plan["marker"] = plan["zone"]
+    return plan
+
+
+def make_heat_threshold_plan(seed, start_temp, max_temp, step, hold):
+    """
+    one row per temperature step from start_temp to max_temp, each on a
+    random zone; the session stops at the first Y so only the first rows
+    may be used, onsets are self-paced
+    """
+    rng = np.random.default_rng(seed)
+    temperatures = np.arange(start_temp, max_temp + step/2, step)
+    n = len(temperatures)
+    plan = np.zeros(n, dtype=PLAN_DTYPE)
+    plan["trial"] = np.arange(1, n + 1)
+    plan["onset_s"] = np.nan
+    plan["zone"] = rng.integers(1, 6, n)
+    plan["temperature"] = temperatures
+    plan["hold_s"] = hold
+    plan["interval_s"] = np.nan
+    plan["marker"] = plan["zone"]
+    return plan
+
+
+def expected_duration(plan):
+    """
+    :return: s from session start to the end of the last hold
+    """
+    if len(plan) == 0 or np.isnan(plan["onset_s"][-1]):
+        return float(np.sum(plan["hold_s"]))
+    return float(plan["onset_s"][-1] + plan["hold_s"][-1])
+
+
+def save_plan(plan, path, seed):
+    with open(path, "w", newline="") as f:
+        f.write("# seed: " + str(seed) + "\n")
+        writer = csv.writer(f)
+        writer.writerow(PLAN_COLUMNS)
+        for row in plan:
+            writer.writerow([row["trial"], repr(float(row["onset_s"])), row["zone"],
+                             repr(float(row["temperature"])), repr(float(row["hold_s"])),
+                             repr(float(row["interval_s"])), row["marker"]])
+
+
+def load_plan(path):
+    """
+    :return: (plan, seed) as saved by save_plan(), other columns (the
+        commands of older plans) are ignored
+    """
+    with open(path, newline="") as f:
+        seed = int(f.readline().split(":")[1])
+        rows = list(csv.DictReader(f))
+    plan = np.zeros(len(rows), dtype=PLAN_DTYPE)
+    for name in PLAN_COLUMNS:
+        plan[name] = np.asarray([row[name] for row in rows], dtype=np.float64)
+    return plan, seed
+
+
+def print_summary(plan):
+    duration = expected_duration(plan)
+    print(f"Trials: {len(plan)}")
+    print(f"Expected duration: {duration:.1f} sec")
+
+
+################################################################
+#                                                              #
+# DRY RUN FROM MAIN                                            #
+#                                                              #
+################################################################
+if __name__ == "__main__":
+    import protocol_engine
+    thermal_defaults = protocol_engine.THERMAL_STIMULI_DEFAULTS
+    heat_defaults = protocol_engine.HEAT_THRESHOLD_DEFAULTS
+    parser = argparse.ArgumentParser(description="Session plan dry run")
+    parser.add_argument("--task", choices=["thermal_stimuli", "heat_threshold"],
+                        default="thermal_stimuli")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--target-temp", type=float, default=thermal_defaults["target_temp"])
+    parser.add_argument("--hold", type=float, default=None, help="default: that of the task")
+    parser.add_argument("--duration", type=float, default=thermal_defaults["duration"])
+    parser.add_argument("--start-temp", type=int, default=heat_defaults["start_temp"])
+    parser.add_argument("--output", default=None, help="save the plan as CSV")
+    args = parser.parse_args()
+
+    seed = new_seed() if args.seed is None else args.seed
+    if args.task == "thermal_stimuli":
+        plan = make_thermal_stimuli_plan(
+            seed, args.target_temp,
+            thermal_defaults["time2apply"] if args.hold is None else args.hold,
+            args.duration, thermal_defaults["intervals"], protocol_engine.AREAS,
+            protocol_engine.FIRST_ONSET_SEC)
+    else:
+        plan = make_heat_threshold_plan(
+            seed, args.start_temp, protocol_engine.MAX_TEMP, protocol_engine.STEP_UP,
+            heat_defaults["hold_time"] if args.hold is None else args.hold)
+    print(f"Seed: {seed}")
+    print_summary(plan)
+    if args.output:
+        save_plan(plan, args.output, seed)
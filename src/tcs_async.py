@@ -0,0 +1,264 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import asyncio
+import time
+import numpy as np
+import serial
+import TcsControl_python3 as TCS
+
+'''
+    asyncio version of TcsDevice.
+    Several thermodes, the trigger box and timers can share one event loop
+    without threads. Commands are encoded, clamped and cached by the same
+    functions as in TcsControl_python3.py, so both classes send the same bytes.
+    The port is used without blocking: on Linux/macOS the event loop wakes
+    up when data arrives, on Windows the port is polled every POLL_SEC.
+    Example:
+        async def main():
+            device = await AsyncTcsDevice.open('COM5')
+            async with device.batch():
+                await device.set_durations([1]*5)
+                await device.set_temperatures([32, 32, 50, 32, 32])
+            await device.stimulate()
+            async for sample_time, temperatures in device.samples():
+                ...
+'''
+
+# polling period when the port has no file descriptor (Windows)
+POLL_SEC = 0.001
+# timeout of a get_temperatures() round trip in s
+READ_TIMEOUT = 2
+
+
+class _Batch:
+    """
+    async with device.batch(): collects the commands and sends them
+    in one write at the end (nothing is sent if the block raises)
+    """
+    def __init__(self, device):
+        self.device = device
+
+    async def __aenter__(self):
+        self.device._batch_depth += 1
+        return self.device
+
+    async def __aexit__(self, exc_type, exc, tb):
+        device = self.device
+        device._batch_depth -= 1
+        if device._batch_depth > 0:
+            return
+        data = bytes(device._tx_buffer)
+        device._tx_buffer.clear()
+        if exc_type is not None:
+            device.invalidate()
+        elif data:
+            device._write(data)
+
+
+class AsyncTcsDevice:
+    """
+    use  device = await AsyncTcsDevice.open(port)
+    """
+    def __init__(self, s_port):
+        self.s_port = s_port
+        self.baseline = 30.0
+        self._loop = asyncio.get_event_loop()
+        self._rx = bytearray()
+        self._sent = {}
+        self._tx_buffer = bytearray()
+        self._batch_depth = 0
+        self._decoder = TCS.FrameDecoder()
+        self._frame = np.zeros(6, dtype=np.int16)
+        self.neutral = None
+        self.firmware = b''
+        self.id_msg = b''
+        self.connect_time = None
+        try:
+            self._fd = s_port.fileno()
+        except (AttributeError, NotImplementedError):
+            self._fd = None
+
+    @classmethod
+    async def open(cls, port='/dev/ttyACM0'):
+        """
+        opens the port and does the same handshake as TcsDevice
+        """
+        start = time.perf_counter()
+        s_port = serial.Serial(port, 115200, timeout=0)
+        s_port.reset_input_buffer()
+        device = cls(s_port)
+        device._write(b'H')
+        banner = await device._read_until_silence(
+            TCS.HANDSHAKE_TIMEOUT, TCS.HANDSHAKE_INTERBYTE_TIMEOUT)
+        device.firmware, device.id_msg = TCS.parse_banner(banner)
+        print(device.firmware)
+        print(device.id_msg)
+        device.connect_time = time.perf_counter() - start
+        return device
+
+    async def set_quiet(self):
+        """
+        sets thermode to quiet mode, see TcsDevice.set_quiet()
+        """
+        self._send(b'F')
+
+    async def set_baseline(self, baselineTemp, force=False):
+        for command in TCS.baseline_commands(baselineTemp, self._sent, force):
+            self._send(command)
+
+    async def adjust_to_skin(self):
+        self._send(b'G')
+        self._sent.pop((b'N', 0), None)
+
+    async def set_durations(self, stimDurations, force=False):
+        self._set_zone_values(b'D', stimDurations, force)
+
+    async def set_ramp_speed(self, rampSpeeds, force=False):
+        self._set_zone_values(b'V', rampSpeeds, force)
+
+    async def set_return_speed(self, returnSpeeds, force=False):
+        self._set_zone_values(b'R', returnSpeeds, force)
+
+    async def set_temperatures(self, temperatures, force=False):
+        self._set_zone_values(b'C', temperatures, force)
+
+    async def stimulate(self):
+        self._send(b'L')
+
+    def invalidate(self):
+        """
+        forgets all values sent so far, see TcsDevice.invalidate()
+        """
+        self._sent.clear()
+
+    def batch(self):
+        return _Batch(self)
+
+    async def get_temperatures(self, timeout=READ_TIMEOUT):
+        """
+        get current temperatures of zone 1 to 5 in °C
+        :return: returns an array of five temperatures or empty array if
+            there is an error
+        """
+        self.s_port.reset_input_buffer()
+        self._rx.clear()
+        self._write(b'E')
+        deadline = time.perf_counter() + timeout
+        while len(self._rx) < TCS.FRAME_LEN:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not await self._read_some(remaining):
+                return []
+        data = bytes(self._rx[:TCS.FRAME_LEN])
+        del self._rx[:TCS.FRAME_LEN]
+        if not self._decoder.decode(data, self._frame):
+            return []
+        self.neutral = self._frame[0] / 10
+        return (self._frame[1:] / 10).tolist()
+
+    async def samples(self):
+        """
+        async iterator over the temperatures the TCS streams by itself
+        (do not use it in quiet mode)
+        yields (time.perf_counter() at arrival, [t1, t2, t3, t4, t5]),
+            frames read together are spread as in TCS.frame_times()
+        """
+        self._rx.clear()
+        previous = None
+        while True:
+            await self._read_some(None)
+            now = time.perf_counter()
+            values, consumed = TCS.parse_stream(self._rx)
+            del self._rx[:consumed]
+            if not len(values):
+                continue
+            times = TCS.frame_times(now, len(values), previous)
+            previous = times[-1]
+            for sample_time, row in zip(times.tolist(), (values[:, 1:] / 10).tolist()):
+                yield sample_time, row
+
+    def close(self):
+        if self._fd is not None:
+            self._loop.remove_reader(self._fd)
+        self.s_port.close()
+
+    def _set_zone_values(self, letter, values, force):
+        for command in TCS.zone_commands(letter, values, self._sent, force):
+            self._send(command)
+
+    def _send(self, command):
+        if self._batch_depth > 0:
+            self._tx_buffer += command
+        else:
+            self._write(command)
+
+    def _write(self, data):
+        # commands are a few bytes, the OS buffer takes them without waiting
+        try:
+            self.s_port.write(data)
+        except Exception:
+            self.invalidate()
+            raise
+
+    async def _read_some(self, timeout):
+        """
+        waits until data arrives and appends it to self._rx
+        :return: False on timeout
+        """
+        data = self.s_port.read(self.s_port.in_waiting)
+        if not data:
+            if not await self._wait_readable(timeout):
+                return False
+            data = self.s_port.read(self.s_port.in_waiting or 1)
+        self._rx += data
+        return True
+
+    async def _wait_readable(self, timeout):
+        if self._fd is None:
+            # no file descriptor to watch: poll
+            deadline = None if timeout is None else time.perf_counter() + timeout
+            while not self.s_port.in_waiting:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return False
+                await asyncio.sleep(POLL_SEC)
+            return True
+        readable = self._loop.create_future()
+        self._loop.add_reader(self._fd, self._set_readable, readable)
+        try:
+            await asyncio.wait_for(readable, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._loop.remove_reader(self._fd)
+
+    @staticmethod
+    def _set_readable(future):
+        if not future.done():
+            future.set_result(True)
+
+    async def _read_until_silence(self, timeout, silence):
+        deadline = time.perf_counter() + timeout
+        # the first byte may take a while
+        if not await self._read_some(timeout):
+            return bytearray()
+        while time.perf_counter() < deadline:
+            if not await self._read_some(silence):
+                break
+        data = self._rx[:]
+        self._rx.clear()
+        return data
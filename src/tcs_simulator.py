@@ -0,0 +1,309 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import os
+import pty
+import select
+import threading
+import time
+import tty
+
+'''
+    Simulators of the QST.lab Thermal Cutaneous Stimulator and of the
+    Neurospec MMBT-S Trigger Interface Box for testing without hardware.
+    Each simulator opens a pseudo-terminal (Linux/macOS only) and prints its
+    port, e.g. /dev/pts/3. Type that port into the COM port field of
+    thermal_stimuli.py or heat_threshold.py instead of COM5/COM8.
+    The TCS simulator understands H, F, N, G, D, V, R, C, L and E and models
+    each zone as a first-order system whose rate is limited by the ramp up
+    and return speeds. Unless it is set to quiet mode (F) it streams its
+    temperatures @1Hz, and @100Hz during stimulation, like the real device.
+    Run:
+        python tcs_simulator.py
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+FIRMWARE = b"TCS simulator firmware v1.0"
+DEVICE_ID = b"ID: SIM-0001"
+HELP_TEXT = [
+    b"H: help",
+    b"F: quiet mode",
+    b"Nxxx: neutral temperature",
+    b"G: adjust neutral temperature to skin",
+    b"Dzxxxxx: stimulation durations",
+    b"Vzxxxx: ramp up speeds",
+    b"Rzxxxx: return speeds",
+    b"Czxxx: target temperatures",
+    b"L: start stimulation",
+    b"E: current temperatures",
+]
+# command letter -> length of the whole command in bytes
+COMMAND_LEN = {b'H': 1, b'F': 1, b'G': 1, b'L': 1, b'E': 1,
+               b'N': 4, b'C': 5, b'V': 6, b'R': 6, b'D': 7}
+# command letter -> scale of the sent integer
+COMMAND_SCALE = {b'N': 10, b'C': 10, b'V': 10, b'R': 10, b'D': 1000}
+
+NEUTRAL_TEMP = 30.0
+SKIN_TEMP = 32.0
+# time constant of the zones in s
+TAU = 0.05
+# model update and streaming period in s
+STEP_SEC = 0.01
+IDLE_STREAM_SEC = 1.0
+
+
+class ThermalModel:
+    """
+    5 zones that move towards their goal temperature with first-order
+    dynamics, never faster than the ramp up (to target) or return
+    (back to neutral) speed
+    """
+    def __init__(self, neutral=NEUTRAL_TEMP, tau=TAU):
+        self.tau = tau
+        self.neutral = neutral
+        self.temperatures = [neutral]*5
+        self.targets = [neutral]*5
+        self.durations = [1.0]*5
+        self.ramp_speeds = [300.0]*5
+        self.return_speeds = [300.0]*5
+        # time.perf_counter() of the last L or None
+        self.stim_start = None
+
+    def stimulate(self, now):
+        self.stim_start = now
+
+    def is_stimulating(self, now):
+        if self.stim_start is None:
+            return False
+        if now - self.stim_start <= max(self.durations):
+            return True
+        # keep the fast rate until all zones are back
+        return any(abs(t - self.neutral) > 0.1 for t in self.temperatures)
+
+    def step(self, now, dt):
+        for i in range(5):
+            on = (self.stim_start is not None and
+                  now - self.stim_start <= self.durations[i])
+            if on:
+                goal, speed = self.targets[i], self.ramp_speeds[i]
+            else:
+                goal, speed = self.neutral, self.return_speeds[i]
+            rate = (goal - self.temperatures[i]) / self.tau
+            rate = max(-speed, min(speed, rate))
+            change = rate*dt
+            # don't overshoot the goal with big steps
+            if abs(change) > abs(goal - self.temperatures[i]):
+                self.temperatures[i] = goal
+            else:
+                self.temperatures[i] += change
+
+    def frame(self):
+        """
+        :return: '\r' + 'xxx?xxx?xxx?xxx?xxx?xxx' with '?' = sign '+' ou '-'
+        """
+        data = b'\r%03d' % round(self.neutral*10)
+        for t in self.temperatures:
+            sign = b'-' if t < 0 else b'+'
+            data += sign + b'%03d' % min(999, round(abs(t)*10))
+        return data
+
+
+class _PtySimulator:
+    """
+    opens a pseudo-terminal and runs handle()/tick() in a background thread
+    """
+    def __init__(self):
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        os.set_blocking(self.master, False)
+        self.port = os.ttyname(self.slave)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True,
+                                        name=type(self).__name__)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def close(self):
+        self.stop()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, data):
+        try:
+            os.write(self.master, data)
+        except BlockingIOError:
+            # nobody reads the port, drop the data like the device would
+            pass
+
+    def _loop(self):
+        last = time.perf_counter()
+        while not self._stop.is_set():
+            readable = select.select([self.master], [], [], STEP_SEC)[0]
+            now = time.perf_counter()
+            if readable:
+                try:
+                    data = os.read(self.master, 4096)
+                except (BlockingIOError, OSError):
+                    data = b''
+                if data:
+                    self.handle(data, now)
+            self.tick(now, now - last)
+            last = now
+
+    def handle(self, data, now):
+        pass
+
+    def tick(self, now, dt):
+        pass
+
+
+class TcsSimulator(_PtySimulator):
+    """
+    pseudo-terminal that speaks the TCS protocol used by TcsDevice
+    :param stream: start in streaming mode like the device (False = quiet)
+    """
+    def __init__(self, neutral=NEUTRAL_TEMP, tau=TAU, stream=True):
+        super(TcsSimulator, self).__init__()
+        self.model = ThermalModel(neutral, tau)
+        self.quiet = not stream
+        self.commands = []
+        self._rx = bytearray()
+        self._last_stream = 0.0
+        self._lock = threading.Lock()
+
+    def handle(self, data, now):
+        self._rx += data
+        while self._rx:
+            letter = bytes(self._rx[:1])
+            length = COMMAND_LEN.get(letter)
+            if length is None:
+                # unknown byte, skip it
+                del self._rx[:1]
+                continue
+            if len(self._rx) < length:
+                # wait for the rest of the command
+                break
+            command = bytes(self._rx[:length])
+            del self._rx[:length]
+            self.execute(command, now)
+
+    def execute(self, command, now):
+        with self._lock:
+            self.commands.append((now, command))
+            model = self.model
+            letter = command[:1]
+            if letter == b'H':
+                lines = [b'', FIRMWARE, DEVICE_ID] + HELP_TEXT
+                self.write(b'\r\n'.join(lines) + b'\r\n')
+            elif letter == b'F':
+                self.quiet = True
+            elif letter == b'G':
+                model.neutral = SKIN_TEMP
+            elif letter == b'L':
+                model.stimulate(now)
+            elif letter == b'E':
+                self.write(model.frame())
+            elif letter == b'N':
+                model.neutral = int(command[1:]) / COMMAND_SCALE[letter]
+            else:
+                zone = int(command[1:2])
+                value = int(command[2:]) / COMMAND_SCALE[letter]
+                values = {b'C': model.targets, b'D': model.durations,
+                          b'V': model.ramp_speeds,
+                          b'R': model.return_speeds}[letter]
+                zones = range(5) if zone == 0 else [zone - 1]
+                for i in zones:
+                    values[i] = value
+
+    def tick(self, now, dt):
+        with self._lock:
+            self.model.step(now, dt)
+            if self.quiet:
+                return
+            period = STEP_SEC if self.model.is_stimulating(now) else IDLE_STREAM_SEC
+            if now - self._last_stream >= period:
+                self._last_stream = now
+                self.write(self.model.frame())
+
+    def get_temperatures(self):
+        with self._lock:
+            return list(self.model.temperatures)
+
+
+class TriggerBoxSimulator(_PtySimulator):
+    """
+    pseudo-terminal standing in for the MMBT-S trigger box
+    every received byte is recorded as a marker with its arrival time
+    """
+    def __init__(self):
+        super(TriggerBoxSimulator, self).__init__()
+        # (time.perf_counter(), marker value)
+        self.markers = []
+
+    def handle(self, data, now):
+        for marker in data:
+            self.markers.append((now, marker))
+
+
+################################################################
+#                                                              #
+# RUN SIMULATORS FROM MAIN                                     #
+#                                                              #
+################################################################
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TCS and MMBT-S simulators")
+    parser.add_argument("--quiet", action="store_true",
+                        help="start the TCS in quiet mode")
+    parser.add_argument("--tau", type=float, default=TAU,
+                        help="time constant of the zones in s")
+    args = parser.parse_args()
+
+    tcs = TcsSimulator(tau=args.tau, stream=not args.quiet).start()
+    trigger_box = TriggerBoxSimulator().start()
+    print(f"Qst COM Port: {tcs.port}")
+    print(f"Acqknowledge COM Port: {trigger_box.port}")
+    print("Ctrl+C to stop")
+    begin = time.perf_counter()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    for marker_time, marker in trigger_box.markers:
+        print(f"{(marker_time - begin)*1000:.1f} ms: marker {marker}")
+    tcs.close()
+    trigger_box.close()
+    print('Done')
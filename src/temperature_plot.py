@@ -0,0 +1,237 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+from PyQt5.QtCore import *
+from PyQt5.QtGui import *
+from PyQt5.QtWidgets import *
+import threading
+import time
+import numpy as np
+
+'''
+    Live plot of the five zone temperatures for the operator.
+    Samples go into a fixed-size ring buffer (SampleRing) from whatever
+    thread records them; adding a sample is a few array writes and never
+    waits for the GUI. The widget redraws at most MAX_REDRAW_HZ times per
+    second and only draws one min/max pair per pixel column, so the cost
+    of a frame depends on the width of the widget and not on the sample
+    rate or the length of the session.
+    Dashed lines: target (red) and baseline (grey) temperature.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+# shown time span
+WINDOW_SEC = 60
+# ring buffer size: the window at 100 Hz
+RING_SAMPLES = WINDOW_SEC * 100
+MAX_REDRAW_HZ = 10
+# no line is drawn over gaps longer than this (between stimuli)
+GAP_SEC = 0.5
+ZONE_COLORS = ["#e6194b", "#3cb44b", "#ffe119", "#4363d8", "#f58231"]
+BACKGROUND_COLOR = "#202020"
+AXIS_COLOR = "#a0a0a0"
+TARGET_COLOR = "#ff4040"
+BASELINE_COLOR = "#a0a0a0"
+# y range is at least this wide around the overlays, in °C
+Y_MARGIN = 3
+MARGIN_LEFT = 40
+MARGIN_RIGHT = 10
+MARGIN_TOP = 10
+MARGIN_BOTTOM = 20
+
+
+class SampleRing:
+    """
+    the last capacity samples of (time, t1 to t5), safe to append from one
+    thread while another one reads
+    """
+    def __init__(self, capacity=RING_SAMPLES, channels=5):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, channels), dtype=np.float32)
+        # samples appended so far, the next one goes to n % capacity
+        self.n = 0
+        self._lock = threading.Lock()
+
+    def append(self, sample_time, temperatures):
+        with self._lock:
+            i = self.n % self.capacity
+            self.times[i] = sample_time
+            self.values[i] = temperatures
+            self.n += 1
+
+    def clear(self):
+        with self._lock:
+            self.n = 0
+
+    def snapshot(self, since):
+        """
+        :return: (times, values) copies of the samples at or after since, oldest first
+        """
+        with self._lock:
+            if self.n <= self.capacity:
+                times = self.times[:self.n].copy()
+                values = self.values[:self.n].copy()
+            else:
+                end = self.n % self.capacity
+                times = np.concatenate((self.times[end:], self.times[:end]))
+                values = np.concatenate((self.values[end:], self.values[:end]))
+        first = np.searchsorted(times, since)
+        return times[first:], values[first:]
+
+
+def minmax_decimate(times, values, t0, t1, n_bins):
+    """
+    splits [t0, t1) into n_bins equal bins
+    :param times: sorted sample times
+    :param values: array (n, channels)
+    :return: (bins, mins, maxs): index of every non-empty bin and the
+        min and max of each channel in it, arrays (k,) and (k, channels)
+    """
+    edges = t0 + (t1 - t0) * np.arange(n_bins + 1) / n_bins
+    inside = slice(np.searchsorted(times, t0), np.searchsorted(times, t1))
+    times, values = times[inside], values[inside]
+    starts = np.searchsorted(times, edges[:-1])
+    ends = np.searchsorted(times, edges[1:])
+    bins = np.flatnonzero(ends > starts)
+    if bins.size == 0:
+        empty = np.empty((0, values.shape[1]), dtype=values.dtype)
+        return bins, empty, empty
+    # the non-empty bins cover the samples without gaps
+    mins = np.minimum.reduceat(values, starts[bins], axis=0)
+    maxs = np.maximum.reduceat(values, starts[bins], axis=0)
+    return bins, mins, maxs
+
+
+def polygon(points):
+    """
+    :param points: float64 array (n, 2) of x, y
+    :return: QPolygonF filled without a Python loop
+    """
+    result = QPolygonF(len(points))
+    pointer = result.data()
+    pointer.setsize(len(points) * 2 * 8)
+    np.frombuffer(pointer, dtype=np.float64).reshape(len(points), 2)[:] = points
+    return result
+
+
+class TemperaturePlot(QWidget):
+    """
+    use add_sample() from any thread; the plot redraws itself
+    """
+    def __init__(self, parent=None, window_sec=WINDOW_SEC):
+        super(TemperaturePlot, self).__init__(parent)
+        self.window_sec = window_sec
+        self.ring = SampleRing()
+        self.target = None
+        self.baseline = None
+        # set by add_sample, cleared by the redraw
+        self._dirty = False
+        self._last_redraw = 0.0
+        self.setMinimumSize(400, 180)
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.redraw_if_dirty)
+        self.timer.start(int(1000 / MAX_REDRAW_HZ))
+
+    def add_sample(self, temperatures, sample_time=None):
+        """
+        :param temperatures: five temperatures in °C
+        :param sample_time: time.perf_counter() of the sample, default now
+        """
+        self.ring.append(time.perf_counter() if sample_time is None else sample_time, temperatures)
+        self._dirty = True
+
+    def set_overlays(self, target=None, baseline=None):
+        self.target = target
+        self.baseline = baseline
+        self._dirty = True
+
+    def clear(self):
+        self.ring.clear()
+        self._dirty = True
+
+    @pyqtSlot()
+    def redraw_if_dirty(self):
+        if self._dirty:
+            self.update()
+
+    def paintEvent(self, event):
+        self._dirty = False
+        self._last_redraw = time.perf_counter()
+        painter = QPainter(self)
+        painter.fillRect(self.rect(), QColor(BACKGROUND_COLOR))
+        plot = QRectF(MARGIN_LEFT, MARGIN_TOP,
+                      max(1, self.width() - MARGIN_LEFT - MARGIN_RIGHT),
+                      max(1, self.height() - MARGIN_TOP - MARGIN_BOTTOM))
+        t1 = self._last_redraw
+        t0 = t1 - self.window_sec
+        times, values = self.ring.snapshot(t0)
+        n_bins = int(plot.width())
+        bins, mins, maxs = minmax_decimate(times, values, t0, t1, n_bins)
+        y_low, y_high = self.y_range(mins, maxs)
+
+        def to_y(temperature):
+            return plot.bottom() - (temperature - y_low) / (y_high - y_low) * plot.height()
+
+        # axes
+        painter.setPen(QColor(AXIS_COLOR))
+        painter.drawRect(plot)
+        for temperature in (y_low, (y_low + y_high) / 2, y_high):
+            painter.drawText(QRectF(0, to_y(temperature) - 8, MARGIN_LEFT - 4, 16),
+                             Qt.AlignRight | Qt.AlignVCenter, "%.0f" % temperature)
+        painter.drawText(QRectF(plot.left(), plot.bottom(), plot.width(), MARGIN_BOTTOM),
+                         Qt.AlignLeft | Qt.AlignVCenter, "-%d s" % self.window_sec)
+        painter.drawText(QRectF(plot.left(), plot.bottom(), plot.width(), MARGIN_BOTTOM),
+                         Qt.AlignRight | Qt.AlignVCenter, "now")
+        # overlays
+        for temperature, color in ((self.baseline, BASELINE_COLOR), (self.target, TARGET_COLOR)):
+            if temperature is not None:
+                painter.setPen(QPen(QColor(color), 1, Qt.DashLine))
+                painter.drawLine(QPointF(plot.left(), to_y(temperature)),
+                                 QPointF(plot.right(), to_y(temperature)))
+        if bins.size == 0:
+            return
+        # one vertical min-max stroke per pixel column, joined into a polyline
+        painter.setRenderHint(QPainter.Antialiasing, False)
+        painter.setClipRect(plot)
+        x = plot.left() + bins.astype(np.float64)
+        # split where the recording paused
+        bin_sec = self.window_sec / n_bins
+        breaks = np.flatnonzero(np.diff(bins) * bin_sec > GAP_SEC) + 1
+        segments = np.split(np.arange(bins.size), breaks)
+        for zone, color in enumerate(ZONE_COLORS[:values.shape[1]]):
+            painter.setPen(QPen(QColor(color), 1))
+            points = np.empty((bins.size * 2, 2), dtype=np.float64)
+            points[0::2, 0] = x
+            points[1::2, 0] = x
+            points[0::2, 1] = to_y(mins[:, zone].astype(np.float64))
+            points[1::2, 1] = to_y(maxs[:, zone].astype(np.float64))
+            for segment in segments:
+                painter.drawPolyline(polygon(points[segment[0] * 2:(segment[-1] + 1) * 2]))
+
+    def y_range(self, mins, maxs):
+        """
+        :return: (low, high) in °C covering the data and the overlays
+        """
+        levels = [level for level in (self.target, self.baseline) if level is not None]
+        if mins.size:
+            levels += [float(mins.min()), float(maxs.max())]
+        if not levels:
+            return 20.0, 60.0
+        return min(levels) - Y_MARGIN, max(levels) + Y_MARGIN
@@ -0,0 +1,247 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import argparse
+import os
+import numpy as np
+
+'''
+    One binary file with all recorded temperatures of a session.
+    The file is a header followed by chunks, one or more per trial, and is
+    only ever appended to. A chunk is:
+        CHUNK_HEADER    trial, marker and number of samples n
+        n x float64     time of the sample in s from session start
+        n x 5 x int16   zone temperatures in 1/10 °C
+        padding to 8 bytes
+    Columns are contiguous inside a chunk, so loading is one read of the
+    file and a few np.frombuffer() calls per trial. A chunk cut short by a
+    crash is ignored by the readers.
+    Summary or CSV export of a file:
+        python temperature_store.py session_temperatures.bin [--csv out.csv]
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+FILE_EXTENSION = ".bin"
+ZONES = 5
+# stored temperature = round(°C * SCALE)
+SCALE = 10
+# samples per chunk at most, long recordings are split (10 s @100Hz)
+CHUNK_SAMPLES = 1000
+STORE_MAGIC = b"TCSTEMP1"
+STORE_VERSION = 1
+CHUNK_MAGIC = b"CHNK"
+STORE_HEADER = np.dtype([("magic", "S8"), ("version", "<u4"), ("zones", "<u4")])
+CHUNK_HEADER = np.dtype([("magic", "S4"), ("trial", "<i4"), ("marker", "<i4"), ("n", "<u4")])
+# what load_session() returns, one row per sample
+SAMPLE_DTYPE = np.dtype([
+    ("time_s", np.float64),
+    ("trial", np.int32),
+    ("marker", np.int32),
+    ("temps", np.float32, (ZONES,)),  # °C
+])
+COLUMN_NAMES = ["time_s", "trial", "marker"] + ["temp_"+str(zone+1) for zone in range(ZONES)]
+
+
+def encode(temperatures):
+    """
+    :param temperatures: array (n, 5) in °C
+    :return: int16 array (n, 5) in 1/10 °C
+    """
+    scaled = np.rint(np.asarray(temperatures, dtype=np.float64) * SCALE)
+    return np.clip(scaled, -32768, 32767).astype("<i2")
+
+
+def chunk_size(n):
+    """
+    :return: bytes of a chunk with n samples, header and padding included
+    """
+    size = CHUNK_HEADER.itemsize + n * 8 + n * ZONES * 2
+    return size + (-size) % 8
+
+
+class TemperatureStore:
+    """
+    use: store = TemperatureStore(path); store.append(trial, marker, times, temperatures)
+         after every recording; store.close() at the end of the session
+    """
+    def __init__(self, path):
+        """
+        :param path: created with a header, or appended to if it exists
+        """
+        self.path = path
+        self._file = open(path, "ab")
+        if self._file.tell() == 0:
+            header = np.zeros(1, dtype=STORE_HEADER)
+            header["magic"] = STORE_MAGIC
+            header["version"] = STORE_VERSION
+            header["zones"] = ZONES
+            self._file.write(header.tobytes())
+        else:
+            read_header(path)
+        self.closed = False
+
+    def append(self, trial, marker, times, temperatures):
+        """
+        writes the samples of one recording, in chunks of CHUNK_SAMPLES
+        :param trial: trial number
+        :param marker: marker of the trial
+        :param times: array (n,) of s from session start
+        :param temperatures: array (n, 5) in °C
+        """
+        times = np.asarray(times, dtype="<f8")
+        encoded = encode(temperatures)
+        for first in range(0, len(times), CHUNK_SAMPLES):
+            last = min(first + CHUNK_SAMPLES, len(times))
+            header = np.zeros(1, dtype=CHUNK_HEADER)
+            header["magic"] = CHUNK_MAGIC
+            header["trial"] = trial
+            header["marker"] = marker
+            header["n"] = last - first
+            chunk = bytearray(chunk_size(last - first))
+            body = header.tobytes() + times[first:last].tobytes() + encoded[first:last].tobytes()
+            chunk[:len(body)] = body
+            self._file.write(chunk)
+        # one recording at a time reaches the OS, a crash loses at most the current one
+        self._file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+
+def read_header(path):
+    """
+    raises ValueError if path is not a temperature store
+    """
+    with open(path, "rb") as f:
+        header = np.frombuffer(f.read(STORE_HEADER.itemsize), dtype=STORE_HEADER)
+    if len(header) == 0 or header["magic"][0] != STORE_MAGIC:
+        raise ValueError(path + " is not a temperature store")
+    if header["version"][0] != STORE_VERSION or header["zones"][0] != ZONES:
+        raise ValueError(path + ": unknown version or number of zones")
+    return header[0]
+
+
+def parse_chunks(data):
+    """
+    :param data: bytes of a whole store file, header included
+    :return: structured array of (trial, marker, n, offset) per complete chunk
+    """
+    chunks = []
+    offset = STORE_HEADER.itemsize
+    while offset + CHUNK_HEADER.itemsize <= len(data):
+        header = np.frombuffer(data, dtype=CHUNK_HEADER, count=1, offset=offset)[0]
+        if header["magic"] != CHUNK_MAGIC:
+            raise ValueError("Corrupt chunk at byte " + str(offset))
+        n = int(header["n"])
+        if offset + chunk_size(n) > len(data):
+            # cut short by a crash
+            break
+        chunks.append((header["trial"], header["marker"], n, offset))
+        offset += chunk_size(n)
+    return np.array(chunks, dtype=[("trial", np.int32), ("marker", np.int32),
+                                   ("n", np.int64), ("offset", np.int64)])
+
+
+def load_session(path):
+    """
+    reads the whole file at once
+    :return: (samples, index): SAMPLE_DTYPE array of all samples in the order
+        they were recorded, and dict trial -> slice of its rows in samples
+    """
+    read_header(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    chunks = parse_chunks(data)
+    samples = np.empty(int(chunks["n"].sum()), dtype=SAMPLE_DTYPE)
+    index = {}
+    row = 0
+    for trial, marker, n, offset in chunks.tolist():
+        body = offset + CHUNK_HEADER.itemsize
+        rows = slice(row, row + n)
+        samples["time_s"][rows] = np.frombuffer(data, dtype="<f8", count=n, offset=body)
+        temps = np.frombuffer(data, dtype="<i2", count=n * ZONES, offset=body + n * 8)
+        samples["temps"][rows] = temps.reshape(n, ZONES) / np.float32(SCALE)
+        samples["trial"][rows] = trial
+        samples["marker"][rows] = marker
+        start = index[trial].start if trial in index else row
+        index[trial] = slice(start, row + n)
+        row += n
+    return samples, index
+
+
+def read_trial(path, trial):
+    """
+    reads only the chunks of one trial
+    :return: SAMPLE_DTYPE array, empty if the trial is not in the file
+    """
+    read_header(path)
+    with open(path, "rb") as f:
+        f.seek(STORE_HEADER.itemsize)
+        parts = []
+        while True:
+            raw = f.read(CHUNK_HEADER.itemsize)
+            if len(raw) < CHUNK_HEADER.itemsize:
+                break
+            header = np.frombuffer(raw, dtype=CHUNK_HEADER)[0]
+            n = int(header["n"])
+            rest = chunk_size(n) - CHUNK_HEADER.itemsize
+            if header["trial"] != trial:
+                f.seek(rest, os.SEEK_CUR)
+                continue
+            body = f.read(rest)
+            if len(body) < rest:
+                break
+            part = np.empty(n, dtype=SAMPLE_DTYPE)
+            part["time_s"] = np.frombuffer(body, dtype="<f8", count=n)
+            part["temps"] = np.frombuffer(body, dtype="<i2", count=n * ZONES,
+                                          offset=n * 8).reshape(n, ZONES) / np.float32(SCALE)
+            part["trial"] = trial
+            part["marker"] = header["marker"]
+            parts.append(part)
+    if not parts:
+        return np.empty(0, dtype=SAMPLE_DTYPE)
+    return np.concatenate(parts)
+
+
+def to_csv(samples, path):
+    table = np.column_stack((samples["time_s"], samples["trial"], samples["marker"], samples["temps"]))
+    np.savetxt(path, table, delimiter=",", fmt=["%.4f", "%d", "%d"] + ["%.1f"]*ZONES,
+               header=",".join(COLUMN_NAMES), comments="")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summary or CSV export of a temperature store")
+    parser.add_argument("path")
+    parser.add_argument("--csv", default=None, help="write all samples as CSV")
+    args = parser.parse_args()
+
+    samples, index = load_session(args.path)
+    print(f"Trials: {len(index)}, samples: {len(samples)}")
+    for trial, rows in index.items():
+        part = samples[rows]
+        print(f"trial {trial}: marker {part['marker'][0]}, {len(part)} samples, "
+              f"{part['time_s'][0]:.3f} to {part['time_s'][-1]:.3f} s, "
+              f"max {part['temps'].max():.1f} °C")
+    if args.csv:
+        to_csv(samples, args.csv)
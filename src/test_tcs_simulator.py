@@ -0,0 +1,227 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import sys
+import time
+import numpy as np
+import pytest
+import TcsControl_python3 as TCS
+import temperature_store
+import live_recording
+import analyze_sessions
+
+'''
+    Tests against the TCS simulator, no hardware needed:
+        python -m pytest -q
+    The simulator opens a pseudo-terminal, so the tests that talk to it
+    only run on Linux/macOS.
+'''
+
+#########################################################
+# CONSTANT PARAMETERS
+
+NEUTRAL_TEMP = 32.0
+TARGET_TEMP = 50.0
+# zone 3, index 2
+ZONE = 2
+# time to let the simulator handle what was sent in s
+SETTLE_SEC = 0.05
+
+needs_pty = pytest.mark.skipif(sys.platform == "win32",
+                               reason="the TCS simulator needs a pseudo-terminal")
+
+
+@pytest.fixture
+def simulator():
+    from tcs_simulator import TcsSimulator
+    with TcsSimulator(neutral=NEUTRAL_TEMP, stream=False) as sim:
+        yield sim
+
+
+@pytest.fixture
+def device(simulator):
+    device = TCS.TcsDevice(simulator.port)
+    yield device
+    device.close()
+
+
+def sent_commands(simulator, first=0):
+    time.sleep(SETTLE_SEC)
+    return [command for now, command in simulator.commands[first:]]
+
+
+def make_frame(neutral, temperatures):
+    from tcs_simulator import ThermalModel
+    model = ThermalModel(neutral)
+    model.temperatures = list(temperatures)
+    return model.frame()
+
+
+def test_parse_stream_skips_noise_and_keeps_incomplete_frame():
+    first = make_frame(32.0, [32.0, 32.5, 50.0, 31.9, -1.5])
+    second = make_frame(30.0, [30.0, 30.0, 30.0, 30.0, 30.0])
+    data = b"xx" + first + b"\n" + second + second[:10]
+    values, consumed = TCS.parse_stream(data)
+    assert values.tolist() == [[320, 320, 325, 500, 319, -15],
+                               [300, 300, 300, 300, 300, 300]]
+    assert data[consumed:] == second[:10]
+
+
+def test_parse_stream_drops_corrupt_frames():
+    bad = bytearray(make_frame(32.0, [32.0]*5))
+    bad[5] = ord("x")
+    values, consumed = TCS.parse_stream(bytes(bad) + make_frame(31.0, [31.0]*5))
+    assert values.tolist() == [[310]*6]
+
+
+def test_frame_decoder_matches_parse_stream():
+    frame = make_frame(32.0, [33.3, 32.0, 49.9, 0.5, -0.1])
+    out = np.zeros(6, dtype=np.int16)
+    assert TCS.FrameDecoder().decode(frame, out)
+    assert out.tolist() == TCS.parse_stream(frame)[0][0].tolist()
+    assert not TCS.FrameDecoder().decode(frame[:-1], out)
+
+
+def test_zone_commands_only_changed_zones():
+    sent = {}
+    assert TCS.zone_commands(b'C', [32.0]*5, sent) == [b'C0320']
+    assert TCS.zone_commands(b'C', [32.0]*5, sent) == []
+    assert TCS.zone_commands(b'C', [32.0, 32.0, 50.0, 32.0, 32.0], sent) == [b'C3500']
+    assert TCS.zone_commands(b'C', [32.0, 32.0, 50.0, 32.0, 32.0], sent, force=True) == \
+        [b'C1320', b'C2320', b'C3500', b'C4320', b'C5320']
+
+
+@needs_pty
+def test_device_sends_only_changed_values(device, simulator):
+    first = len(simulator.commands)
+    device.set_temperatures([NEUTRAL_TEMP]*5)
+    device.set_temperatures([NEUTRAL_TEMP]*5)
+    assert sent_commands(simulator, first) == [b'C0320']
+    device.invalidate()
+    device.set_temperatures([NEUTRAL_TEMP]*5)
+    assert sent_commands(simulator, first) == [b'C0320', b'C0320']
+    assert simulator.model.targets == [NEUTRAL_TEMP]*5
+
+
+@needs_pty
+def test_batch_sends_all_commands_at_the_end(device, simulator):
+    first = len(simulator.commands)
+    with device.batch():
+        device.set_durations([0.5]*5)
+        with device.batch():
+            device.set_temperatures([NEUTRAL_TEMP, NEUTRAL_TEMP, TARGET_TEMP, NEUTRAL_TEMP, NEUTRAL_TEMP])
+        assert sent_commands(simulator, first) == []
+    assert sent_commands(simulator, first) == [b'D000500', b'C1320', b'C2320', b'C3500',
+                                               b'C4320', b'C5320']
+
+
+@needs_pty
+def test_batch_sends_nothing_if_the_block_raises(device, simulator):
+    first = len(simulator.commands)
+    with pytest.raises(RuntimeError):
+        with device.batch():
+            device.set_temperatures([TARGET_TEMP]*5)
+            raise RuntimeError
+    assert sent_commands(simulator, first) == []
+    # the values were never sent, so they are not cached either
+    device.set_temperatures([TARGET_TEMP]*5)
+    assert sent_commands(simulator, first) == [b'C0500']
+
+
+@needs_pty
+def test_get_temperatures_polls_the_simulator(device, simulator):
+    device.set_quiet()
+    time.sleep(SETTLE_SEC)
+    assert device.get_temperatures() == [NEUTRAL_TEMP]*5
+    assert device.neutral == NEUTRAL_TEMP
+
+
+def test_temperature_store_round_trip(tmp_path):
+    path = str(tmp_path / "session_temperatures.bin")
+    rng = np.random.default_rng(1)
+    # the first trial spans several chunks
+    n = [temperature_store.CHUNK_SAMPLES + 10, 20]
+    times = [np.arange(count) * 0.01 for count in n]
+    temps = [np.round(rng.uniform(20, 55, (count, 5)), 1) for count in n]
+    store = temperature_store.TemperatureStore(path)
+    store.append(1, 11, times[0], temps[0])
+    store.close()
+    # reopened to append, like a resumed session
+    store = temperature_store.TemperatureStore(path)
+    store.append(2, 12, times[1], temps[1])
+    store.close()
+
+    samples, index = temperature_store.load_session(path)
+    assert sorted(index) == [1, 2]
+    for i, trial in enumerate([1, 2]):
+        rows = samples[index[trial]]
+        np.testing.assert_array_equal(rows["time_s"], times[i])
+        np.testing.assert_allclose(rows["temps"], temps[i], atol=0.01)
+        assert set(rows["marker"].tolist()) == {10 + trial}
+        np.testing.assert_array_equal(temperature_store.read_trial(path, trial), rows)
+    assert len(temperature_store.read_trial(path, 3)) == 0
+
+
+def test_live_recording_round_trip(tmp_path):
+    path = str(tmp_path / "session_live.bin")
+    live = live_recording.LiveRecording(path, 10)
+    reader = live_recording.LiveReader(path)
+    live.append(0.5, 1, 11, [32.0, 32.0, 50.0, 32.0, 32.0])
+    assert len(reader.new_rows()) == 1
+    live.append(0.6, 1, 11, [32.0, 32.0, 49.9, 32.0, 32.0])
+    rows = reader.new_rows()
+    assert rows["time_s"].tolist() == [0.6]
+    assert not reader.is_closed()
+    live.close()
+    assert reader.is_closed()
+
+    samples = live_recording.to_samples(live_recording.LiveReader(path).rows())
+    assert samples["time_s"].tolist() == [0.5, 0.6]
+    assert samples["trial"].tolist() == [1, 1]
+    np.testing.assert_allclose(samples["temps"][:, ZONE], [50.0, 49.9], atol=0.01)
+
+
+@needs_pty
+def test_trial_features_of_a_simulated_stimulus(device, simulator):
+    device.set_quiet()
+    with device.batch():
+        device.set_baseline(NEUTRAL_TEMP)
+        device.set_durations([0.5]*5)
+        device.set_ramp_speed([100]*5)
+        device.set_return_speed([100]*5)
+        device.set_temperatures([NEUTRAL_TEMP, NEUTRAL_TEMP, TARGET_TEMP, NEUTRAL_TEMP, NEUTRAL_TEMP])
+    time.sleep(SETTLE_SEC)
+    onset = time.perf_counter()
+    device.stimulate()
+    times = []
+    temps = []
+    while time.perf_counter() - onset < 1.2:
+        temperatures = device.get_temperatures()
+        if temperatures:
+            times.append(time.perf_counter() - onset)
+            temps.append(temperatures)
+        time.sleep(0.005)
+
+    features = analyze_sessions.trial_features(np.array([times]), np.array([temps]),
+                                               np.array([ZONE]), np.array([TARGET_TEMP]))
+    # 18 °C @100 °C/s, the last few tenths slower
+    assert 0.1 < features["time_to_target_s"][0] < 0.4
+    assert features["peak_temp"][0] == pytest.approx(TARGET_TEMP, abs=0.1)
+    assert features["overshoot"][0] == pytest.approx(0, abs=0.1)
+    assert features["plateau_mean"][0] == pytest.approx(TARGET_TEMP, abs=0.5)
+    assert features["baseline_temp"][0] == NEUTRAL_TEMP
+    assert 0.1 < features["return_time_s"][0] < 0.5
@@ -18,16 +18,14 @@
 from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 from PyQt5.QtWidgets import *
-import pandas as pd
-import numpy as np
-import random
-import serial
-import os
 import sys
-import time
-import pygame
-from datetime import datetime
-import TcsControl_python3 as TCS
+from session_modules import load_session_modules
+
+# imported by load_session_modules() when a session starts, see session_modules.py
+device_registry = None
+protocol_engine = None
+session_plan = None
+temperature_plot = None
 
 '''
     The program will apply thermal stimulus multiple times during the session. 
@@ -37,6 +35,8 @@ import TcsControl_python3 as TCS
     session information, target temperature and the baseline temperature.
     During the session, a marker will be send to the serial port of Neurospec: MMBT-S Trigger Interface Box.
     The value of the marker will match the current area on the thermode, where the target temperature is applied.
+    The session itself is protocol_engine.ThermalStimuliSession, the same as
+    in run_protocol.py; this window only collects the settings and shows the progress.
 '''
 
 #########################################################
@@ -48,10 +48,6 @@ BAUDRATE = 9600
 
 # Stimulus duration
 TIME2APPLY_SEC = 1
-# Wait time before next stimulus
-MIN_INTERVAL = 8
-MAX_INTERVAL = 12
-INTERVAL_SEC = np.arange(MIN_INTERVAL,MAX_INTERVAL,0.5)
 # Baseline temperature
 BASELINE_TEMP = 32.0
 # Temp to apply in C
@@ -60,20 +56,40 @@ TARGET_TEMP = 51.0
 TOTAL_DURATION_SEC = 300
 
 
-LOG_FOLDER = "_HEAT_LOGS"
 SUBJECT_ID = "00"
 SESSION = "00"
-# DURATIONS       = [TIME2APPLY_SEC]*5     # stimulation durations in s for the 5 zones
-RAMP_SPEED      = [300.0]*5              # ramp up speed in °C/s for the 5 zones
-RETURN_SPEED    = [300.0]*5              # ramp down speed in °C/s for the 5 zones
-AREAS = [1,4,2,5,3]
-BEGIN_MARKER = 11
-END_MARKER = 22
 
-MAX_TEMP = 60
-MIN_TEMP = 15
-MIN_TIME2APPLY = 1
-MAX_TIME2APPLY = 10
+# temperature reads per second while recording (10, 50 or 100)
+SAMPLE_RATE_HZ = 100
+
+
+########################################
+# SESSION WORKER CLASS
+######################################
+class SessionWorker(QObject):
+    """
+    runs the session in its own thread, so that the GUI stays responsive
+    and Stop works during a stimulus; passes the engine callbacks on as signals
+    """
+    # trial number, marker, temperature
+    trial = pyqtSignal(int, int, float)
+    # time since onset (s)
+    progress = pyqtSignal(float)
+    finished = pyqtSignal()
+
+    def __init__(self, engine):
+        super(SessionWorker, self).__init__()
+        self.engine = engine
+        engine.on_trial = self.trial.emit
+        engine.on_progress = self.progress.emit
+
+    @pyqtSlot()
+    def run(self):
+        try:
+            self.engine.run()
+        finally:
+            self.finished.emit()
+################### end SessionWorker class
 
 
 ########################################
@@ -98,12 +114,13 @@ class MySettingsWidget(QMainWindow):
 
         self.task_on = False
 
-        # logging
-        self.current_path = os.path.dirname(os.path.abspath(__file__))
-        self.dump_path = os.path.join(self.current_path,LOG_FOLDER)
-
-        # start index of available areas
-        self.current_area_idx = 0
+        # protocol_engine.ThermalStimuliSession, see start_task
+        self.engine = None
+        # the session runs in this thread
+        self.worker = None
+        self.worker_thread = None
+        # live temperatures, added below the settings at the first session
+        self.plot = None
 
         # user input
         self.task_params_dict = {
@@ -113,6 +130,8 @@ class MySettingsWidget(QMainWindow):
                                     "baseline_temp":BASELINE_TEMP,
                                     'time2apply':TIME2APPLY_SEC,
                                     "duration":TOTAL_DURATION_SEC,
+                                    "seed":"",
+                                    "sample_rate":SAMPLE_RATE_HZ,
                                     "com_acqknoledge":COM_ACQKNOLEDGE,
                                     "com_qst":COM_QST
                                 }
@@ -140,6 +159,10 @@ class MySettingsWidget(QMainWindow):
         self.duration_text = QLineEdit(str(self.task_params_dict["duration"]))
         self.duration_text.setValidator(QIntValidator())
         self.main_layout.addRow(self.duration_label,self.duration_text)
+        self.seed_label = QLabel("Seed (empty = random):")
+        self.seed_text = QLineEdit(self.task_params_dict["seed"])
+        self.seed_text.setValidator(QIntValidator(0, 2**31 - 1))
+        self.main_layout.addRow(self.seed_label,self.seed_text)
         self.com_qst_label = QLabel("Qst COM Port:")
         self.com_qst_text = QLineEdit(self.task_params_dict["com_qst"])
         self.main_layout.addRow(self.com_qst_label,self.com_qst_text)
@@ -151,6 +174,9 @@ class MySettingsWidget(QMainWindow):
         self.main_layout.addRow("",self.start_btn)
         self.stop_btn = QPushButton("Stop")
         self.main_layout.addRow("",self.stop_btn)
+        self.status_label = QLabel("")
+        self.main_layout.addRow("",self.status_label)
+        self.trial_text = ""
 
         self.start_btn.clicked.connect(self.read_user_input)
         self.stop_btn.clicked.connect(self.close_all)
@@ -168,12 +194,14 @@ class MySettingsWidget(QMainWindow):
 
     def read_user_input(self):
         if self.task_on == False:
+            # the limits and the intervals are those of protocol_engine
+            load_session_modules(globals())
             self.task_params_dict["subjectID"] = self.participant_id_text.text()
             self.task_params_dict["session"] = self.session_id_text.text()
             try:
                 self.task_params_dict["target_temp"] = float(self.temperature_text.text())
-                if self.task_params_dict["target_temp"] > MAX_TEMP or self.task_params_dict["target_temp"] < MIN_TEMP:
-                    msg = "Max temperature is "+str(MAX_TEMP)+" and min temperature is "+str(MIN_TEMP)
+                if self.task_params_dict["target_temp"] > protocol_engine.MAX_TEMP or self.task_params_dict["target_temp"] < protocol_engine.MIN_TEMP:
+                    msg = "Max temperature is "+str(protocol_engine.MAX_TEMP)+" and min temperature is "+str(protocol_engine.MIN_TEMP)
                     self.show_info_dialog(msg)
                     return
             except:
@@ -181,8 +209,8 @@ class MySettingsWidget(QMainWindow):
                 return
             try:
                 self.task_params_dict["baseline_temp"] = float(self.temperature_base_text.text())
-                if self.task_params_dict["baseline_temp"] > MAX_TEMP or self.task_params_dict["baseline_temp"] < MIN_TEMP:
-                    msg = "Max temperature is "+str(MAX_TEMP)+" and min temperature is "+str(MIN_TEMP)
+                if self.task_params_dict["baseline_temp"] > protocol_engine.MAX_TEMP or self.task_params_dict["baseline_temp"] < protocol_engine.MIN_TEMP:
+                    msg = "Max temperature is "+str(protocol_engine.MAX_TEMP)+" and min temperature is "+str(protocol_engine.MIN_TEMP)
                     self.show_info_dialog(msg)
                     return
             except:
@@ -190,8 +218,8 @@ class MySettingsWidget(QMainWindow):
                 return
             try:
                 self.task_params_dict['time2apply'] = abs(float(self.time2apply_text.text()))
-                if self.task_params_dict["time2apply"] > MAX_TIME2APPLY or self.task_params_dict["time2apply"] < MIN_TIME2APPLY:
-                    msg = "Max time to apply is "+str(MAX_TIME2APPLY)+" and min time to apply is "+str(MIN_TIME2APPLY)
+                if self.task_params_dict["time2apply"] > protocol_engine.MAX_TIME2APPLY or self.task_params_dict["time2apply"] < protocol_engine.MIN_TIME2APPLY:
+                    msg = "Max time to apply is "+str(protocol_engine.MAX_TIME2APPLY)+" and min time to apply is "+str(protocol_engine.MIN_TIME2APPLY)
                     self.show_info_dialog(msg)
                     return
             except:
@@ -199,8 +227,8 @@ class MySettingsWidget(QMainWindow):
                 return
             try:
                 duration = abs(int(self.duration_text.text()))
-                if duration <= (self.task_params_dict["time2apply"]+MAX_INTERVAL+1):
-                    msg = "Total duration has to be at least "+ str(self.task_params_dict["time2apply"]+MAX_INTERVAL+1)+" sec."
+                if duration <= (self.task_params_dict["time2apply"]+protocol_engine.MAX_INTERVAL+1):
+                    msg = "Total duration has to be at least "+ str(self.task_params_dict["time2apply"]+protocol_engine.MAX_INTERVAL+1)+" sec."
                     self.show_info_dialog(msg)
                     return
                 else:
@@ -208,11 +236,20 @@ class MySettingsWidget(QMainWindow):
             except:
                 self.show_info_dialog("Total duration has to be an integer.")
                 return
+            if self.seed_text.text().strip():
+                try:
+                    self.task_params_dict["seed"] = int(self.seed_text.text())
+                    if self.task_params_dict["seed"] < 0:
+                        raise ValueError("negative seed")
+                except ValueError:
+                    self.show_info_dialog("The seed has to be an integer of 0 or more.")
+                    return
+            else:
+                self.task_params_dict["seed"] = session_plan.new_seed()
             self.task_params_dict["com_qst"] = self.com_qst_text.text()
             self.task_params_dict["com_acqknoledge"] = self.com_acqk_text.text()
+            self.task_params_dict["intervals"] = protocol_engine.INTERVAL_SEC
             self.task_on = True
-            # reset area intex
-            self.current_area_idx = 0
             self.start_task()
 
     def start_task(self):
@@ -225,134 +262,69 @@ class MySettingsWidget(QMainWindow):
         self.connect2qst()
         # if self.qst_connected == True:
         if self.qst_connected == True and self.acq_connected == True:
-            print("Begin")
-            self.configure_logging()
-            pygame.init()
-            self.begin_time = pygame.time.get_ticks()
-            # log
-            f = open(self.log_path, "a")
-            f.write(str(self.begin_time)+","+datetime.now().strftime("%Y_%m_%d_%H_%M_%S")+","+str(BEGIN_MARKER)+"\n")
-            f.close()
-            # send begin marker to acqknowledge
-            self.send_marker(BEGIN_MARKER)
-            time.sleep(1)
-            self.stimulate()
+            self.engine = protocol_engine.ThermalStimuliSession(self.task_params_dict, self.qst, self.acq)
+            self.show_plot()
+            try:
+                self.engine.configure_device()
+            except:
+                self.show_info_dialog("Could not connect to Qst")
+                self.session_finished()
+                return
+            try:
+                self.engine.configure_logging()
+            except OSError as e:
+                self.show_info_dialog(str(e))
+                sys.exit()
+            self.start_worker()
         else:
             self.show_info_dialog("One or both devices are not connected.")
-        ###################################################################
-        # pygame.init()
-        # self.begin_time = pygame.time.get_ticks()
-        # self.configure_logging()
-        # f = open(self.log_path, "a")
-        # f.write(str(self.begin_time)+","+datetime.now().strftime("%Y_%m_%d_%H_%M_%S")+","+str(BEGIN_MARKER)+"\n")
-        # f.close()
-        # self.stimulate()
-        ###################################################################
-
-    def stimulate(self):
-        if self.task_on == True:
-            # set temperatures
-            # check if the time is right
-            curr_dur = (pygame.time.get_ticks() - self.begin_time) / 1000
-            if curr_dur < self.task_params_dict["duration"]: # if total duration is not over yet
-                if self.current_area_idx >= len(AREAS):
-                    self.current_area_idx = 0
-                temps = [self.task_params_dict["baseline_temp"] for el in AREAS]
-                current_area = AREAS[self.current_area_idx]
-                temps[current_area-1] = self.task_params_dict["target_temp"] # current_area-1 (-1 because area index starts at 0)
-                marker = current_area
-                self.current_area_idx+=1
-                curr_temp = self.task_params_dict["target_temp"]
-                print(f"Current area: {marker}, Temperature: {curr_temp}")
-                # log
-                f = open(self.log_path, "a")
-                f.write(str(pygame.time.get_ticks())+","+datetime.now().strftime("%Y_%m_%d_%H_%M_%S")+","+str(marker)+"\n")
-                f.close()
-                ###########################################
-                # time.sleep(TIME2APPLY_SEC+0.25) # wait when not "really" applying stimulus
-                #################################################################
-                # send marker and begin stimulation
-                self.send_marker(marker)
-                self.qst.set_temperatures(temps)
-                self.qst.stimulate()
-                # log temperatures
-                recordDuration =self.task_params_dict["time2apply"]+0.25
-                cpt = 0
-                start_time = time.time()
-                column_names = ["temp_1", "temp_2", "temp_3", "temp_4", "temp_5"]
-                df = pd.DataFrame(columns = column_names)
-                while True:
-                    current_temperatures = self.qst.get_temperatures()
-                    data = pd.DataFrame([current_temperatures], columns=column_names)
-                    df = df.append(data)
-                    current_time = time.time()
-                    cpt = cpt + 1
-                    elapsed_time = current_time - start_time
-                    if elapsed_time > recordDuration:
-                        break
-                # save results to csv
-                curr_time = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-                file_name = curr_time+".csv"
-                temp_log_path = os.path.join(self.dump_path_subject_temp,file_name)
-                df.to_csv(temp_log_path,index=False)
-                #####################################################################
-                # wait interval
-                interval = random.choice(INTERVAL_SEC)
-                # show current duration
-                duration = (pygame.time.get_ticks() - self.begin_time)/1000
-                print(f"Sec from session start: {duration}")
-                print(f"Current interval: {interval}\n")
-                QTimer.singleShot((interval-0.25)*1000, self.stimulate)
-
-            else: # close connections
-                self.close_all()
-            
-    def send_marker(self,marker):
-        print(f"Sending marker: {marker}\n")
-        #######################################
-        arg = bytes(chr(marker), 'utf8','ignore')
-        self.acq.write(arg)
-
-    def configure_logging(self):
-        try: 
-            os.mkdir(self.dump_path)
-        except:
-            pass
-        if not os.path.exists(self.dump_path):
-            self.show_info_dialog("Your data could not be logged under default path.")
-            sys.exit()
-        try:
-            # create subject sub folrder
-            self.start_time = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
-            subfolder_name = self.task_params_dict["subjectID"]+"_"+self.task_params_dict["session"]+"_"+self.start_time 
-            self.dump_path_subject = os.path.join(self.dump_path,subfolder_name)
-            os.mkdir(self.dump_path_subject)
-        except:
-            pass
-        if not os.path.exists(self.dump_path_subject):
-            self.show_info_dialog("Your data could not be logged under default subject path.")
-            sys.exit()
-        self.log_file_name = self.task_params_dict["subjectID"]+"_"+self.task_params_dict["session"]+"_"+self.start_time +".txt"
-        self.log_path = os.path.join(self.dump_path_subject,self.log_file_name)
-        f = open(self.log_path, "a")
-        # write headers
-        f.write("ms,year_month_day_hour_min_sec,marker"+"\n")
-        f.close()
-        try:
-            # create subject temperature sub folrder
-            subfolder_temp_name = self.task_params_dict["subjectID"]+"_"+self.task_params_dict["session"]+"_"+self.start_time+"_temperatures_"+str(self.task_params_dict["target_temp"])
-            self.dump_path_subject_temp = os.path.join(self.dump_path_subject,subfolder_temp_name)
-            os.mkdir(self.dump_path_subject_temp)
-        except:
-            pass
-        if not os.path.exists(self.dump_path_subject_temp):
-            self.show_info_dialog("Your data could not be logged under default subject temperatures path.")
-            sys.exit()
-
+            self.session_finished()
+
+    def show_plot(self):
+        if self.plot is None:
+            self.plot = temperature_plot.TemperaturePlot()
+            self.main_layout.addRow(self.plot)
+        self.plot.clear()
+        self.plot.set_overlays(self.task_params_dict["target_temp"], self.task_params_dict["baseline_temp"])
+        # called in the session thread, the plot only stores the sample
+        self.engine.on_sample = self.plot_sample
+
+    def plot_sample(self, elapsed_time, temperatures):
+        self.plot.add_sample(temperatures)
+
+    @pyqtSlot(int, int, float)
+    def show_trial(self, trial, marker, curr_temp):
+        self.trial_text = f"Area: {marker}, Temperature: {curr_temp}"
+        self.status_label.setText(self.trial_text)
+
+    @pyqtSlot(float)
+    def show_progress(self, elapsed_time):
+        self.status_label.setText(f"{self.trial_text} | {elapsed_time:.1f} sec")
+
+    def start_worker(self):
+        self.worker_thread = QThread()
+        self.worker = SessionWorker(self.engine)
+        self.worker.moveToThread(self.worker_thread)
+        self.worker_thread.started.connect(self.worker.run)
+        self.worker.trial.connect(self.show_trial)
+        self.worker.progress.connect(self.show_progress)
+        self.worker.finished.connect(self.session_finished)
+        self.worker_thread.start()
+
+    def stop_worker(self):
+        if self.worker is None:
+            return
+        # the session stops within one sample and sends the end marker
+        self.engine.stop()
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+        self.worker = None
+        self.worker_thread = None
 
     def connect2acqknowledge(self):
         try:
-            self.acq = serial.Serial(self.task_params_dict["com_acqknoledge"] , baudrate= BAUDRATE, timeout = 2)
+            # reuses the port opened in a previous session
+            self.acq = device_registry.get_serial(self.task_params_dict["com_acqknoledge"] , baudrate= BAUDRATE, timeout = 2)
             self.acq_connected = True
         except:
             self.acq = None
@@ -360,52 +332,37 @@ class MySettingsWidget(QMainWindow):
 
     def connect2qst(self):
         try:
-            self.qst = TCS.TcsDevice(port=self.task_params_dict["com_qst"])
-            # Quiet mode
-            self.qst.set_quiet()
+            # reuses the device opened in a previous session if it still answers
+            self.qst = device_registry.get_tcs(self.task_params_dict["com_qst"])
             self.qst_connected = True
-            # send constant settings for the stimuli
-            self.qst.set_baseline(self.task_params_dict["baseline_temp"])
-            # set durations to user defined
-            durations = [self.task_params_dict["time2apply"]]*5
-            self.qst.set_durations(durations)
-            self.qst.set_ramp_speed(RAMP_SPEED)
-            self.qst.set_return_speed(RETURN_SPEED)
         except:
-            self.acq = None
+            self.qst = None
             self.show_info_dialog("Could not connect to Qst")
 
     def close_connections(self):
-        try:
-            self.acq.close()
-            self.acq = None
-        except:
-            print("Acq already closed")
-        try:
-            self.qst.close()
-            self.qst = None
-        except:
-            print("Qst already closed")
+        # the ports stay open in the registry for the next session
+        self.acq = None
+        self.qst = None
 
     def close_all(self):
         if self.task_on == True:
-            # total time
-            end_time = (pygame.time.get_ticks() - self.begin_time)/1000
-            print(f"Total duration: {end_time} sec\n")
-            # send end marker to acqknowledge
-            try:
-                self.send_marker(END_MARKER)
-            except:
-                print("End marker could not be sent")
-            # log
-            f = open(self.log_path, "a")
-            f.write(str(pygame.time.get_ticks())+","+datetime.now().strftime("%Y_%m_%d_%H_%M_%S")+","+str(END_MARKER)+"\n")
-            f.close()
-            self.close_connections()
-            print("The end")
-            self.start_btn.setEnabled(True)
-            self.stop_btn.setEnabled(False)
-            self.task_on = False
+            self.stop_worker()
+
+    @pyqtSlot()
+    def session_finished(self):
+        # end of the plan, Stop, or the session could not start
+        if self.worker is not None:
+            self.worker_thread.quit()
+            self.worker_thread.wait()
+            self.worker = None
+            self.worker_thread = None
+        self.task_on = False
+        self.close_connections()
+        self.start_btn.setEnabled(True)
+        self.stop_btn.setEnabled(False)
+        self.status_label.setText("")
+        if self.engine is not None and self.engine.watchdog is not None and self.engine.watchdog.tripped:
+            self.show_info_dialog(self.engine.watchdog.message())
         
     # show info that only ins are streamed
     def show_info_dialog(self, text):
@@ -417,8 +374,12 @@ class MySettingsWidget(QMainWindow):
         msgBox.exec()
 
     def closeEvent(self, event):  
+        self.stop_worker()
+        self.task_on = False
         if self.acq != None or self.qst != None:
             self.close_connections() 
+        if device_registry is not None:
+            device_registry.close_all()
 ################### end MySettingsWidget class
 
 ################################################################
@@ -434,4 +395,4 @@ if __name__ == "__main__":
     app.exec_()
    
 
-    print('Done')
\ No newline at end of file
+    print('Done')
@@ -0,0 +1,146 @@
+"""
+ Copyright (c) 2023 CSAN_LiU
+
+ This program is free software: you can redistribute it and/or modify
+ it under the terms of the GNU General Public License as published by
+ the Free Software Foundation, either version 3 of the License, or
+ (at your option) any later version.
+
+ This program is distributed in the hope that it will be useful,
+ but WITHOUT ANY WARRANTY; without even the implied warranty of
+ MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+ GNU General Public License for more details.
+
+ You should have received a copy of the GNU General Public License
+ along with this program.  If not, see <https://www.gnu.org/licenses/>.
+ """
+
+import sys
+import time
+
+'''
+    Trial onsets as absolute deadlines.
+    Each onset is planned from the previous *planned* onset, so time spent
+    recording, writing files or waiting for the event loop never adds up
+    into longer intervals than the protocol says.
+    Waits sleep and busy-wait only the last part. On Windows sleep() and
+    Event.wait() wake on the system timer, every ~15.6 ms by default; a
+    session asks for 1 ms ticks with begin_fine_timer() (timeBeginPeriod),
+    and the busy wait is never shorter than what the timer can oversleep.
+'''
+
+# the last part of the wait is a busy wait, sleeping is not precise enough
+SPIN_SEC = 0.002
+# Windows timer period asked for by begin_fine_timer() in ms
+TIMER_PERIOD_MS = 1
+# longest oversleep on Windows with the default timer and with TIMER_PERIOD_MS
+WINDOWS_TICK_SEC = 0.0156
+FINE_TICK_SEC = 0.002
+
+# begin_fine_timer() calls not ended yet
+_fine_timer_users = 0
+
+
+def timer_tick():
+    """
+    :return: how much sleep() may oversleep in s, 0 where it is precise
+    """
+    if sys.platform != "win32":
+        return 0.0
+    return FINE_TICK_SEC if _fine_timer_users else WINDOWS_TICK_SEC
+
+
+def begin_fine_timer():
+    """
+    asks Windows for TIMER_PERIOD_MS timer ticks until end_fine_timer(),
+    nothing to do on other systems
+    :return: True if the call has to be ended with end_fine_timer()
+    """
+    global _fine_timer_users
+    if sys.platform != "win32":
+        return False
+    import ctypes
+    try:
+        if ctypes.windll.winmm.timeBeginPeriod(TIMER_PERIOD_MS) != 0:
+            return False
+    except (AttributeError, OSError):
+        return False
+    _fine_timer_users += 1
+    return True
+
+
+def end_fine_timer():
+    global _fine_timer_users
+    if _fine_timer_users == 0:
+        return
+    import ctypes
+    ctypes.windll.winmm.timeEndPeriod(TIMER_PERIOD_MS)
+    _fine_timer_users -= 1
+
+
+def wait_until(deadline, stop=None, spin=SPIN_SEC):
+    """
+    blocks until time.perf_counter() reaches deadline
+    :param stop: optional threading.Event that ends the wait early
+    :param spin: the last spin s are a busy wait, at least timer_tick()
+    :return: how late we are in s (>= 0), None if stop was set
+    """
+    spin = max(spin, timer_tick())
+    while True:
+        if stop is not None and stop.is_set():
+            return None
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return -remaining
+        if remaining > spin:
+            if stop is None:
+                time.sleep(remaining - spin)
+            else:
+                stop.wait(remaining - spin)
+
+
+class TrialScheduler:
+    """
+    plans onsets on time.perf_counter() and keeps planned vs actual onsets
+    """
+    def __init__(self):
+        # time.perf_counter() at session start
+        self.start = None
+        # deadline of the next trial
+        self.next_onset = None
+        # (trial, planned, actual) in s from session start
+        self.onsets = []
+
+    def begin(self, first_delay, start=None):
+        """
+        starts the session, the first trial is due first_delay s after start
+        :param start: time.perf_counter() of the session start, default now
+        """
+        self.start = time.perf_counter() if start is None else start
+        self.next_onset = self.start + first_delay
+        self.onsets = []
+
+    def record_onset(self, actual):
+        """
+        :param actual: time.perf_counter() when the trial really started
+        :return: onset error in s (positive = late)
+        """
+        trial = len(self.onsets) + 1
+        planned = self.next_onset - self.start
+        self.onsets.append((trial, planned, actual - self.start))
+        return actual - self.next_onset
+
+    def advance(self, gap):
+        """
+        plans the next trial gap s after the planned onset of the last one
+        """
+        self.next_onset += gap
+
+    def jitter(self):
+        """
+        :return: (mean, max) absolute onset error in s
+        """
+        if not self.onsets:
+            return 0.0, 0.0
+        errors = [abs(actual - planned) for trial, planned, actual in self.onsets]
+        return sum(errors) / len(errors), max(errors)